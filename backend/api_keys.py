@@ -0,0 +1,97 @@
+import hmac
+import time
+import hashlib
+import secrets
+import threading
+from datetime import datetime
+
+from extensions import db
+from models.api_key import ApiKey
+from background import submit
+
+# Personal API keys look like fl_<prefix>_<secret>. The prefix is stored in
+# clear and indexed, the secret only as a SHA-256 hash, so checking a key is
+# one indexed lookup and one constant-time compare. Keys are sent as
+# "Authorization: Bearer fl_..." and are limited to their scopes.
+
+KEY_PREFIX = 'fl_'
+
+# Scopes are <resource>:<read|write>; resources follow the API's blueprints
+RESOURCES = {
+    'clients': 'clients',
+    'projects': 'projects',
+    'time_entries': 'time',
+    'invoices': 'invoices',
+    'documents': 'documents',
+    'search': 'search',
+    'portfolio': 'portfolio'
+}
+SCOPES = {f"{resource}:{action}" for resource in RESOURCES.values() for action in ('read', 'write')}
+READ_METHODS = {'GET', 'HEAD', 'OPTIONS'}
+
+# last_used_at is written at most this often per key
+LAST_USED_INTERVAL = 300
+
+_last_written = {}  # key id -> monotonic time of the last last_used_at write
+_lock = threading.Lock()
+
+def is_api_key(value):
+    return bool(value) and value.startswith(KEY_PREFIX)
+
+def _hash_secret(secret):
+    return hashlib.sha256(secret.encode('utf-8')).hexdigest()
+
+def create_api_key(user_id, name, scopes):
+    """Add a key for a user; returns (ApiKey, full key). The caller commits."""
+    prefix = secrets.token_hex(6)
+    secret = secrets.token_urlsafe(32)
+    api_key = ApiKey(
+        user_id=user_id,
+        name=name,
+        prefix=prefix,
+        key_hash=_hash_secret(secret),
+        scopes=' '.join(sorted(set(scopes)))
+    )
+    db.session.add(api_key)
+    return api_key, f"{KEY_PREFIX}{prefix}_{secret}"
+
+def verify_api_key(value):
+    """Return the ApiKey for a presented key, or None"""
+    prefix, _, secret = value[len(KEY_PREFIX):].partition('_')
+    if not prefix or not secret:
+        return None
+    api_key = ApiKey.query.filter_by(prefix=prefix).first()
+    if api_key is None or not hmac.compare_digest(api_key.key_hash, _hash_secret(secret)):
+        return None
+    return api_key
+
+def required_scope(blueprint, method):
+    """Scope needed for a request, or None for routes keys may not use at all"""
+    resource = RESOURCES.get(blueprint)
+    if resource is None:
+        return None
+    return f"{resource}:{'read' if method in READ_METHODS else 'write'}"
+
+def _write_last_used(app, key_id, used_at):
+    with app.app_context():
+        ApiKey.query.filter_by(id=key_id).update({ApiKey.last_used_at: used_at}, synchronize_session=False)
+        db.session.commit()
+
+def record_use(app, api_key):
+    """Note that a key was used; writes to the database at most every LAST_USED_INTERVAL"""
+    now = time.monotonic()
+    with _lock:
+        last = _last_written.get(api_key.id)
+        if last is None and api_key.last_used_at is not None:
+            # Another worker may have written it recently
+            age = (datetime.utcnow() - api_key.last_used_at).total_seconds()
+            last = now - age
+        if last is not None and now - last < LAST_USED_INTERVAL:
+            return False
+        _last_written[api_key.id] = now
+    submit(_write_last_used, app, api_key.id, datetime.utcnow())
+    return True
+
+def forget(key_id):
+    with _lock:
+        _last_written.pop(key_id, None)
@@ -1,10 +1,19 @@
 import os
 from flask import Flask, jsonify, request, make_response, send_from_directory
 from flask_cors import CORS
+from werkzeug.middleware.proxy_fix import ProxyFix
 from extensions import db, login_manager  # Import db from extensions
 from config import Config
 from error_handlers import register_error_handlers
+from database import init_database
 from auth_middleware import init_auth_middleware
+from search_index import init_search_index
+from background import init_background_tasks
+from profile_images import is_hashed_name
+from portfolio_snapshots import init_portfolio_snapshots
+from portfolio_analytics import init_portfolio_analytics
+from login_throttle import init_login_throttle
+from token_revocation import init_token_revocation
 
 import logging
 logging.getLogger().setLevel(logging.DEBUG)
@@ -12,7 +21,13 @@ logging.getLogger().setLevel(logging.DEBUG)
 def create_app(config_class=Config):
     app = Flask(__name__, static_folder='static', static_url_path='/static')
     app.config.from_object(config_class)
-    app.config['UPLOAD_FOLDER'] = 'static/uploads/profile_images'
+    app.static_folder = app.config.get('STATIC_FOLDER', app.static_folder)
+
+    # Behind a proxy every request comes from the proxy's address
+    trusted_proxies = app.config.get('TRUSTED_PROXIES', 0)
+    if trusted_proxies:
+        app.wsgi_app = ProxyFix(app.wsgi_app, x_for=trusted_proxies, x_proto=trusted_proxies,
+                                x_host=trusted_proxies)
 
     # CORS setup matching your frontend
     CORS(app, 
@@ -31,8 +46,15 @@ def create_app(config_class=Config):
 
     # Initialize extensions
     db.init_app(app)  # Initialize db with the app instance
+    init_database(app)
     login_manager.init_app(app)
     init_auth_middleware(app)
+    init_token_revocation(app)
+    init_login_throttle(app)
+    init_search_index(app)
+    init_background_tasks(app)
+    init_portfolio_snapshots(app)
+    init_portfolio_analytics(app)
     
     # Register auth blueprint
     try:
@@ -50,6 +72,7 @@ def create_app(config_class=Config):
     from routes.invoices import invoices_bp
     from routes.documents import documents_bp
     from routes.portfolio import portfolio_bp
+    from routes.search import search_bp
     
     app.register_blueprint(projects_bp, url_prefix='/api/projects')
     app.register_blueprint(clients_bp, url_prefix='/api/clients')
@@ -57,6 +80,7 @@ def create_app(config_class=Config):
     app.register_blueprint(invoices_bp, url_prefix='/api/invoices')
     app.register_blueprint(documents_bp, url_prefix='/api/documents')
     app.register_blueprint(portfolio_bp, url_prefix='/api/portfolio')
+    app.register_blueprint(search_bp, url_prefix='/api/search')
 
     register_error_handlers(app)
 
@@ -90,15 +114,19 @@ def create_app(config_class=Config):
     
     @app.route('/static/uploads/profile_images/<path:filename>')
     def serve_profile_image(filename):
-        directory = os.path.join(app.root_path, 'static/uploads/profile_images')
-        response = send_from_directory(directory, filename)
-        response.headers['Cache-Control'] = 'no-cache, no-store, must-revalidate'
-        response.headers['Pragma'] = 'no-cache'
-        response.headers['Expires'] = '0'
+        response = send_from_directory(app.config['UPLOAD_FOLDER'], filename)
+        if is_hashed_name(filename):
+            # Content-hashed names never change meaning, so cache them for good
+            response.headers['Cache-Control'] = 'public, max-age=31536000, immutable'
+        else:
+            response.headers['Cache-Control'] = 'no-cache, no-store, must-revalidate'
+            response.headers['Pragma'] = 'no-cache'
+            response.headers['Expires'] = '0'
         return response
 
     return app
 
 if __name__ == '__main__':
+    # Development server only; use `python run.py --env prod` in production
     app = create_app()
-    app.run(debug=True, host='localhost', port=5001)
\ No newline at end of file
+    app.run(debug=os.environ.get('FLASK_DEBUG') == '1', host='localhost', port=5001)
\ No newline at end of file
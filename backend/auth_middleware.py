@@ -1,58 +1,71 @@
 from flask import request, jsonify, current_app, g
-from flask_login import login_user, logout_user
 from werkzeug.local import LocalProxy
 from functools import wraps
 import jwt
+import uuid
+import hmac
+import base64
+import secrets
+import hashlib
 from datetime import datetime, timedelta
-from models.user import User
+from extensions import db
+from models.auth_token import RefreshToken
+from token_revocation import is_revoked, revoke
+from user_cache import get_user
+from api_keys import is_api_key, verify_api_key, required_scope, record_use
 import logging
 
 current_user = LocalProxy(lambda: g.get('_current_user', None))
 
+def _decode_token():
+    """Decode the bearer token once per request; returns its payload or None"""
+    if '_token_payload' in g:
+        return g._token_payload
+    
+    payload = None
+    auth_header = request.headers.get('Authorization')
+    if auth_header and auth_header.startswith('Bearer ') and not is_api_key(auth_header[7:]):
+        token = auth_header.split(' ')[1]
+        try:
+            # jwt.decode also rejects expired tokens
+            payload = jwt.decode(
+                token,
+                current_app.config.get('SECRET_KEY'),
+                algorithms=['HS256'],
+                options={'require': ['exp', 'jti']}
+            )
+            if is_revoked(payload['jti']):
+                logging.debug("Revoked token: %s", payload['jti'])
+                payload = None
+        except jwt.InvalidTokenError as e:
+            logging.debug("Invalid token: %s", e)
+    g._token_payload = payload
+    return payload
+
 def _get_current_user():
     """Get the current user from the JWT token in request header"""
-    auth_header = request.headers.get('Authorization')
-    if not auth_header or not auth_header.startswith('Bearer '):
-        logging.debug("No valid Authorization header found")
-        return None
-    
-    token = auth_header.split(' ')[1]
+    if '_current_user' in g:
+        return g._current_user
     
+    user = None
+    payload = _decode_token()
     try:
-        payload = jwt.decode(
-            token,
-            current_app.config.get('SECRET_KEY'),
-            algorithms=['HS256']
-        )
-        exp_timestamp = payload.get('exp')
-        if exp_timestamp and datetime.utcfromtimestamp(exp_timestamp) < datetime.utcnow():
-            logging.debug("Token expired")
-            return None
-        
-        user_id = payload.get('sub')
-        if user_id is None:
-            logging.debug("No user_id in token payload")
-            return None
-        
-        user = User.query.get(user_id)
-        if user:
-            logout_user()  # Clear any existing session
-            login_user(user)
-            g._current_user = user
-            logging.debug(f"Synced user from token: {user.username}")
-        else:
-            logging.debug(f"No user found for ID: {user_id}")
-        return user
-    except jwt.InvalidTokenError as e:
-        logging.debug(f"Invalid token: {str(e)}")
-        return None
+        user_id = int(payload['sub']) if payload else None
+    except (KeyError, TypeError, ValueError):
+        user_id = None
+    if user_id is not None:
+        user = get_user(user_id)
+    g._current_user = user
+    return user
 
-def generate_token(user_id):
-    """Generate a new JWT token for a user"""
+def generate_token(user_id, jti=None, issued_at=None):
+    """Generate a short-lived JWT access token for a user"""
+    now = issued_at or datetime.utcnow()
     payload = {
-        'exp': datetime.utcnow() + timedelta(days=1),
-        'iat': datetime.utcnow(),
-        'sub': user_id
+        'exp': now + timedelta(minutes=current_app.config.get('ACCESS_TOKEN_MINUTES', 15)),
+        'iat': now,
+        'sub': user_id,
+        'jti': jti or uuid.uuid4().hex
     }
     token = jwt.encode(
         payload,
@@ -61,6 +74,97 @@ def generate_token(user_id):
     )
     return token
 
+def _hash_refresh_token(refresh_token):
+    return hashlib.sha256(refresh_token.encode('utf-8')).hexdigest()
+
+def _successor_token(refresh_token):
+    """The refresh token that replaces this one, derived so a retry finds the same one"""
+    digest = hmac.new(current_app.config['SECRET_KEY'].encode('utf-8'),
+                      refresh_token.encode('utf-8'), hashlib.sha256).digest()
+    return base64.urlsafe_b64encode(digest).rstrip(b'=').decode('ascii')
+
+def issue_tokens(user_id, family_id=None, refresh_token=None):
+    """Create an access token and a new refresh token; the caller commits"""
+    access_jti = uuid.uuid4().hex
+    refresh_token = refresh_token or secrets.token_urlsafe(32)
+    db.session.add(RefreshToken(
+        user_id=user_id,
+        token_hash=_hash_refresh_token(refresh_token),
+        family_id=family_id or uuid.uuid4().hex,
+        access_jti=access_jti,
+        expires_at=datetime.utcnow() + timedelta(days=current_app.config.get('REFRESH_TOKEN_DAYS', 30))
+    ))
+    return {
+        'token': generate_token(user_id, access_jti),
+        'refresh_token': refresh_token,
+        'expires_in': current_app.config.get('ACCESS_TOKEN_MINUTES', 15) * 60
+    }
+
+def _access_expiry(issued_at):
+    return issued_at + timedelta(minutes=current_app.config.get('ACCESS_TOKEN_MINUTES', 15))
+
+def _revoke_refresh_tokens(query):
+    """Revoke refresh tokens and the access tokens that may still be live beside them"""
+    now = datetime.utcnow()
+    live_since = now - timedelta(minutes=current_app.config.get('ACCESS_TOKEN_MINUTES', 15))
+    for row in query.filter(RefreshToken.created_at > live_since):
+        revoke(row.access_jti, _access_expiry(row.created_at))
+    query.filter(RefreshToken.revoked_at.is_(None)).update(
+        {RefreshToken.revoked_at: now}, synchronize_session=False
+    )
+
+def rotate_refresh_token(refresh_token):
+    """Exchange a refresh token for a new token pair, or return None; the caller commits.
+    
+    Presenting a refresh token that was already rotated means it leaked, so
+    the whole login session is revoked. The exception is a repeat within
+    REFRESH_REUSE_GRACE_SECONDS while its successor is still live, e.g. two
+    browser tabs refreshing with the token they share: it gets the same
+    successor back.
+    """
+    row = RefreshToken.query.filter_by(token_hash=_hash_refresh_token(refresh_token or '')).first()
+    now = datetime.utcnow()
+    if row is None or row.expires_at <= now:
+        return None
+    
+    # Only one of several concurrent requests claims the token
+    successor_token = _successor_token(refresh_token)
+    claimed = RefreshToken.query.filter(
+        RefreshToken.id == row.id, RefreshToken.revoked_at.is_(None)
+    ).update({RefreshToken.revoked_at: now}, synchronize_session=False)
+    if claimed:
+        return issue_tokens(row.user_id, row.family_id, successor_token)
+    
+    revoked_at = db.session.query(RefreshToken.revoked_at).filter(RefreshToken.id == row.id).scalar()
+    successor = RefreshToken.query.filter_by(token_hash=_hash_refresh_token(successor_token)).first()
+    grace = timedelta(seconds=current_app.config.get('REFRESH_REUSE_GRACE_SECONDS', 10))
+    if (revoked_at is not None and revoked_at >= now - grace and successor is not None
+            and successor.revoked_at is None and successor.expires_at > now):
+        # Same access jti and expiry, so revoking the session still covers it
+        expires_at = _access_expiry(successor.created_at)
+        return {
+            'token': generate_token(successor.user_id, successor.access_jti, successor.created_at),
+            'refresh_token': successor_token,
+            'expires_in': max(int((expires_at - now).total_seconds()), 0)
+        }
+    
+    _revoke_refresh_tokens(RefreshToken.query.filter_by(family_id=row.family_id))
+    return None
+
+def revoke_current_session():
+    """End the login session of the current request's access token; the caller commits"""
+    payload = _decode_token()
+    if not payload:
+        return
+    revoke(payload.get('jti'), datetime.utcfromtimestamp(payload['exp']))
+    row = RefreshToken.query.filter_by(access_jti=payload.get('jti')).first()
+    if row is not None:
+        _revoke_refresh_tokens(RefreshToken.query.filter_by(family_id=row.family_id))
+
+def revoke_user_sessions(user_id):
+    """End every login session of a user, e.g. after a password change; the caller commits"""
+    _revoke_refresh_tokens(RefreshToken.query.filter_by(user_id=user_id))
+
 def jwt_required(f):
     """Decorator to protect routes with JWT authentication"""
     @wraps(f)
@@ -74,8 +178,44 @@ def jwt_required(f):
         return f(*args, **kwargs)
     return decorated
 
+def _authenticate_api_key(app, key):
+    """Resolve a personal API key and check its scope; returns an error response or None"""
+    api_key = verify_api_key(key)
+    user = get_user(api_key.user_id) if api_key else None
+    g._api_key = api_key
+    g._current_user = user
+    g._login_user = user if user is not None else app.login_manager.anonymous_user()
+    if user is None:
+        return None  # Anonymous; protected routes answer 401
+    
+    if request.blueprint is not None:
+        scope = required_scope(request.blueprint, request.method)
+        if scope is None:
+            return jsonify({"error": "API keys cannot be used for this endpoint"}), 403
+        if scope not in api_key.scope_list():
+            return jsonify({"error": f"API key lacks the '{scope}' scope"}), 403
+    
+    record_use(app, api_key)
+    return None
+
 def init_auth_middleware(app):
     """Initialize authentication middleware for the app"""
     @app.before_request
     def load_user():
-        g._current_user = _get_current_user()
\ No newline at end of file
+        # g can outlive a request when an app context is already pushed
+        g.pop('_token_payload', None)
+        g.pop('_current_user', None)
+        g.pop('_login_user', None)
+        g.pop('_api_key', None)
+        
+        auth_header = request.headers.get('Authorization', '')
+        if auth_header.startswith('Bearer ') and is_api_key(auth_header[7:]):
+            return _authenticate_api_key(app, auth_header[7:])
+        
+        user = _get_current_user()
+        # Requests with a bearer token are authenticated by the token alone:
+        # Flask-Login's current_user is set for this request only, so the
+        # session cookie is neither read nor rewritten. Requests without a
+        # token fall back to the cookie session set by the login route.
+        if request.headers.get('Authorization', '').startswith('Bearer '):
+            g._login_user = user if user is not None else app.login_manager.anonymous_user()
\ No newline at end of file
@@ -0,0 +1,32 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+# Shared worker pool for work that must not block a request, such as
+# thumbnail rendering and document text extraction. The pool is created
+# lazily so that each forked server worker gets its own threads.
+
+_executor = None
+_executor_lock = threading.Lock()
+_max_workers = 2
+
+def init_background_tasks(app):
+    """Read the worker pool size from the app config"""
+    global _max_workers
+    _max_workers = app.config.get('BACKGROUND_WORKERS', 2)
+
+def submit(fn, *args, **kwargs):
+    """Run fn(*args, **kwargs) on the background pool and return its Future"""
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=_max_workers, thread_name_prefix='background')
+        executor = _executor
+    return executor.submit(fn, *args, **kwargs)
+
+def shutdown_background_tasks(wait=True):
+    """Stop the worker pool, finishing queued tasks when wait is True"""
+    global _executor
+    with _executor_lock:
+        executor, _executor = _executor, None
+    if executor is not None:
+        executor.shutdown(wait=wait)
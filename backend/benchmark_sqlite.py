@@ -0,0 +1,118 @@
+import os
+import time
+import random
+import tempfile
+import argparse
+import multiprocessing
+from sqlalchemy import create_engine, event, text
+from sqlalchemy.exc import OperationalError
+
+from config import ProductionConfig
+from database import set_sqlite_pragmas
+from extensions import db
+import models.init  # noqa: F401  registers every table on db.metadata
+
+# Mixed read/write load against a SQLite file from several processes, the
+# way gunicorn workers share instance/freelance.db. Compares SQLite's
+# defaults (rollback journal, no busy timeout) with ProductionConfig.
+#
+# The tables and indexes are created from the app's models, and the read is
+# the hours-by-project query of the time entry summary.
+
+USERS = 50
+PROJECTS_PER_USER = 10
+PROJECTS = USERS * PROJECTS_PER_USER
+
+READ_SQL = text("""
+    SELECT p.id, p.title, SUM(t.hours)
+    FROM project p JOIN time_entry t ON t.project_id = p.id
+    WHERE p.user_id = :user_id AND t.date >= date('now', '-30 days') AND t.date <= date('now')
+    GROUP BY p.id
+""")
+WRITE_SQL = text("""
+    INSERT INTO time_entry (project_id, description, date, hours, billable, invoiced, created_at)
+    VALUES (:project_id, 'benchmark entry', date('now', :days_ago), :hours, :billable, 0, datetime('now'))
+""")
+
+def _entry(hours):
+    return {
+        'project_id': random.randint(1, PROJECTS),
+        'days_ago': f"-{random.randint(0, 90)} days",
+        'hours': hours,
+        'billable': random.random() < 0.8
+    }
+
+def _engine(path, pragmas):
+    engine = create_engine(f"sqlite:///{path}")
+    if pragmas:
+        event.listen(engine, 'connect', lambda conn, record: set_sqlite_pragmas(conn, pragmas))
+    return engine
+
+def _prepare(path, pragmas):
+    engine = _engine(path, pragmas)
+    db.metadata.create_all(engine)
+    with engine.begin() as conn:
+        conn.execute(text("""
+            INSERT INTO user (id, username, email, portfolio_version) VALUES (:id, :username, :email, 0)
+        """), [{'id': user_id, 'username': f"user{user_id}", 'email': f"user{user_id}@example.com"}
+               for user_id in range(1, USERS + 1)])
+        conn.execute(text("INSERT INTO client (id, user_id, name) VALUES (:id, :id, :name)"), [
+            {'id': user_id, 'name': f"Client {user_id}"} for user_id in range(1, USERS + 1)
+        ])
+        conn.execute(text("""
+            INSERT INTO project (user_id, client_id, title) VALUES (:user_id, :user_id, :title)
+        """), [{'user_id': user_id, 'title': f"Project {user_id}-{n}"}
+               for user_id in range(1, USERS + 1) for n in range(PROJECTS_PER_USER)])
+        conn.execute(WRITE_SQL, [_entry(1.5) for _ in range(20000)])
+    engine.dispose()
+
+def _worker(path, pragmas, seconds, write_ratio, results):
+    engine = _engine(path, pragmas)
+    reads = writes = errors = 0
+    deadline = time.monotonic() + seconds
+    while time.monotonic() < deadline:
+        try:
+            if random.random() < write_ratio:
+                with engine.begin() as conn:
+                    conn.execute(WRITE_SQL, _entry(0.5))
+                writes += 1
+            else:
+                with engine.connect() as conn:
+                    conn.execute(READ_SQL, {'user_id': random.randint(1, USERS)}).fetchall()
+                reads += 1
+        except OperationalError:
+            errors += 1  # "database is locked"
+    results.put((reads, writes, errors))
+
+def run(pragmas, workers, seconds, write_ratio):
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'bench.db')
+        _prepare(path, pragmas)
+        results = multiprocessing.Queue()
+        processes = [
+            multiprocessing.Process(target=_worker, args=(path, pragmas, seconds, write_ratio, results))
+            for _ in range(workers)
+        ]
+        for process in processes:
+            process.start()
+        totals = [results.get() for _ in processes]
+        for process in processes:
+            process.join()
+    reads, writes, errors = (sum(column) for column in zip(*totals))
+    return {
+        'reads_per_second': reads / seconds,
+        'writes_per_second': writes / seconds,
+        'locked_errors': errors
+    }
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Compare SQLite throughput with and without the production PRAGMAs')
+    parser.add_argument('--workers', type=int, default=4, help='Concurrent processes (default: 4)')
+    parser.add_argument('--seconds', type=float, default=10, help='Duration of each run (default: 10)')
+    parser.add_argument('--write-ratio', type=float, default=0.2, help='Share of writes (default: 0.2)')
+    args = parser.parse_args()
+    
+    for label, pragmas in (('SQLite defaults', {}), ('ProductionConfig', ProductionConfig.SQLITE_PRAGMAS)):
+        result = run(pragmas, args.workers, args.seconds, args.write_ratio)
+        print(f"{label:18} reads/s {result['reads_per_second']:9.0f}  "
+              f"writes/s {result['writes_per_second']:8.0f}  locked errors {result['locked_errors']}")
@@ -0,0 +1,163 @@
+import io
+import csv
+from datetime import datetime
+from sqlalchemy import insert
+
+from extensions import db
+from models.client import Client
+from search_index import index_rows
+
+# Rows are written in chunks of this size, one multi-row INSERT per chunk
+CHUNK_SIZE = 500
+
+# Errors beyond this many are counted but not itemised in the response
+MAX_REPORTED_ERRORS = 100
+
+CLIENT_FIELDS = ('name', 'email', 'phone', 'company', 'address', 'notes')
+
+CSV_HEADER_ALIASES = {
+    'full name': 'name',
+    'fn': 'name',
+    'e-mail': 'email',
+    'email address': 'email',
+    'telephone': 'phone',
+    'phone number': 'phone',
+    'organization': 'company',
+    'organisation': 'company',
+    'org': 'company',
+    'note': 'notes'
+}
+
+MAX_LENGTHS = {'name': 100, 'email': 120, 'phone': 20, 'company': 100}
+
+def parse_csv(stream):
+    """Yield (line_number, record) pairs from a CSV file with a header row"""
+    text_stream = io.TextIOWrapper(stream, encoding='utf-8-sig', newline='')
+    reader = csv.reader(text_stream)
+    header = next(reader, None)
+    if header is None:
+        return
+    columns = [CSV_HEADER_ALIASES.get(h.strip().lower(), h.strip().lower()) for h in header]
+
+    for row in reader:
+        if not any(cell.strip() for cell in row):
+            continue
+        record = {}
+        for column, value in zip(columns, row):
+            if column in CLIENT_FIELDS and value.strip():
+                record[column] = value.strip()
+        yield reader.line_num, record
+
+def _unescape_vcard(value):
+    return (value.replace('\\n', '\n').replace('\\N', '\n')
+            .replace('\\,', ',').replace('\\;', ';').replace('\\\\', '\\'))
+
+def _unfold(lines):
+    """Join vCard continuation lines (RFC 6350 folding) onto their parent line"""
+    current = None
+    for line_number, line in enumerate(lines, start=1):
+        line = line.rstrip('\r\n')
+        if line[:1] in (' ', '\t') and current is not None:
+            current = (current[0], current[1] + line[1:])
+            continue
+        if current is not None:
+            yield current
+        current = (line_number, line)
+    if current is not None:
+        yield current
+
+def parse_vcard(stream):
+    """Yield (line_number, record) pairs, one per BEGIN:VCARD ... END:VCARD block"""
+    text_stream = io.TextIOWrapper(stream, encoding='utf-8-sig')
+    record = None
+    start_line = None
+
+    for line_number, line in _unfold(text_stream):
+        if ':' not in line:
+            continue
+        key, value = line.split(':', 1)
+        prop = key.split(';', 1)[0].split('.')[-1].upper()
+
+        if prop == 'BEGIN' and value.strip().upper() == 'VCARD':
+            record = {}
+            start_line = line_number
+        elif prop == 'END' and value.strip().upper() == 'VCARD':
+            if record is not None:
+                yield start_line, record
+            record = None
+        elif record is None:
+            continue
+        elif prop == 'FN':
+            record['name'] = _unescape_vcard(value).strip()
+        elif prop == 'N' and 'name' not in record:
+            parts = [_unescape_vcard(p).strip() for p in value.split(';')]
+            given = parts[1] if len(parts) > 1 else ''
+            record['name'] = f"{given} {parts[0]}".strip()
+        elif prop == 'EMAIL' and 'email' not in record:
+            record['email'] = value.strip()
+        elif prop == 'TEL' and 'phone' not in record:
+            record['phone'] = value.strip()
+        elif prop == 'ORG':
+            record['company'] = _unescape_vcard(value.split(';')[0]).strip()
+        elif prop == 'ADR' and 'address' not in record:
+            parts = [_unescape_vcard(p).strip() for p in value.split(';')]
+            record['address'] = ', '.join(p for p in parts if p)
+        elif prop == 'NOTE':
+            record['notes'] = _unescape_vcard(value).strip()
+
+def _validate(record):
+    if not record.get('name'):
+        return "Client name is required"
+    for field, max_length in MAX_LENGTHS.items():
+        if len(record.get(field) or '') > max_length:
+            return f"{field} is longer than {max_length} characters"
+    return None
+
+def import_clients(user_id, records, dry_run=False):
+    """Insert parsed records for a user, skipping emails that already exist"""
+    # One lookup for every existing email of this user
+    existing_emails = {
+        email.lower() for (email,) in db.session.query(Client.email).filter(
+            Client.user_id == user_id,
+            Client.email.isnot(None),
+            Client.email != ''
+        )
+    }
+
+    result = {'created': 0, 'skipped': 0, 'errors': 0, 'error_details': []}
+    chunk = []
+
+    def flush():
+        if not dry_run and chunk:
+            ids = db.session.scalars(insert(Client).returning(Client.id), chunk).all()
+            index_rows('client', ids)
+        result['created'] += len(chunk)
+        chunk.clear()
+
+    now = datetime.utcnow()
+    for line_number, record in records:
+        error = _validate(record)
+        if error:
+            result['errors'] += 1
+            if len(result['error_details']) < MAX_REPORTED_ERRORS:
+                result['error_details'].append({'line': line_number, 'error': error})
+            continue
+
+        email = (record.get('email') or '').lower()
+        if email and email in existing_emails:
+            result['skipped'] += 1
+            continue
+        if email:
+            existing_emails.add(email)
+
+        row = {field: record.get(field, '') for field in CLIENT_FIELDS}
+        row['user_id'] = user_id
+        row['created_at'] = now
+        chunk.append(row)
+        if len(chunk) >= CHUNK_SIZE:
+            flush()
+
+    flush()
+    if not dry_run:
+        db.session.commit()
+    return result
@@ -15,10 +15,95 @@ os.makedirs(INSTANCE_DIR, exist_ok=True)
 UPLOADS_DIR = os.path.join(BASE_DIR, 'static', 'uploads')
 os.makedirs(UPLOADS_DIR, exist_ok=True)
 
+def database_url():
+    """DATABASE_URL if set (SQLite or PostgreSQL), else the SQLite file in instance/"""
+    url = os.environ.get('DATABASE_URL') or 'sqlite:///' + os.path.join(INSTANCE_DIR, 'freelance.db')
+    # Many hosts still hand out the postgres:// scheme, which SQLAlchemy rejects
+    if url.startswith('postgres://'):
+        url = 'postgresql://' + url[len('postgres://'):]
+    return url
+
 class Config:
     SECRET_KEY = os.environ.get('SECRET_KEY') or 'dev-key-please-change'
-    SQLALCHEMY_DATABASE_URI = os.environ.get('DATABASE_URL') or \
-        'sqlite:///' + os.path.join(INSTANCE_DIR, 'freelance.db')
+    SQLALCHEMY_DATABASE_URI = database_url()
     SQLALCHEMY_TRACK_MODIFICATIONS = False
-    UPLOAD_FOLDER = UPLOADS_DIR
+    # Served at /static; portfolio snapshots are written to its portfolios/ folder
+    STATIC_FOLDER = os.path.join(BASE_DIR, 'static')
+    # Profile images, and documents in its documents/ subfolder
+    UPLOAD_FOLDER = os.path.join(UPLOADS_DIR, 'profile_images')
     MAX_CONTENT_LENGTH = 16 * 1024 * 1024  # 16MB max upload size
+    # Chunked document uploads: each chunk request stays under MAX_CONTENT_LENGTH
+    UPLOAD_CHUNK_SIZE = 8 * 1024 * 1024  # 8MB recommended chunk size
+    MAX_DOCUMENT_SIZE = 2 * 1024 * 1024 * 1024  # 2GB max assembled document
+    # Upload sessions idle this long are refused and removed by the orphan GC
+    UPLOAD_SESSION_TTL_HOURS = int(os.environ.get('UPLOAD_SESSION_TTL_HOURS', 24))
+    # Offload document downloads to a front proxy once ownership is checked:
+    # DOCUMENT_ACCEL_REDIRECT_PREFIX names an nginx `internal` location that
+    # maps to UPLOAD_FOLDER/documents; USE_X_SENDFILE sends X-Sendfile instead.
+    DOCUMENT_ACCEL_REDIRECT_PREFIX = os.environ.get('DOCUMENT_ACCEL_REDIRECT_PREFIX')
+    USE_X_SENDFILE = os.environ.get('USE_X_SENDFILE', '').lower() == 'true'
+    # Access tokens are short-lived; clients renew them with a refresh token
+    ACCESS_TOKEN_MINUTES = int(os.environ.get('ACCESS_TOKEN_MINUTES', 15))
+    REFRESH_TOKEN_DAYS = int(os.environ.get('REFRESH_TOKEN_DAYS', 30))
+    # A rotated refresh token presented again this soon (another tab sharing
+    # it) gets the same successor instead of ending the session as reused
+    REFRESH_REUSE_GRACE_SECONDS = int(os.environ.get('REFRESH_REUSE_GRACE_SECONDS', 10))
+    # Login attempts allowed per username and per client IP in each window;
+    # set LOGIN_THROTTLE_FILE to share the counts between server workers
+    LOGIN_ATTEMPTS_PER_USER = int(os.environ.get('LOGIN_ATTEMPTS_PER_USER', 5))
+    LOGIN_ATTEMPTS_PER_IP = int(os.environ.get('LOGIN_ATTEMPTS_PER_IP', 20))
+    LOGIN_THROTTLE_WINDOW = int(os.environ.get('LOGIN_THROTTLE_WINDOW', 300))
+    LOGIN_THROTTLE_FILE = os.environ.get('LOGIN_THROTTLE_FILE')
+    # Number of reverse proxies (nginx, a load balancer) in front of the app.
+    # Their X-Forwarded-* headers are trusted so that request.remote_addr,
+    # which keys the per-IP login limit, is the client and not the proxy.
+    TRUSTED_PROXIES = int(os.environ.get('TRUSTED_PROXIES', 0))
+    # Threads for thumbnails and document text extraction
+    BACKGROUND_WORKERS = int(os.environ.get('BACKGROUND_WORKERS', 2))
+    # Write static portfolio snapshots after changes commit
+    PORTFOLIO_SNAPSHOTS_ENABLED = os.environ.get('PORTFOLIO_SNAPSHOTS_ENABLED', 'true').lower() == 'true'
+    # Seconds between writes of buffered portfolio view counts
+    PORTFOLIO_VIEW_FLUSH_SECONDS = int(os.environ.get('PORTFOLIO_VIEW_FLUSH_SECONDS', 30))
+    # PRAGMAs run on every new SQLite connection (see database.py). With
+    # foreign_keys on, SQLite enforces references the way PostgreSQL does:
+    # project deletes rely on the ORM cascades on Project and Invoice, and
+    # clients with projects are refused by the route.
+    SQLITE_PRAGMAS = {
+        'foreign_keys': 'ON',
+        'busy_timeout': 5000  # ms to wait for a lock before "database is locked"
+    }
+
+class DevelopmentConfig(Config):
+    DEBUG = True
+
+class TestingConfig(Config):
+    TESTING = True
+
+class ProductionConfig(Config):
+    DEBUG = False
+    # WAL lets readers run while one worker writes; synchronous=NORMAL is
+    # durable across application crashes and only risks the last commits
+    # on power loss. mmap and a larger page cache cut read syscalls.
+    SQLITE_PRAGMAS = {
+        'journal_mode': 'WAL',
+        'synchronous': 'NORMAL',
+        'busy_timeout': 5000,
+        'mmap_size': 256 * 1024 * 1024,
+        'cache_size': -64000,  # negative means KiB: about 64MB per connection
+        'foreign_keys': 'ON'
+    }
+    # QueuePool settings per worker process; with PostgreSQL keep
+    # workers * (pool_size + max_overflow) under the server's max_connections
+    SQLALCHEMY_ENGINE_OPTIONS = {
+        'pool_size': int(os.environ.get('DB_POOL_SIZE', 10)),
+        'max_overflow': int(os.environ.get('DB_MAX_OVERFLOW', 5)),
+        'pool_timeout': int(os.environ.get('DB_POOL_TIMEOUT', 30)),
+        'pool_recycle': 3600,
+        'pool_pre_ping': True
+    }
+
+config_by_name = {
+    'dev': DevelopmentConfig,
+    'test': TestingConfig,
+    'prod': ProductionConfig
+}
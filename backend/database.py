@@ -0,0 +1,27 @@
+from sqlalchemy import event
+
+from extensions import db
+
+# Connection setup for SQLite: the PRAGMAs in SQLITE_PRAGMAS are per
+# connection (journal_mode=WAL is also stored in the database file), so
+# they are applied whenever the pool opens a new connection.
+
+def set_sqlite_pragmas(dbapi_connection, pragmas):
+    cursor = dbapi_connection.cursor()
+    try:
+        for name, value in pragmas.items():
+            cursor.execute(f"PRAGMA {name}={value}")
+    finally:
+        cursor.close()
+
+def init_database(app):
+    """Apply the configured SQLite PRAGMAs to every pooled connection"""
+    pragmas = app.config.get('SQLITE_PRAGMAS') or {}
+    with app.app_context():
+        engine = db.engine
+    if engine.dialect.name != 'sqlite' or not pragmas:
+        return
+    
+    @event.listens_for(engine, 'connect')
+    def on_connect(dbapi_connection, connection_record):
+        set_sqlite_pragmas(dbapi_connection, pragmas)
@@ -0,0 +1,333 @@
+import os
+import time
+import uuid
+import fcntl
+import hashlib
+import logging
+import threading
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from flask import current_app
+
+from extensions import db
+from thumbnails import thumbnail_path
+
+# Document files are stored once per distinct content, named by the SHA-256
+# of their bytes. Document rows sharing content point at the same blob, and
+# the blob is removed when the last of those rows is deleted. Blobs are
+# sharded two levels deep by hash prefix (blobs/ab/cd/abcd...) so that no
+# single directory grows past a few hundred entries.
+#
+# Reusing a blob and removing it race: an upload can find the blob present
+# just before the last other row is deleted. Both therefore run under
+# blob_lock(), and an upload keeps holding it until its row commits, so the
+# reference count seen by release_file() always includes it. Only that short
+# step is serialised; the upload body is streamed and hashed outside the lock.
+
+COPY_BUFFER_SIZE = 64 * 1024
+
+# Rows and directory entries are reconciled in batches of this size
+BATCH_SIZE = 500
+
+# Files younger than this are never treated as orphans: an upload writes its
+# blob before the Document row is committed.
+ORPHAN_MIN_AGE_SECONDS = 60 * 60
+
+def documents_dir():
+    path = os.path.join(current_app.config['UPLOAD_FOLDER'], 'documents')
+    os.makedirs(path, exist_ok=True)
+    return path
+
+def blob_path(content_hash):
+    """Sharded path of the blob for a content hash"""
+    return os.path.join(documents_dir(), 'blobs', content_hash[:2], content_hash[2:4], content_hash)
+
+LOCK_NAME = '.lock'
+
+_thread_lock = threading.Lock()
+
+@contextmanager
+def blob_lock():
+    """Serialise blob commits and releases across threads and server workers"""
+    lock_path = os.path.join(documents_dir(), 'blobs', LOCK_NAME)
+    os.makedirs(os.path.dirname(lock_path), exist_ok=True)
+    with _thread_lock, open(lock_path, 'a') as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+def commit_blob(temp_path, content_hash):
+    """Move a staged file into place, or drop it if the blob exists
+
+    Call inside blob_lock() and commit the Document row referencing the
+    returned path before leaving it.
+    """
+    path = blob_path(content_hash)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    if os.path.exists(path):
+        os.remove(temp_path)
+    else:
+        os.replace(temp_path, path)
+    return path
+
+def stage_stream(stream):
+    """Copy a stream to a temp file in blob storage, hashing it on the way through
+
+    Returns (temp_path, content_hash, size); pass temp_path to commit_blob().
+    """
+    temp_dir = os.path.join(documents_dir(), '.partial')
+    os.makedirs(temp_dir, exist_ok=True)
+    temp_path = os.path.join(temp_dir, f"{uuid.uuid4().hex}.tmp")
+
+    digest = hashlib.sha256()
+    size = 0
+    try:
+        with open(temp_path, 'wb') as out:
+            while True:
+                chunk = stream.read(COPY_BUFFER_SIZE)
+                if not chunk:
+                    break
+                digest.update(chunk)
+                out.write(chunk)
+                size += len(chunk)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+
+    return temp_path, digest.hexdigest(), size
+
+def stage_file(temp_path):
+    """Hash an already written file (e.g. an assembled chunked upload)
+
+    Returns (temp_path, content_hash, size); pass temp_path to commit_blob().
+    """
+    return temp_path, _hash_file(temp_path), os.path.getsize(temp_path)
+
+def _hash_file(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(COPY_BUFFER_SIZE), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def release_file(file_path):
+    """Remove a stored file once no Document row references it any more"""
+    from models.document import Document
+
+    with blob_lock():
+        references = db.session.query(Document.id).filter(Document.file_path == file_path).count()
+        if references:
+            return False
+
+        try:
+            for path in (file_path, thumbnail_path(file_path)):
+                if os.path.exists(path):
+                    os.remove(path)
+            return True
+        except OSError as e:
+            logging.error(f"Error deleting file {file_path}: {e}")
+            return False
+
+def upload_expiry_cutoff():
+    """Upload sessions last updated before this have expired"""
+    return datetime.utcnow() - timedelta(hours=current_app.config['UPLOAD_SESSION_TTL_HOURS'])
+
+def upload_expired(upload):
+    return upload.updated_at < upload_expiry_cutoff()
+
+def _iter_document_batches(*columns):
+    """Yield batches of Document rows using keyset pagination on id"""
+    from models.document import Document
+
+    last_id = 0
+    while True:
+        rows = db.session.query(Document.id, *columns).filter(
+            Document.id > last_id
+        ).order_by(Document.id).limit(BATCH_SIZE).all()
+        if not rows:
+            return
+        yield rows
+        last_id = rows[-1].id
+
+def migrate_to_sharded_layout():
+    """Move every document file to its sharded, content-addressed blob path"""
+    from models.document import Document
+
+    stats = {'moved': 0, 'already_sharded': 0, 'missing': 0}
+    left_behind = set()
+
+    for rows in _iter_document_batches(Document.file_path, Document.content_hash):
+        for row in rows:
+            if row.content_hash and row.file_path == blob_path(row.content_hash):
+                stats['already_sharded'] += 1
+                continue
+
+            if os.path.isfile(row.file_path):
+                content_hash = row.content_hash or _hash_file(row.file_path)
+                target = blob_path(content_hash)
+                os.makedirs(os.path.dirname(target), exist_ok=True)
+                if os.path.exists(target):
+                    # Same content already stored; other rows may still point at
+                    # this copy, so it is released once every row has moved
+                    left_behind.add(row.file_path)
+                else:
+                    os.replace(row.file_path, target)
+                    if os.path.exists(thumbnail_path(row.file_path)):
+                        os.replace(thumbnail_path(row.file_path), thumbnail_path(target))
+            elif row.content_hash and os.path.isfile(blob_path(row.content_hash)):
+                # A shared blob that an earlier row already moved
+                content_hash = row.content_hash
+                target = blob_path(content_hash)
+            else:
+                stats['missing'] += 1
+                continue
+
+            db.session.query(Document).filter(Document.id == row.id).update(
+                {'file_path': target, 'content_hash': content_hash},
+                synchronize_session=False
+            )
+            stats['moved'] += 1
+        db.session.commit()
+
+    stats['duplicates_removed'] = sum(1 for path in left_behind if release_file(path))
+    return stats
+
+def _iter_stored_files(root):
+    """Walk the documents directory without building the full listing in memory"""
+    stack = [root]
+    while stack:
+        directory = stack.pop()
+        try:
+            with os.scandir(directory) as entries:
+                for entry in entries:
+                    if entry.is_dir(follow_symlinks=False):
+                        stack.append(entry.path)
+                    elif entry.is_file(follow_symlinks=False):
+                        yield entry
+        except FileNotFoundError:
+            continue
+
+def _check_orphan_batch(batch, delete, stats):
+    from models.document import Document
+
+    # An upload may reuse a blob that looks orphaned, so references are read
+    # and files removed under blob_lock(), like release_file(). The upload
+    # commits its row before leaving the lock, and so is either seen here or
+    # finds the blob gone and stores it again.
+    with blob_lock():
+        candidate_paths = {path for path, _ in batch}
+        referenced = {
+            path for (path,) in db.session.query(Document.file_path).filter(
+                Document.file_path.in_(candidate_paths)
+            )
+        }
+
+        for path, original_path in batch:
+            if path in referenced:
+                continue
+            stats['orphans'] += 1
+            stats['orphan_bytes'] += os.path.getsize(original_path) if os.path.exists(original_path) else 0
+            if len(stats['orphan_files']) < 100:
+                stats['orphan_files'].append(original_path)
+            if delete:
+                try:
+                    os.remove(original_path)
+                except OSError as e:
+                    logging.error(f"Error deleting orphan {original_path}: {e}")
+
+def collect_orphans(delete=False, min_age_seconds=ORPHAN_MIN_AGE_SECONDS):
+    """Reconcile stored files against Document.file_path and report or remove orphans
+
+    Files are checked in batches with one indexed IN lookup per batch.
+    Thumbnails are checked through the file they belong to, and partial
+    uploads through their upload session. Expired upload sessions count as
+    orphans along with their partial file, and are deleted with it.
+    """
+    from models.document import DocumentUpload
+
+    root = documents_dir()
+    partial_dir = os.path.join(root, '.partial')
+    lock_path = os.path.join(root, 'blobs', LOCK_NAME)
+    cutoff = time.time() - min_age_seconds
+    stats = {'scanned': 0, 'orphans': 0, 'orphan_bytes': 0, 'orphan_files': [], 'deleted': delete}
+    batch = []
+
+    # The upload routes refuse expired sessions, so none can resume meanwhile
+    expired_uploads = {
+        upload_id for (upload_id,) in db.session.query(DocumentUpload.id).filter(
+            DocumentUpload.updated_at < upload_expiry_cutoff()
+        )
+    }
+    stats['expired_uploads'] = len(expired_uploads)
+
+    for entry in _iter_stored_files(root):
+        if entry.path == lock_path:
+            continue
+        stats['scanned'] += 1
+        if entry.stat(follow_symlinks=False).st_mtime > cutoff:
+            continue
+
+        if os.path.dirname(entry.path) == partial_dir:
+            upload_id = entry.name.split('.', 1)[0]
+            if (entry.name.endswith('.part') and upload_id not in expired_uploads
+                    and db.session.get(DocumentUpload, upload_id)):
+                continue
+            stats['orphans'] += 1
+            stats['orphan_bytes'] += entry.stat().st_size
+            if delete:
+                os.remove(entry.path)
+            continue
+
+        owner_path = entry.path[:-len('.thumb.jpg')] if entry.name.endswith('.thumb.jpg') else entry.path
+        batch.append((owner_path, entry.path))
+        if len(batch) >= BATCH_SIZE:
+            _check_orphan_batch(batch, delete, stats)
+            batch = []
+
+    if batch:
+        _check_orphan_batch(batch, delete, stats)
+
+    if delete and expired_uploads:
+        expired_ids = list(expired_uploads)
+        for start in range(0, len(expired_ids), BATCH_SIZE):
+            db.session.query(DocumentUpload).filter(
+                DocumentUpload.id.in_(expired_ids[start:start + BATCH_SIZE])
+            ).delete(synchronize_session=False)
+        db.session.commit()
+
+    # Rows whose file has disappeared are reported, never deleted
+    from models.document import Document
+    stats['missing_files'] = 0
+    stats['missing_document_ids'] = []
+    for rows in _iter_document_batches(Document.file_path):
+        for row in rows:
+            if not os.path.isfile(row.file_path):
+                stats['missing_files'] += 1
+                if len(stats['missing_document_ids']) < 100:
+                    stats['missing_document_ids'].append(row.id)
+    return stats
+
+if __name__ == "__main__":
+    import argparse
+    import json
+    from app import create_app
+
+    parser = argparse.ArgumentParser(description='Maintain stored document files')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    subparsers.add_parser('migrate', help='Move files into the sharded content-addressed layout')
+    gc_parser = subparsers.add_parser('gc', help='Report (or remove) files not referenced by any document')
+    gc_parser.add_argument('--delete', action='store_true', help='Remove orphaned files instead of only reporting them')
+    gc_parser.add_argument('--min-age', type=int, default=ORPHAN_MIN_AGE_SECONDS,
+                           help='Ignore files modified within this many seconds (default: 3600)')
+    args = parser.parse_args()
+
+    app = create_app()
+    with app.app_context():
+        if args.command == 'migrate':
+            result = migrate_to_sharded_layout()
+        else:
+            result = collect_orphans(delete=args.delete, min_age_seconds=args.min_age)
+        print(json.dumps(result, indent=2))
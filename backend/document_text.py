@@ -0,0 +1,108 @@
+import re
+import shutil
+import logging
+import zipfile
+import subprocess
+from xml.etree import ElementTree
+
+from background import submit
+from search_index import store_document_text, documents_pending_extraction
+
+# Text is pulled out of uploaded documents on the background pool and
+# written to the document_content FTS table, so uploads never wait on it.
+
+# Only this much text per document is indexed
+MAX_TEXT_CHARS = 2 * 1024 * 1024
+
+EXTRACTABLE_TYPES = {'txt', 'pdf', 'docx'}
+
+_WORD_NS = '{http://schemas.openxmlformats.org/wordprocessingml/2006/main}'
+
+def _extract_txt(file_path):
+    with open(file_path, 'rb') as f:
+        data = f.read(MAX_TEXT_CHARS * 4)
+    for encoding in ('utf-8', 'cp1252'):
+        try:
+            return data.decode(encoding)
+        except UnicodeDecodeError:
+            continue
+    return data.decode('utf-8', errors='ignore')
+
+def _extract_docx(file_path):
+    """Collect paragraph text from word/document.xml without loading it all as a tree"""
+    paragraphs = []
+    current = []
+    with zipfile.ZipFile(file_path) as archive:
+        with archive.open('word/document.xml') as xml:
+            for event, element in ElementTree.iterparse(xml, events=('end',)):
+                if element.tag == f'{_WORD_NS}t' and element.text:
+                    current.append(element.text)
+                elif element.tag == f'{_WORD_NS}tab':
+                    current.append('\t')
+                elif element.tag == f'{_WORD_NS}p':
+                    paragraphs.append(''.join(current))
+                    current = []
+                    element.clear()
+    return '\n'.join(paragraphs)
+
+def _extract_pdf(file_path):
+    """Use poppler's pdftotext when it is installed"""
+    if shutil.which('pdftotext') is None:
+        logging.debug("pdftotext not installed; skipping PDF text extraction")
+        return ''
+    result = subprocess.run(
+        ['pdftotext', '-enc', 'UTF-8', '-q', file_path, '-'],
+        check=True, timeout=60, capture_output=True
+    )
+    return result.stdout.decode('utf-8', errors='ignore')
+
+_EXTRACTORS = {
+    'txt': _extract_txt,
+    'docx': _extract_docx,
+    'pdf': _extract_pdf
+}
+
+def extract_text(file_path, file_type):
+    """Return the plain text of a document, or '' when it can't be extracted"""
+    extractor = _EXTRACTORS.get((file_type or '').lower())
+    if extractor is None:
+        return ''
+    try:
+        text = extractor(file_path)
+    except Exception as e:
+        logging.warning(f"Text extraction failed for {file_path}: {e}")
+        return ''
+    return re.sub(r'[ \t]+', ' ', text)[:MAX_TEXT_CHARS]
+
+def index_document_text(app, document_id, file_path, file_type):
+    """Extract and store one document's text; runs on the background pool"""
+    text = extract_text(file_path, file_type)
+    with app.app_context():
+        store_document_text(document_id, text)
+
+def schedule_text_extraction(app, document):
+    """Queue text extraction for a newly stored document"""
+    if (document.file_type or '').lower() not in EXTRACTABLE_TYPES:
+        return None
+    return submit(index_document_text, app, document.id, document.file_path, document.file_type)
+
+def backfill_document_text():
+    """Extract text for every document that hasn't been indexed yet"""
+    indexed = 0
+    after_id = 0
+    while True:
+        rows = documents_pending_extraction(after_id)
+        if not rows:
+            return indexed
+        for row in rows:
+            store_document_text(row.id, extract_text(row.file_path, row.file_type))
+            indexed += 1
+        after_id = rows[-1].id
+
+if __name__ == "__main__":
+    from app import create_app
+
+    app = create_app()
+    with app.app_context():
+        count = backfill_document_text()
+        print(f"Indexed text for {count} documents.")
@@ -0,0 +1,134 @@
+import os
+import json
+import math
+import time
+import fcntl
+import threading
+from collections import OrderedDict
+
+# Token buckets for login attempts, keyed by username and by client IP and
+# checked before a password is hashed, so a credential-stuffing burst is
+# turned away cheaply instead of tying up workers in PBKDF2. A bucket holds
+# `capacity` attempts and refills at capacity/window per second.
+#
+# Buckets live in process memory by default. Set LOGIN_THROTTLE_FILE to
+# share them between server workers through a locked JSON file.
+
+MAX_BUCKETS = 10000
+
+def _refill(bucket, capacity, window, now):
+    tokens, updated = bucket if bucket else (capacity, now)
+    return min(capacity, tokens + (now - updated) * capacity / window)
+
+def _take(buckets, limits, now):
+    """Consume one attempt from every bucket, or none if any is empty.
+    
+    Returns the seconds to wait before retrying, 0 when allowed.
+    """
+    levels = {key: _refill(buckets.get(key), capacity, window, now) for key, capacity, window in limits}
+    wait = max(
+        ((1 - levels[key]) * window / capacity for key, capacity, window in limits if levels[key] < 1),
+        default=0
+    )
+    if wait:
+        return wait
+    for key, _, _ in limits:
+        buckets[key] = (levels[key] - 1, now)
+    return 0
+
+class MemoryBackend:
+    """Buckets for this process only"""
+    
+    def __init__(self):
+        self._buckets = OrderedDict()
+        self._lock = threading.Lock()
+    
+    def take(self, limits, now):
+        with self._lock:
+            wait = _take(self._buckets, limits, now)
+            for key, _, _ in limits:
+                if key in self._buckets:
+                    self._buckets.move_to_end(key)
+            while len(self._buckets) > MAX_BUCKETS:
+                self._buckets.popitem(last=False)
+            return wait
+    
+    def reset(self, key):
+        with self._lock:
+            self._buckets.pop(key, None)
+    
+    def clear(self):
+        with self._lock:
+            self._buckets.clear()
+
+class FileBackend:
+    """Buckets shared by every process that uses the same file"""
+    
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+    
+    def _update(self, fn):
+        with self._lock, open(self.path, 'a+') as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                f.seek(0)
+                try:
+                    buckets = {key: tuple(value) for key, value in json.loads(f.read() or '{}').items()}
+                except ValueError:
+                    buckets = {}
+                result = fn(buckets)
+                if len(buckets) > MAX_BUCKETS:
+                    # Keep the most recently used buckets
+                    newest = sorted(buckets.items(), key=lambda item: item[1][1])[-MAX_BUCKETS:]
+                    buckets = dict(newest)
+                f.seek(0)
+                f.truncate()
+                json.dump(buckets, f, separators=(',', ':'))
+                f.flush()
+                return result
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+    
+    def take(self, limits, now):
+        return self._update(lambda buckets: _take(buckets, limits, now))
+    
+    def reset(self, key):
+        self._update(lambda buckets: buckets.pop(key, None))
+    
+    def clear(self):
+        self._update(lambda buckets: buckets.clear())
+
+_backend = MemoryBackend()
+_limits = {'user': (5, 300), 'ip': (20, 300)}
+
+def init_login_throttle(app):
+    """Read limits and pick the bucket store from the app config"""
+    global _backend
+    _limits['user'] = (app.config.get('LOGIN_ATTEMPTS_PER_USER', 5), app.config.get('LOGIN_THROTTLE_WINDOW', 300))
+    _limits['ip'] = (app.config.get('LOGIN_ATTEMPTS_PER_IP', 20), app.config.get('LOGIN_THROTTLE_WINDOW', 300))
+    path = app.config.get('LOGIN_THROTTLE_FILE')
+    if path:
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        _backend = FileBackend(path)
+    elif not isinstance(_backend, MemoryBackend):
+        _backend = MemoryBackend()
+
+def _user_key(username):
+    return f"user:{(username or '').strip().lower()}"
+
+def check_login_attempt(username, ip):
+    """Count a login attempt; returns seconds until retry if it is throttled, else 0"""
+    limits = [
+        (_user_key(username), *_limits['user']),
+        (f"ip:{ip}", *_limits['ip'])
+    ]
+    wait = _backend.take(limits, time.time())
+    return math.ceil(wait) if wait else 0
+
+def reset_login_attempts(username):
+    """Forget a username's failed attempts after a successful login"""
+    _backend.reset(_user_key(username))
+
+def clear():
+    _backend.clear()
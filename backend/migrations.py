@@ -1,48 +1,61 @@
-import os
-import sqlite3
-from flask import current_app
+from flask import current_app, has_app_context
+from sqlalchemy import inspect, text
 from app import create_app, db
 
+# Columns added after the first release, as (table, column, SQL type and
+# default). The types and defaults are valid on SQLite and PostgreSQL.
+ADDED_COLUMNS = [
+    ('project', 'is_public', 'BOOLEAN DEFAULT false'),
+    ('user', 'portfolio_version', 'INTEGER NOT NULL DEFAULT 0'),
+    ('invoice', 'paid_date', 'DATE'),
+    ('document', 'content_hash', 'VARCHAR(64)')
+]
+
+def _add_missing_columns(connection):
+    inspector = inspect(connection)
+    quote = connection.dialect.identifier_preparer.quote
+    tables = set(inspector.get_table_names())
+
+    for table_name, column_name, ddl in ADDED_COLUMNS:
+        if table_name not in tables:
+            continue  # Created with every column by create_all below
+        columns = {column['name'] for column in inspector.get_columns(table_name)}
+        if column_name not in columns:
+            print(f"Adding '{column_name}' column to {table_name} table...")
+            connection.execute(text(f"ALTER TABLE {quote(table_name)} ADD COLUMN {quote(column_name)} {ddl}"))
+            print("Column added successfully.")
+
+def _create_missing_indexes(connection):
+    """create_all only indexes new tables; add indexes declared on the models since"""
+    inspector = inspect(connection)
+    tables = set(inspector.get_table_names())
+    for table in db.metadata.sorted_tables:
+        if table.name not in tables:
+            continue
+        existing = {index['name'] for index in inspector.get_indexes(table.name)}
+        for index in table.indexes:
+            if index.name not in existing:
+                print(f"Creating index {index.name}...")
+                index.create(connection)
+
 def run_migrations():
     """Run database migrations for schema changes"""
-    app = create_app()
-    
-    with app.app_context():
-        # Get database path from app config
-        db_path = current_app.config['SQLALCHEMY_DATABASE_URI'].replace('sqlite:///', '')
-        
-        if not os.path.exists(db_path):
-            print(f"Database file doesn't exist yet: {db_path}")
-            # Database will be created automatically by SQLAlchemy
-            return
-            
-        # Connect to the database
-        conn = sqlite3.connect(db_path)
-        cursor = conn.cursor()
-        
-        # Check if 'is_public' column exists in projects table
-        cursor.execute("PRAGMA table_info(project)")
-        columns = cursor.fetchall()
-        column_names = [column[1] for column in columns]
-        
-        # Add 'is_public' column if it doesn't exist
-        if 'is_public' not in column_names:
-            print("Adding 'is_public' column to project table...")
-            cursor.execute("ALTER TABLE project ADD COLUMN is_public BOOLEAN DEFAULT 0")
-            conn.commit()
-            print("Column added successfully.")
-        
-        # Check if documents table exists
-        cursor.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='document'")
-        if not cursor.fetchone():
-            print("Documents table doesn't exist. It will be created by SQLAlchemy.")
-        
-        # Close the database connection
-        conn.close()
-        
-        # Let SQLAlchemy create any missing tables
-        db.create_all()
-        print("Database migration completed successfully.")
+    if has_app_context():
+        _migrate()
+    else:
+        app = create_app()
+        with app.app_context():
+            _migrate()
+
+def _migrate():
+    print(f"Migrating {current_app.config['SQLALCHEMY_DATABASE_URI'].split('://', 1)[0]} database...")
+    with db.engine.begin() as connection:
+        _add_missing_columns(connection)
+        _create_missing_indexes(connection)
+
+    # Let SQLAlchemy create any missing tables
+    db.create_all()
+    print("Database migration completed successfully.")
 
 if __name__ == "__main__":
     run_migrations()
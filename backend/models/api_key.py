@@ -0,0 +1,26 @@
+from app import db
+from datetime import datetime
+
+class ApiKey(db.Model):
+    """A personal API key; only its public prefix and a hash of the secret are stored"""
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False, index=True)
+    name = db.Column(db.String(100), nullable=False)
+    prefix = db.Column(db.String(16), unique=True, nullable=False)
+    key_hash = db.Column(db.String(64), nullable=False)
+    scopes = db.Column(db.String(255), nullable=False)  # Space-separated, e.g. "time:read time:write"
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    last_used_at = db.Column(db.DateTime)
+    
+    def scope_list(self):
+        return self.scopes.split()
+    
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'name': self.name,
+            'prefix': self.prefix,
+            'scopes': self.scope_list(),
+            'created_at': self.created_at.isoformat() if self.created_at else None,
+            'last_used_at': self.last_used_at.isoformat() if self.last_used_at else None
+        }
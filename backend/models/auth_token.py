@@ -0,0 +1,19 @@
+from app import db
+from datetime import datetime
+
+class RefreshToken(db.Model):
+    """One refresh token of a login session; only its SHA-256 is stored"""
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False, index=True)
+    token_hash = db.Column(db.String(64), unique=True, nullable=False)
+    family_id = db.Column(db.String(32), nullable=False, index=True)  # Shared by every rotation of one login
+    access_jti = db.Column(db.String(32))  # Access token issued alongside this refresh token
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    expires_at = db.Column(db.DateTime, nullable=False)
+    revoked_at = db.Column(db.DateTime)
+
+class RevokedToken(db.Model):
+    """An access token revoked before its expiry"""
+    id = db.Column(db.Integer, primary_key=True)
+    jti = db.Column(db.String(32), unique=True, nullable=False)
+    expires_at = db.Column(db.DateTime, nullable=False, index=True)
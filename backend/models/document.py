@@ -5,9 +5,10 @@ class Document(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     project_id = db.Column(db.Integer, db.ForeignKey('project.id'), nullable=False)
     name = db.Column(db.String(200), nullable=False)
-    file_path = db.Column(db.String(255), nullable=False)
+    file_path = db.Column(db.String(255), nullable=False, index=True)
     file_type = db.Column(db.String(50))
     file_size = db.Column(db.Integer)  # Size in bytes
+    content_hash = db.Column(db.String(64), index=True)  # SHA-256 of the file content
     document_type = db.Column(db.String(20))  # contract, proposal, invoice, other
     description = db.Column(db.Text)
     uploaded_at = db.Column(db.DateTime, default=datetime.utcnow)
@@ -20,7 +21,35 @@ class Document(db.Model):
             'file_path': self.file_path,
             'file_type': self.file_type,
             'file_size': self.file_size,
+            'content_hash': self.content_hash,
             'document_type': self.document_type,
             'description': self.description,
             'uploaded_at': self.uploaded_at.isoformat()
         }
+
+class DocumentUpload(db.Model):
+    """In-progress chunked upload; bytes live in a partial file until completed"""
+    id = db.Column(db.String(32), primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    project_id = db.Column(db.Integer, db.ForeignKey('project.id'), nullable=False)
+    filename = db.Column(db.String(255), nullable=False)
+    file_type = db.Column(db.String(50))
+    total_size = db.Column(db.BigInteger, nullable=False)
+    received_size = db.Column(db.BigInteger, nullable=False, default=0)
+    name = db.Column(db.String(200))
+    document_type = db.Column(db.String(20))
+    description = db.Column(db.Text)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'project_id': self.project_id,
+            'filename': self.filename,
+            'total_size': self.total_size,
+            'offset': self.received_size,
+            'complete': self.received_size >= self.total_size,
+            'created_at': self.created_at.isoformat(),
+            'updated_at': self.updated_at.isoformat() if self.updated_at else None
+        }
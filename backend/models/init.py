@@ -4,4 +4,7 @@ from models.client import Client
 from models.project import Project
 from models.time_entry import TimeEntry
 from models.invoice import Invoice, InvoiceItem
-from models.document import Document
+from models.document import Document, DocumentUpload
+from models.portfolio_view import PortfolioViewDaily
+from models.auth_token import RefreshToken, RevokedToken
+from models.api_key import ApiKey
@@ -2,12 +2,23 @@ from app import db
 from datetime import datetime, timedelta
 
 class Invoice(db.Model):
+    __table_args__ = (
+        db.Index('ix_invoice_project_status', 'project_id', 'status'),
+        # Partial index for the overdue check, which only looks at sent invoices
+        db.Index(
+            'ix_invoice_sent_due_date', 'due_date',
+            postgresql_where=db.text("status = 'sent'"),
+            sqlite_where=db.text("status = 'sent'")
+        ),
+    )
+    
     id = db.Column(db.Integer, primary_key=True)
     project_id = db.Column(db.Integer, db.ForeignKey('project.id'), nullable=False)
     invoice_number = db.Column(db.String(50), nullable=False, unique=True)
     issue_date = db.Column(db.Date, nullable=False, default=datetime.utcnow().date)
     due_date = db.Column(db.Date, nullable=False, default=(datetime.utcnow() + timedelta(days=30)).date())
     status = db.Column(db.String(20), default='draft')  # draft, sent, paid, overdue
+    paid_date = db.Column(db.Date)
     notes = db.Column(db.Text)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     
@@ -26,6 +37,7 @@ class Invoice(db.Model):
             'issue_date': self.issue_date.isoformat() if self.issue_date else None,
             'due_date': self.due_date.isoformat() if self.due_date else None,
             'status': self.status,
+            'paid_date': self.paid_date.isoformat() if self.paid_date else None,
             'notes': self.notes,
             'total_amount': self.total_amount,
             'items': [item.to_dict() for item in self.items],
@@ -34,7 +46,7 @@ class Invoice(db.Model):
 
 class InvoiceItem(db.Model):
     id = db.Column(db.Integer, primary_key=True)
-    invoice_id = db.Column(db.Integer, db.ForeignKey('invoice.id'), nullable=False)
+    invoice_id = db.Column(db.Integer, db.ForeignKey('invoice.id'), nullable=False, index=True)
     description = db.Column(db.Text, nullable=False)
     quantity = db.Column(db.Float, nullable=False, default=1)
     unit_price = db.Column(db.Float, nullable=False)
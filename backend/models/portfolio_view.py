@@ -0,0 +1,17 @@
+from app import db
+
+class PortfolioViewDaily(db.Model):
+    """Public portfolio views per user, day and referring host"""
+    __tablename__ = 'portfolio_view_daily'
+    
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), primary_key=True)
+    day = db.Column(db.Date, primary_key=True)
+    referrer = db.Column(db.String(255), primary_key=True, default='')  # '' for direct visits
+    views = db.Column(db.Integer, nullable=False, default=0)
+    
+    def to_dict(self):
+        return {
+            'day': self.day.isoformat(),
+            'referrer': self.referrer or None,
+            'views': self.views
+        }
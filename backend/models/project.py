@@ -20,6 +20,7 @@ class Project(db.Model):
     time_entries = db.relationship('TimeEntry', backref='project', lazy='dynamic', cascade="all, delete-orphan")
     invoices = db.relationship('Invoice', backref='project', lazy='dynamic', cascade="all, delete-orphan")
     documents = db.relationship('Document', backref='project', lazy='dynamic', cascade="all, delete-orphan")
+    document_uploads = db.relationship('DocumentUpload', backref='project', lazy='dynamic', cascade="all, delete-orphan")
     
     def total_hours_method(self):
         return sum(entry.hours for entry in self.time_entries)
@@ -2,6 +2,16 @@ from app import db
 from datetime import datetime
 
 class TimeEntry(db.Model):
+    __table_args__ = (
+        db.Index('ix_time_entry_project_date', 'project_id', 'date'),
+        # Partial index for the billable-hours aggregates
+        db.Index(
+            'ix_time_entry_billable_project_date', 'project_id', 'date',
+            postgresql_where=db.text('billable'),
+            sqlite_where=db.text('billable = 1')
+        ),
+    )
+    
     id = db.Column(db.Integer, primary_key=True)
     project_id = db.Column(db.Integer, db.ForeignKey('project.id'), nullable=False)
     description = db.Column(db.Text, nullable=False)
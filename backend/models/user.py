@@ -16,6 +16,7 @@ class User(db.Model, UserMixin):
     hourly_rate = db.Column(db.Float, default=0.0)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     is_public = db.Column(db.Boolean, default=True)
+    portfolio_version = db.Column(db.Integer, nullable=False, default=0)  # Bumped whenever the public portfolio changes
     
     clients = db.relationship('Client', backref='user', lazy='dynamic')
     projects = db.relationship('Project', backref='user', lazy='dynamic')
@@ -47,6 +48,5 @@ class User(db.Model, UserMixin):
 
 @login_manager.user_loader
 def load_user(id):
-    user = User.query.get(int(id))
-    logging.debug(f"Loaded user by ID {id}: {user.username if user else 'None'}")
-    return user
\ No newline at end of file
+    from user_cache import get_user
+    return get_user(int(id))
\ No newline at end of file
@@ -0,0 +1,141 @@
+import atexit
+import logging
+import threading
+from datetime import datetime, timedelta
+from urllib.parse import urlsplit
+from sqlalchemy import text, func
+
+from extensions import db
+from models.portfolio_view import PortfolioViewDaily
+
+# Public portfolio views are counted in memory and written in batches, so the
+# anonymous portfolio endpoint never waits on a database write. Each worker
+# flushes its own counts every PORTFOLIO_VIEW_FLUSH_SECONDS and at exit; one
+# flush is a single upsert statement however many views it carries, so a
+# burst of traffic costs one short write per interval rather than a write
+# per request.
+
+# Distinct (user, day, referrer) keys held between flushes; past this,
+# new referrers are counted under OTHER_REFERRER
+MAX_PENDING_KEYS = 10000
+OTHER_REFERRER = '(other)'
+
+UPSERT_SQL = text("""
+    INSERT INTO portfolio_view_daily (user_id, day, referrer, views)
+    VALUES (:user_id, :day, :referrer, :views)
+    ON CONFLICT (user_id, day, referrer) DO UPDATE SET views = portfolio_view_daily.views + excluded.views
+""")
+
+_pending = {}
+_lock = threading.Lock()
+_app = None
+_flush_interval = 30
+_flusher = None
+_stop = threading.Event()
+
+def referrer_host(referrer):
+    """Reduce a Referer header to its host; '' for direct visits"""
+    if not referrer:
+        return ''
+    try:
+        host = urlsplit(referrer).hostname or ''
+    except ValueError:
+        return ''
+    return host[:255]
+
+def record_view(user_id, referrer=None):
+    """Count one portfolio view; never touches the database"""
+    key = (user_id, datetime.utcnow().date(), referrer_host(referrer))
+    with _lock:
+        if key not in _pending and len(_pending) >= MAX_PENDING_KEYS:
+            key = (user_id, key[1], OTHER_REFERRER)
+        _pending[key] = _pending.get(key, 0) + 1
+    _ensure_flusher()
+
+def flush_portfolio_views():
+    """Write buffered counts to portfolio_view_daily; returns the number of views written"""
+    with _lock:
+        if not _pending:
+            return 0
+        batch = dict(_pending)
+        _pending.clear()
+    
+    rows = [
+        {'user_id': user_id, 'day': day, 'referrer': referrer, 'views': views}
+        for (user_id, day, referrer), views in batch.items()
+    ]
+    try:
+        if _app is None:
+            raise RuntimeError("portfolio analytics not initialised")
+        with _app.app_context():
+            db.session.execute(UPSERT_SQL, rows)
+            db.session.commit()
+    except Exception as e:
+        # Put the counts back so the next flush retries them
+        logging.error(f"Flushing portfolio views failed: {e}")
+        with _lock:
+            for key, views in batch.items():
+                _pending[key] = _pending.get(key, 0) + views
+        return 0
+    return sum(batch.values())
+
+def _flush_loop():
+    while not _stop.wait(_flush_interval):
+        flush_portfolio_views()
+
+def _ensure_flusher():
+    """Start this worker's flush thread on first use, after any fork"""
+    global _flusher
+    if _flusher is not None and _flusher.is_alive():
+        return
+    with _lock:
+        if _flusher is not None and _flusher.is_alive():
+            return
+        _stop.clear()
+        _flusher = threading.Thread(target=_flush_loop, name='portfolio-views', daemon=True)
+        _flusher.start()
+
+def shutdown_portfolio_analytics():
+    """Stop the flush thread and write whatever is still buffered"""
+    _stop.set()
+    flush_portfolio_views()
+
+def init_portfolio_analytics(app):
+    """Read the flush interval and flush remaining views at exit"""
+    global _app, _flush_interval
+    first_init = _app is None
+    _app = app
+    _flush_interval = app.config.get('PORTFOLIO_VIEW_FLUSH_SECONDS', 30)
+    if first_init:
+        atexit.register(shutdown_portfolio_analytics)
+
+def view_stats(user_id, days=30):
+    """Totals, recent daily counts and top referrers for a user's portfolio"""
+    since = datetime.utcnow().date() - timedelta(days=days - 1)
+    
+    total = db.session.query(func.coalesce(func.sum(PortfolioViewDaily.views), 0)).filter(
+        PortfolioViewDaily.user_id == user_id
+    ).scalar()
+    
+    daily = db.session.query(
+        PortfolioViewDaily.day, func.sum(PortfolioViewDaily.views)
+    ).filter(
+        PortfolioViewDaily.user_id == user_id,
+        PortfolioViewDaily.day >= since
+    ).group_by(PortfolioViewDaily.day).order_by(PortfolioViewDaily.day).all()
+    
+    referrers = db.session.query(
+        PortfolioViewDaily.referrer, func.sum(PortfolioViewDaily.views).label('views')
+    ).filter(
+        PortfolioViewDaily.user_id == user_id,
+        PortfolioViewDaily.day >= since,
+        PortfolioViewDaily.referrer != ''
+    ).group_by(PortfolioViewDaily.referrer).order_by(db.desc('views')).limit(10).all()
+    
+    return {
+        'total_views': int(total),
+        'days': days,
+        'recent_views': int(sum(views for _, views in daily)),
+        'daily': [{'day': day.isoformat(), 'views': int(views)} for day, views in daily],
+        'top_referrers': [{'referrer': referrer, 'views': int(views)} for referrer, views in referrers]
+    }
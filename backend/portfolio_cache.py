@@ -0,0 +1,60 @@
+import time
+import hashlib
+import threading
+from collections import OrderedDict
+
+from extensions import db
+from portfolio_snapshots import mark_portfolio_changed
+
+# Rendered public portfolios, keyed by (username, portfolio_version). Every
+# change that affects a portfolio bumps the user's version in the database,
+# so all workers stop using old entries as soon as the change commits; the
+# TTL only bounds how long unused entries stay in memory.
+
+MAX_ENTRIES = 1024
+TTL_SECONDS = 300
+
+_entries = OrderedDict()
+_lock = threading.Lock()
+
+def make_etag(body):
+    return hashlib.sha256(body).hexdigest()[:32]
+
+def get(username, version):
+    """Return (body, etag) for a cached portfolio, or None"""
+    key = (username, version)
+    with _lock:
+        entry = _entries.get(key)
+        if entry is None:
+            return None
+        body, etag, stored_at = entry
+        if time.monotonic() - stored_at > TTL_SECONDS:
+            del _entries[key]
+            return None
+        _entries.move_to_end(key)
+        return body, etag
+
+def put(username, version, body):
+    """Cache a rendered portfolio body and return its ETag"""
+    etag = make_etag(body)
+    with _lock:
+        _entries[(username, version)] = (body, etag, time.monotonic())
+        _entries.move_to_end((username, version))
+        while len(_entries) > MAX_ENTRIES:
+            _entries.popitem(last=False)
+    return etag
+
+def bump_portfolio_version(user_id):
+    """Invalidate a user's cached portfolio; call before the change commits"""
+    from models.user import User
+
+    db.session.query(User).filter(User.id == user_id).update(
+        {User.portfolio_version: db.func.coalesce(User.portfolio_version, 0) + 1},
+        synchronize_session=False
+    )
+    # Re-render the static snapshot once the change commits
+    mark_portfolio_changed(user_id)
+
+def clear():
+    with _lock:
+        _entries.clear()
@@ -0,0 +1,201 @@
+import os
+import json
+import fcntl
+import logging
+import tempfile
+import threading
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
+from flask import current_app, has_app_context, render_template_string
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+from werkzeug.utils import secure_filename
+
+from extensions import db
+from background import submit
+
+# Static copies of every public portfolio, written to
+# <static>/portfolios/<username>.json and .html after any change to the
+# user's public data commits. They are plain files under the static folder,
+# so a front proxy (or Flask's static route) serves them without touching
+# the database.
+#
+# Renders of one user run one at a time, across threads and server workers,
+# and each reads the user inside the lock. Whichever runs last therefore
+# writes the latest committed state: an older render can neither overwrite a
+# newer snapshot nor put back files that a switch to private removed.
+
+SNAPSHOT_TEMPLATE = """<!DOCTYPE html>
+<html lang="en">
+<head>
+    <meta charset="utf-8">
+    <meta name="viewport" content="width=device-width, initial-scale=1">
+    <title>{{ portfolio.name or portfolio.username }} - Portfolio</title>
+    {% if portfolio.bio %}<meta name="description" content="{{ portfolio.bio }}">{% endif %}
+</head>
+<body>
+    <header>
+        {% if portfolio.profile_image %}<img src="{{ portfolio.profile_image }}" alt="{{ portfolio.name or portfolio.username }}" width="256" height="256">{% endif %}
+        <h1>{{ portfolio.name or portfolio.username }}</h1>
+        {% if portfolio.specialization %}<p>{{ portfolio.specialization }}</p>{% endif %}
+        {% if portfolio.bio %}<p>{{ portfolio.bio }}</p>{% endif %}
+        {% if portfolio.email %}<p><a href="mailto:{{ portfolio.email }}">{{ portfolio.email }}</a></p>{% endif %}
+    </header>
+    <main>
+        {% for project in portfolio.projects %}
+        <article>
+            <h2>{{ project.title }}</h2>
+            {% if project.description %}<p>{{ project.description }}</p>{% endif %}
+            <p>{{ project.start_date or '' }}{% if project.end_date %} &ndash; {{ project.end_date }}{% endif %}</p>
+        </article>
+        {% endfor %}
+    </main>
+</body>
+</html>
+"""
+
+def snapshot_dir():
+    path = os.path.join(current_app.static_folder, 'portfolios')
+    os.makedirs(path, exist_ok=True)
+    return path
+
+# Users share this many render locks, so parallel regeneration still runs
+# while the lock files stay few
+RENDER_LOCK_STRIPES = 16
+
+_thread_locks = [threading.Lock() for _ in range(RENDER_LOCK_STRIPES)]
+
+@contextmanager
+def render_lock(user_id):
+    """Serialise snapshot renders of one user across threads and server workers"""
+    stripe = user_id % RENDER_LOCK_STRIPES
+    lock_path = os.path.join(snapshot_dir(), f".render-{stripe}.lock")
+    with _thread_locks[stripe], open(lock_path, 'a') as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+def _write_atomic(path, data):
+    # A unique temp file per write: threads of one worker may render the same snapshot at once
+    with tempfile.NamedTemporaryFile(dir=os.path.dirname(path), prefix=os.path.basename(path) + '.',
+                                     suffix='.tmp', delete=False) as f:
+        f.write(data)
+    try:
+        os.chmod(f.name, 0o644)
+        os.replace(f.name, path)
+    except OSError:
+        os.remove(f.name)
+        raise
+
+def _remove(path):
+    try:
+        if os.path.exists(path):
+            os.remove(path)
+    except OSError as e:
+        logging.error(f"Error deleting snapshot {path}: {e}")
+
+def write_snapshot(user):
+    """Render one user's snapshot, or remove it if their portfolio is private
+
+    Call inside render_lock() with the user freshly loaded.
+    """
+    from models.user import User
+    from routes.portfolio import build_portfolio
+
+    # Usernames that aren't safe file names are served dynamically only
+    if secure_filename(user.username) != user.username:
+        return False
+
+    base = os.path.join(snapshot_dir(), user.username)
+    if not user.is_public:
+        _remove(f"{base}.json")
+        _remove(f"{base}.html")
+        return False
+
+    portfolio = build_portfolio(user)
+
+    # A change that committed while this rendered has queued a render of its
+    # own, which is waiting for the lock and will write the newer state
+    current = db.session.query(User.portfolio_version, User.is_public).filter(User.id == user.id).first()
+    if current is None or tuple(current) != (user.portfolio_version, user.is_public):
+        return False
+
+    # The JSON goes last, so once it is current the HTML is too
+    _write_atomic(f"{base}.html", render_template_string(SNAPSHOT_TEMPLATE, portfolio=portfolio).encode('utf-8'))
+    _write_atomic(f"{base}.json", json.dumps(portfolio, separators=(',', ':')).encode('utf-8'))
+    return True
+
+def render_user_snapshot(app, user_id):
+    """Render a snapshot in a fresh app context; runs on the background pool"""
+    from models.user import User
+
+    with app.app_context():
+        try:
+            with render_lock(user_id):
+                user = db.session.get(User, user_id)
+                if user is not None:
+                    write_snapshot(user)
+        except Exception as e:
+            logging.error(f"Portfolio snapshot failed for user {user_id}: {e}")
+
+def mark_portfolio_changed(user_id):
+    """Remember that a user's portfolio changed in the current transaction"""
+    db.session.info.setdefault('portfolio_changed', set()).add(user_id)
+
+def _after_commit(session):
+    changed = session.info.pop('portfolio_changed', None)
+    if not changed or not has_app_context():
+        return
+    app = current_app._get_current_object()
+    if not app.config.get('PORTFOLIO_SNAPSHOTS_ENABLED', True):
+        return
+    for user_id in changed:
+        submit(render_user_snapshot, app, user_id)
+
+def _after_rollback(session):
+    session.info.pop('portfolio_changed', None)
+
+_listeners_registered = False
+
+def init_portfolio_snapshots(app):
+    """Re-render snapshots after commits that changed public portfolio data"""
+    global _listeners_registered
+    if _listeners_registered:
+        return
+    event.listen(Session, 'after_commit', _after_commit)
+    event.listen(Session, 'after_rollback', _after_rollback)
+    _listeners_registered = True
+
+def regenerate_all_snapshots(workers=8):
+    """Render every public user's snapshot in parallel, e.g. after a deploy"""
+    from models.user import User
+
+    app = current_app._get_current_object()
+    public_users = db.session.query(User.id, User.username).filter(User.is_public == True).all()
+    user_ids = [user.id for user in public_users]
+
+    # Drop snapshots of users who are no longer public
+    public_names = {user.username for user in public_users}
+    for filename in os.listdir(snapshot_dir()):
+        username, _, extension = filename.rpartition('.')
+        if extension in ('json', 'html') and username not in public_names:
+            _remove(os.path.join(snapshot_dir(), filename))
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        list(executor.map(lambda user_id: render_user_snapshot(app, user_id), user_ids))
+    return len(user_ids)
+
+if __name__ == "__main__":
+    import argparse
+    from app import create_app
+
+    parser = argparse.ArgumentParser(description='Regenerate static portfolio snapshots')
+    parser.add_argument('--workers', type=int, default=8, help='Parallel render threads (default: 8)')
+    args = parser.parse_args()
+
+    app = create_app()
+    with app.app_context():
+        count = regenerate_all_snapshots(workers=args.workers)
+        print(f"Regenerated {count} portfolio snapshots.")
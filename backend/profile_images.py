@@ -0,0 +1,98 @@
+import io
+import os
+import re
+import hashlib
+import logging
+
+from PIL import Image, ImageOps, UnidentifiedImageError
+
+# Profile images are decoded once, oriented and stripped of metadata, then
+# written as JPEG and WebP at a few fixed widths. Every file name carries a
+# hash of the uploaded bytes, so a URL always refers to the same image and
+# can be cached forever.
+
+PROFILE_IMAGE_URL_PREFIX = '/static/uploads/profile_images/'
+VARIANT_SIZES = (128, 256, 512)
+DEFAULT_SIZE = 512
+FORMATS = {
+    'jpg': ('JPEG', {'quality': 85, 'optimize': True, 'progressive': True}),
+    'webp': ('WEBP', {'quality': 80, 'method': 6})
+}
+
+# Refuse images that would decode to more than this many pixels
+MAX_SOURCE_PIXELS = 40_000_000
+
+HASHED_NAME_RE = re.compile(r'^[0-9a-f]{16}_\d+\.(jpg|webp)$')
+
+class InvalidImageError(ValueError):
+    pass
+
+def profile_images_dir(upload_folder):
+    os.makedirs(upload_folder, exist_ok=True)
+    return upload_folder
+
+def is_hashed_name(filename):
+    return bool(HASHED_NAME_RE.match(filename))
+
+def variant_urls(content_id):
+    """URLs of every stored variant for a content id, grouped by format"""
+    return {
+        extension: {size: f"{PROFILE_IMAGE_URL_PREFIX}{content_id}_{size}.{extension}" for size in VARIANT_SIZES}
+        for extension in FORMATS
+    }
+
+def content_id_from_url(url):
+    """Return the content id of a hashed profile image URL, or None for legacy uploads"""
+    filename = (url or '').rsplit('/', 1)[-1]
+    return filename.split('_', 1)[0] if is_hashed_name(filename) else None
+
+def process_profile_image(stream, upload_folder):
+    """Decode an upload once and write all variants; returns the content id"""
+    data = stream.read()
+    content_id = hashlib.sha256(data).hexdigest()[:16]
+    target_dir = profile_images_dir(upload_folder)
+
+    # Identical uploads reuse the variants already on disk
+    if all(os.path.exists(os.path.join(target_dir, f"{content_id}_{size}.{extension}"))
+           for size in VARIANT_SIZES for extension in FORMATS):
+        return content_id
+
+    try:
+        with Image.open(io.BytesIO(data)) as source:
+            if source.width * source.height > MAX_SOURCE_PIXELS:
+                raise InvalidImageError("Image is too large")
+            image = ImageOps.exif_transpose(source)
+            image.load()
+    except (UnidentifiedImageError, Image.DecompressionBombError, OSError) as e:
+        raise InvalidImageError(f"Invalid image: {e}")
+
+    # Re-encoding from pixel data drops EXIF and any other metadata
+    if image.mode not in ('RGB', 'L'):
+        rgba = image.convert('RGBA')
+        image = Image.new('RGB', rgba.size, (255, 255, 255))
+        image.paste(rgba, mask=rgba.getchannel('A'))
+    elif image.mode == 'L':
+        image = image.convert('RGB')
+
+    for size in VARIANT_SIZES:
+        variant = image.copy()
+        variant.thumbnail((size, size), Image.LANCZOS)
+        for extension, (format_name, options) in FORMATS.items():
+            path = os.path.join(target_dir, f"{content_id}_{size}.{extension}")
+            temp_path = f"{path}.tmp"
+            variant.save(temp_path, format_name, **options)
+            os.replace(temp_path, path)
+
+    return content_id
+
+def remove_variants(content_id, upload_folder):
+    """Delete the variant files of a content id"""
+    target_dir = profile_images_dir(upload_folder)
+    for size in VARIANT_SIZES:
+        for extension in FORMATS:
+            path = os.path.join(target_dir, f"{content_id}_{size}.{extension}")
+            try:
+                if os.path.exists(path):
+                    os.remove(path)
+            except OSError as e:
+                logging.error(f"Error deleting profile image {path}: {e}")
@@ -9,7 +9,16 @@ import logging
 
 from app import db
 from models.user import User
-from auth_middleware import generate_token
+from auth_middleware import issue_tokens, rotate_refresh_token, revoke_current_session, revoke_user_sessions
+from portfolio_cache import bump_portfolio_version
+from user_cache import invalidate_user
+from login_throttle import check_login_attempt, reset_login_attempts
+from models.api_key import ApiKey
+from api_keys import SCOPES, create_api_key, forget
+from profile_images import (
+    DEFAULT_SIZE, InvalidImageError, process_profile_image,
+    variant_urls, content_id_from_url, remove_variants
+)
 
 auth_bp = Blueprint('auth', __name__)
 
@@ -45,12 +54,13 @@ def register():
         return jsonify({"error": "Failed to save user"}), 500
     
     login_user(user, remember=True)
-    token = generate_token(user.id)
-    logging.debug(f"Generated token for user {user.username}: {token}")
+    tokens = issue_tokens(user.id)
+    db.session.commit()
+    logging.debug(f"Generated tokens for user {user.username}")
     
     response = make_response(jsonify({
         "message": "User registered successfully",
-        "token": token,
+        **tokens,
         "user": user.to_dict()
     }), 201)
     response.headers['Cache-Control'] = 'no-cache, no-store, must-revalidate'
@@ -64,31 +74,60 @@ def login():
     logging.debug(f"Login attempt with data: {request.get_json()}")
     
     if current_user.is_authenticated:
+        logging.debug(f"Logging out previous user: {current_user.username}")
         logout_user()
-        logging.debug(f"Logged out previous user: {current_user.username}")
     
     data = request.get_json()
+    
+    # Turn away floods before any password hashing
+    retry_after = check_login_attempt(data['username'], request.remote_addr)
+    if retry_after:
+        logging.debug(f"Login throttled for username: {data['username']}")
+        response = make_response(jsonify({"error": "Too many login attempts. Try again later."}), 429)
+        response.headers['Retry-After'] = str(retry_after)
+        return response
+    
     user = User.query.filter_by(username=data['username']).first()
     
     if user is None or not user.check_password(data['password']):
         logging.debug(f"Login failed for username: {data['username']}")
         return jsonify({"error": "Invalid username or password"}), 401
     
+    reset_login_attempts(data['username'])
+    
     login_user(user, remember=data.get('remember', False))
-    token = generate_token(user.id)
-    logging.debug(f"Logged in user {user.username} with token: {token}")
+    tokens = issue_tokens(user.id)
+    db.session.commit()
+    logging.debug(f"Logged in user {user.username}")
     
-    response = make_response(jsonify({"token": token, "user": user.to_dict()}), 200)
+    response = make_response(jsonify({**tokens, "user": user.to_dict()}), 200)
     response.headers['Cache-Control'] = 'no-cache, no-store, must-revalidate'
     response.headers['Pragma'] = 'no-cache'
     response.headers['Expires'] = '0'
     
     return response
 
+@auth_bp.route('/refresh', methods=['POST'])
+def refresh():
+    """Exchange a refresh token for a new access and refresh token"""
+    data = request.get_json(silent=True) or {}
+    tokens = rotate_refresh_token(data.get('refresh_token'))
+    db.session.commit()
+    if tokens is None:
+        return jsonify({"error": "Invalid or expired refresh token"}), 401
+    
+    response = make_response(jsonify(tokens), 200)
+    response.headers['Cache-Control'] = 'no-cache, no-store, must-revalidate'
+    response.headers['Pragma'] = 'no-cache'
+    response.headers['Expires'] = '0'
+    return response
+
 @auth_bp.route('/logout', methods=['POST'])
 @login_required
 def logout():
     logging.debug(f"Logging out user: {current_user.username}")
+    revoke_current_session()
+    db.session.commit()
     logout_user()
     response = make_response(jsonify({"message": "Logged out successfully"}), 200)
     response.set_cookie('session', '', expires=0)
@@ -128,7 +167,9 @@ def update_user():
     if 'hourly_rate' in data:
         current_user.hourly_rate = float(data['hourly_rate']) if data['hourly_rate'] else 0.0
     
+    bump_portfolio_version(current_user.id)
     db.session.commit()
+    invalidate_user(current_user.id)
     logging.debug(f"User {current_user.username} updated successfully")
     
     response = make_response(jsonify({
@@ -152,10 +193,14 @@ def change_password():
         return jsonify({"error": "Current password is incorrect"}), 400
     
     current_user.set_password(data['new_password'])
+    # Sign out every session, then give this client a fresh one
+    revoke_user_sessions(current_user.id)
+    tokens = issue_tokens(current_user.id)
     db.session.commit()
+    invalidate_user(current_user.id)
     logging.debug(f"Password updated for {current_user.username}")
     
-    response = make_response(jsonify({"message": "Password updated successfully"}), 200)
+    response = make_response(jsonify({"message": "Password updated successfully", **tokens}), 200)
     response.headers['Cache-Control'] = 'no-cache, no-store, must-revalidate'
     response.headers['Pragma'] = 'no-cache'
     response.headers['Expires'] = '0'
@@ -173,26 +218,79 @@ def upload_profile_image():
     if not file or file.filename == '':
         return jsonify({"error": "No file selected"}), 400
     
-    filename = secure_filename(file.filename)
-    unique_filename = f"{current_user.id}_{uuid.uuid4().hex}_{filename}"
-    upload_folder = os.path.join(current_app.root_path, 'static/uploads/profile_images')
-    os.makedirs(upload_folder, exist_ok=True)
-    file_path = os.path.join(upload_folder, unique_filename)
-    
-    file.save(file_path)
-    logging.debug(f"Image saved at: {file_path}")
+    try:
+        content_id = process_profile_image(file.stream, current_app.config['UPLOAD_FOLDER'])
+    except InvalidImageError as e:
+        return jsonify({"error": str(e)}), 400
     
-    image_url = f"/static/uploads/profile_images/{unique_filename}"
+    previous_id = content_id_from_url(current_user.profile_image)
+    variants = variant_urls(content_id)
+    image_url = variants['jpg'][DEFAULT_SIZE]
     current_user.profile_image = image_url
+    bump_portfolio_version(current_user.id)
     db.session.commit()
+    invalidate_user(current_user.id)
     logging.debug(f"Updated profile_image for user {current_user.username}: {image_url}")
     
+    # Drop the previous variants unless another account uses the same image
+    if previous_id and previous_id != content_id and not User.query.filter(
+        User.profile_image.like(f"%/{previous_id}_%")
+    ).first():
+        remove_variants(previous_id, current_app.config['UPLOAD_FOLDER'])
+    
     response = make_response(jsonify({
         "message": "Profile image uploaded successfully",
-        "image_url": f"http://localhost:5001{image_url}"
+        "image_url": f"http://localhost:5001{image_url}",
+        "variants": variants
     }), 200)
     response.headers['Cache-Control'] = 'no-cache, no-store, must-revalidate'
     response.headers['Pragma'] = 'no-cache'
     response.headers['Expires'] = '0'
     
-    return response
\ No newline at end of file
+    return response
+
+@auth_bp.route('/api-keys', methods=['GET'])
+@login_required
+def get_api_keys():
+    """List the current user's API keys"""
+    api_keys = ApiKey.query.filter_by(user_id=current_user.id).order_by(ApiKey.created_at.desc()).all()
+    return jsonify([api_key.to_dict() for api_key in api_keys]), 200
+
+@auth_bp.route('/api-keys', methods=['POST'])
+@login_required
+def create_key():
+    """Create an API key; the full key is only returned here"""
+    data = request.get_json() or {}
+    
+    if not data.get('name'):
+        return jsonify({"error": "Name is required"}), 400
+    scopes = data.get('scopes')
+    if not scopes or not isinstance(scopes, list):
+        return jsonify({"error": "At least one scope is required"}), 400
+    unknown = sorted(set(scopes) - SCOPES)
+    if unknown:
+        return jsonify({"error": f"Unknown scopes: {', '.join(unknown)}"}), 400
+    
+    api_key, key = create_api_key(current_user.id, data['name'], scopes)
+    db.session.commit()
+    
+    response = make_response(jsonify({
+        "message": "API key created successfully",
+        "api_key": api_key.to_dict(),
+        "key": key
+    }), 201)
+    response.headers['Cache-Control'] = 'no-cache, no-store, must-revalidate'
+    response.headers['Pragma'] = 'no-cache'
+    response.headers['Expires'] = '0'
+    return response
+
+@auth_bp.route('/api-keys/<int:key_id>', methods=['DELETE'])
+@login_required
+def delete_api_key(key_id):
+    """Revoke an API key"""
+    api_key = ApiKey.query.filter_by(id=key_id, user_id=current_user.id).first_or_404()
+    db.session.delete(api_key)
+    db.session.commit()
+    forget(key_id)
+    
+    return jsonify({"message": "API key deleted successfully"}), 200
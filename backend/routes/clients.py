@@ -1,8 +1,13 @@
 from flask import Blueprint, request, jsonify
 from flask_login import current_user, login_required
+from datetime import datetime
+import csv
+from sqlalchemy import text, bindparam
 
 from app import db
 from models.client import Client
+from typeahead import get_client_index, invalidate_client_index
+from client_import import parse_csv, parse_vcard, import_clients
 
 clients_bp = Blueprint('clients', __name__)
 
@@ -43,6 +48,7 @@ def create_client():
     
     db.session.add(client)
     db.session.commit()
+    invalidate_client_index(current_user.id)
     
     return jsonify({
         "message": "Client created successfully",
@@ -71,6 +77,7 @@ def update_client(client_id):
         client.notes = data['notes']
     
     db.session.commit()
+    invalidate_client_index(current_user.id)
     
     return jsonify({
         "message": "Client updated successfully",
@@ -91,6 +98,7 @@ def delete_client(client_id):
     
     db.session.delete(client)
     db.session.commit()
+    invalidate_client_index(current_user.id)
     
     return jsonify({"message": "Client deleted successfully"}), 200
 
@@ -110,3 +118,208 @@ def search_clients():
     ).all()
     
     return jsonify([client.to_dict() for client in clients]), 200
+
+@clients_bp.route('/import', methods=['POST'])
+@login_required
+def import_clients_file():
+    """Bulk import clients from a CSV or vCard file"""
+    if 'file' not in request.files:
+        return jsonify({"error": "No file part"}), 400
+    
+    file = request.files['file']
+    if file.filename == '':
+        return jsonify({"error": "No file selected"}), 400
+    
+    # Detect format from the explicit field or the file extension
+    file_format = (request.form.get('format') or file.filename.rsplit('.', 1)[-1]).lower()
+    if file_format == 'csv':
+        records = parse_csv(file.stream)
+    elif file_format in ('vcf', 'vcard'):
+        records = parse_vcard(file.stream)
+    else:
+        return jsonify({"error": "Unsupported format. Use CSV or vCard"}), 400
+    
+    dry_run = (request.form.get('dry_run') or request.args.get('dry_run', '')).lower() == 'true'
+    
+    try:
+        result = import_clients(current_user.id, records, dry_run=dry_run)
+    except (UnicodeDecodeError, csv.Error) as e:
+        db.session.rollback()
+        return jsonify({"error": f"Could not parse file: {str(e)}"}), 400
+    
+    if not dry_run and result['created']:
+        invalidate_client_index(current_user.id)
+    
+    result['dry_run'] = dry_run
+    return jsonify(result), 200 if dry_run else 201
+
+@clients_bp.route('/typeahead', methods=['GET'])
+@login_required
+def typeahead_clients():
+    """Prefix search on client name, company and email words"""
+    query = request.args.get('q', '')
+    limit = min(max(request.args.get('limit', 10, type=int), 1), 50)
+    
+    if not query:
+        return jsonify([]), 200
+    
+    return jsonify(get_client_index(current_user.id).search(query, limit)), 200
+
+# Ledger of issued invoices (debits) and payments (credits) for one client.
+# Item totals are summed for this client's invoices only. Each page runs the
+# running-balance window over its own rows, starting from the balance carried
+# in the cursor, so later pages only read entries after the cursor. The first
+# page of a date range gets its opening balance from one aggregate over the
+# entries before start_date. Requires window function support (SQLite 3.25+).
+STATEMENT_ENTRIES_CTE = """
+    WITH item_totals AS (
+        SELECT ii.invoice_id, SUM(ii.quantity * ii.unit_price) AS amount
+        FROM invoice_item ii
+        JOIN invoice i ON i.id = ii.invoice_id
+        JOIN project p ON p.id = i.project_id
+        WHERE p.client_id = :client_id
+          AND p.user_id = :user_id
+          AND i.status != 'draft'
+        GROUP BY ii.invoice_id
+    ),
+    client_invoices AS (
+        SELECT i.id, i.invoice_number, i.issue_date, i.paid_date, i.status,
+               COALESCE(t.amount, 0) AS amount
+        FROM invoice i
+        JOIN project p ON p.id = i.project_id
+        LEFT JOIN item_totals t ON t.invoice_id = i.id
+        WHERE p.client_id = :client_id
+          AND p.user_id = :user_id
+          AND i.status != 'draft'
+    ),
+    entries AS (
+        SELECT issue_date AS entry_date, 0 AS kind, id AS invoice_id, invoice_number,
+               amount AS debit, 0 AS credit
+        FROM client_invoices
+        UNION ALL
+        SELECT COALESCE(paid_date, issue_date), 1, id, invoice_number,
+               0, amount
+        FROM client_invoices
+        WHERE status = 'paid'
+    )
+"""
+
+OPENING_BALANCE_SQL = text(STATEMENT_ENTRIES_CTE + """
+    SELECT COALESCE(SUM(debit - credit), 0)
+    FROM entries
+    WHERE entry_date < :start_date
+""").bindparams(bindparam('start_date', type_=db.Date))
+
+STATEMENT_SQL = text(STATEMENT_ENTRIES_CTE + """,
+    page AS (
+        SELECT entry_date, kind, invoice_id, invoice_number, debit, credit
+        FROM entries
+        WHERE (:start_date IS NULL OR entry_date >= :start_date)
+          AND (:end_date IS NULL OR entry_date <= :end_date)
+          AND (:after_date IS NULL
+               OR entry_date > :after_date
+               OR (entry_date = :after_date AND invoice_id > :after_invoice)
+               OR (entry_date = :after_date AND invoice_id = :after_invoice AND kind > :after_kind))
+        ORDER BY entry_date, invoice_id, kind
+        LIMIT :limit
+    )
+    SELECT entry_date, kind, invoice_id, invoice_number, debit, credit,
+           :opening_balance + SUM(debit - credit) OVER (
+               ORDER BY entry_date, invoice_id, kind
+               ROWS BETWEEN UNBOUNDED PRECEDING AND CURRENT ROW
+           ) AS balance
+    FROM page
+    ORDER BY entry_date, invoice_id, kind
+""").bindparams(
+    bindparam('start_date', type_=db.Date),
+    bindparam('end_date', type_=db.Date),
+    bindparam('after_date', type_=db.Date),
+    bindparam('after_invoice', type_=db.Integer),
+    bindparam('after_kind', type_=db.Integer),
+    bindparam('opening_balance', type_=db.Float),
+).columns(entry_date=db.Date)
+
+@clients_bp.route('/<int:client_id>/statement', methods=['GET'])
+@login_required
+def client_statement(client_id):
+    """Get a chronological statement of invoices and payments with a running balance"""
+    client = Client.query.filter_by(id=client_id, user_id=current_user.id).first_or_404()
+    
+    start_date = None
+    end_date = None
+    
+    if request.args.get('start_date'):
+        try:
+            start_date = datetime.strptime(request.args['start_date'], '%Y-%m-%d').date()
+        except ValueError:
+            return jsonify({"error": "Invalid start date format. Use YYYY-MM-DD"}), 400
+    
+    if request.args.get('end_date'):
+        try:
+            end_date = datetime.strptime(request.args['end_date'], '%Y-%m-%d').date()
+        except ValueError:
+            return jsonify({"error": "Invalid end date format. Use YYYY-MM-DD"}), 400
+    
+    # Keyset cursor: "<YYYY-MM-DD>:<invoice_id>:<kind>:<balance>" of the last
+    # row on the previous page; the balance is where the next page starts from
+    after_date = after_invoice = after_kind = None
+    cursor = request.args.get('cursor')
+    if cursor:
+        try:
+            date_str, invoice_str, kind_str, balance_str = cursor.split(':')
+            after_date = datetime.strptime(date_str, '%Y-%m-%d').date()
+            after_invoice = int(invoice_str)
+            after_kind = int(kind_str)
+            opening_balance = float(balance_str)
+        except ValueError:
+            return jsonify({"error": "Invalid cursor"}), 400
+    elif start_date:
+        opening_balance = db.session.execute(OPENING_BALANCE_SQL, {
+            'client_id': client.id,
+            'user_id': current_user.id,
+            'start_date': start_date
+        }).scalar()
+    else:
+        opening_balance = 0.0
+    
+    limit = min(max(request.args.get('limit', 50, type=int), 1), 500)
+    
+    rows = db.session.execute(STATEMENT_SQL, {
+        'client_id': client.id,
+        'user_id': current_user.id,
+        'start_date': start_date,
+        'end_date': end_date,
+        'after_date': after_date,
+        'after_invoice': after_invoice,
+        'after_kind': after_kind,
+        'opening_balance': opening_balance,
+        'limit': limit + 1
+    }).all()
+    
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    
+    entries = [
+        {
+            'date': row.entry_date.isoformat(),
+            'type': 'payment' if row.kind else 'invoice',
+            'invoice_id': row.invoice_id,
+            'invoice_number': row.invoice_number,
+            'debit': row.debit,
+            'credit': row.credit,
+            'balance': row.balance
+        } for row in rows
+    ]
+    
+    next_cursor = None
+    if has_more:
+        last = rows[-1]
+        next_cursor = f"{last.entry_date.isoformat()}:{last.invoice_id}:{last.kind}:{float(last.balance)!r}"
+    
+    return jsonify({
+        'client_id': client.id,
+        'opening_balance': opening_balance if rows else None,
+        'closing_balance': rows[-1].balance if rows else None,
+        'entries': entries,
+        'next_cursor': next_cursor
+    }), 200
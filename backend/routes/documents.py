@@ -1,13 +1,20 @@
 from flask import Blueprint, request, jsonify, current_app, send_file
 from flask_login import current_user, login_required
 from werkzeug.utils import secure_filename
+from werkzeug.exceptions import ClientDisconnected
 import os
 import uuid
+import mimetypes
 from datetime import datetime
 
 from app import db
-from models.document import Document
+from models.document import Document, DocumentUpload
 from models.project import Project
+from document_storage import (documents_dir, blob_lock, stage_stream, stage_file, commit_blob, release_file,
+                              upload_expired)
+from thumbnails import schedule_thumbnail, thumbnail_path
+from document_text import schedule_text_extraction
+from search_index import filter_documents_by_content
 
 documents_bp = Blueprint('documents', __name__)
 
@@ -23,6 +30,7 @@ def get_documents():
     # Get query parameters
     project_id = request.args.get('project_id', type=int)
     document_type = request.args.get('document_type')
+    search_text = request.args.get('q', '').strip()
     
     # Base query: only show documents for projects owned by current user
     query = db.session.query(Document).join(Project).filter(Project.user_id == current_user.id)
@@ -34,7 +42,9 @@ def get_documents():
     if document_type:
         query = query.filter(Document.document_type == document_type)
     
-    # Order by most recently uploaded
+    # Full-text search ranks by relevance, otherwise most recently uploaded first
+    if search_text:
+        query = filter_documents_by_content(query, search_text)
     documents = query.order_by(Document.uploaded_at.desc()).all()
     
     return jsonify([document.to_dict() for document in documents]), 200
@@ -65,12 +75,60 @@ def download_document(document_id):
     if not os.path.isfile(document.file_path):
         return jsonify({"error": "File not found"}), 404
     
-    # Return file for download
-    return send_file(
+    prefix = current_app.config.get('DOCUMENT_ACCEL_REDIRECT_PREFIX')
+    if prefix:
+        return _accel_redirect(document, prefix)
+    
+    # Return file for download; Range, If-None-Match and If-Modified-Since are
+    # answered by send_file, and the content hash is a strong ETag.
+    # With USE_X_SENDFILE the body is handed to the front server instead.
+    response = send_file(
         document.file_path,
         as_attachment=True,
-        download_name=document.name
+        download_name=document.name,
+        etag=document.content_hash or True,
+        conditional=True
     )
+    response.headers['Cache-Control'] = 'private, no-cache'
+    return response
+
+@documents_bp.route('/<int:document_id>/thumbnail', methods=['GET'])
+@login_required
+def get_document_thumbnail(document_id):
+    """Get a cached thumbnail or first-page preview for a document"""
+    document = db.session.query(Document).join(Project).filter(
+        Document.id == document_id,
+        Project.user_id == current_user.id
+    ).first_or_404()
+    
+    path = thumbnail_path(document.file_path)
+    if not os.path.isfile(path):
+        # Queue generation in case the file predates thumbnails or a worker restarted
+        if os.path.isfile(document.file_path):
+            schedule_thumbnail(document.file_path, document.file_type)
+        return jsonify({"error": "Thumbnail not available"}), 404
+    
+    # Thumbnails are derived from immutable content, so they can be cached for good
+    response = send_file(path, mimetype='image/jpeg', conditional=True)
+    response.headers['Cache-Control'] = 'private, max-age=31536000, immutable'
+    return response
+
+def _accel_redirect(document, prefix):
+    """Hand the transfer to an nginx internal location after the ownership check"""
+    if document.content_hash and document.content_hash in request.if_none_match:
+        response = current_app.response_class(status=304)
+    else:
+        relative_path = os.path.relpath(os.path.abspath(document.file_path), os.path.abspath(documents_dir()))
+        response = current_app.response_class(
+            mimetype=mimetypes.guess_type(document.name)[0] or 'application/octet-stream'
+        )
+        response.headers['X-Accel-Redirect'] = prefix.rstrip('/') + '/' + relative_path.replace(os.sep, '/')
+        response.headers.set('Content-Disposition', 'attachment', filename=document.name)
+    
+    if document.content_hash:
+        response.set_etag(document.content_hash)
+    response.headers['Cache-Control'] = 'private, no-cache'
+    return response
 
 @documents_bp.route('/', methods=['POST'])
 @login_required
@@ -100,41 +158,231 @@ def upload_document():
     if not allowed_file(file.filename):
         return jsonify({"error": "File type not allowed"}), 400
     
-    # Create unique filename
     original_filename = secure_filename(file.filename)
     file_extension = original_filename.rsplit('.', 1)[1].lower() if '.' in original_filename else ''
-    unique_filename = f"{uuid.uuid4().hex}.{file_extension}"
-    
-    # Ensure upload directory exists
-    upload_dir = os.path.join(current_app.config['UPLOAD_FOLDER'], 'documents')
-    os.makedirs(upload_dir, exist_ok=True)
-    
-    # Save the file
-    file_path = os.path.join(upload_dir, unique_filename)
-    file.save(file_path)
-    
-    # Get file size
-    file_size = os.path.getsize(file_path)
-    
-    # Create document record
-    document = Document(
-        project_id=project_id,
-        name=request.form.get('name') or original_filename,
-        file_path=file_path,
-        file_type=file_extension,
-        file_size=file_size,
-        document_type=request.form.get('document_type', 'other'),
-        description=request.form.get('description', '')
+    
+    # Store the content once, keyed by its SHA-256 computed while copying
+    temp_path, content_hash, file_size = stage_stream(file.stream)
+    
+    with blob_lock():
+        file_path = commit_blob(temp_path, content_hash)
+        
+        # Create document record
+        document = Document(
+            project_id=project_id,
+            name=request.form.get('name') or original_filename,
+            file_path=file_path,
+            file_type=file_extension,
+            file_size=file_size,
+            content_hash=content_hash,
+            document_type=request.form.get('document_type', 'other'),
+            description=request.form.get('description', '')
+        )
+        
+        db.session.add(document)
+        db.session.commit()
+    schedule_thumbnail(document.file_path, document.file_type)
+    schedule_text_extraction(current_app._get_current_object(), document)
+    
+    return jsonify({
+        "message": "Document uploaded successfully",
+        "document": document.to_dict()
+    }), 201
+
+# Chunked, resumable uploads. The client creates an upload session, PUTs
+# raw chunks with an Upload-Offset header (each written straight to a partial
+# file), asks for the current offset after an interruption, and finally
+# completes the session to create the Document row.
+
+STREAM_BUFFER_SIZE = 64 * 1024
+
+def _partial_dir():
+    partial_dir = os.path.join(documents_dir(), '.partial')
+    os.makedirs(partial_dir, exist_ok=True)
+    return partial_dir
+
+def _partial_path(upload):
+    return os.path.join(_partial_dir(), f"{upload.id}.part")
+
+@documents_bp.route('/uploads', methods=['POST'])
+@login_required
+def create_upload():
+    """Start a chunked upload session"""
+    data = request.get_json()
+    
+    if not data.get('project_id'):
+        return jsonify({"error": "Project ID is required"}), 400
+    
+    project = Project.query.filter_by(id=data['project_id'], user_id=current_user.id).first()
+    if not project:
+        return jsonify({"error": "Invalid project ID"}), 400
+    
+    filename = secure_filename(data.get('filename') or '')
+    if not filename or not allowed_file(filename):
+        return jsonify({"error": "File type not allowed"}), 400
+    
+    try:
+        total_size = int(data.get('size'))
+    except (TypeError, ValueError):
+        return jsonify({"error": "File size is required"}), 400
+    
+    if total_size <= 0 or total_size > current_app.config['MAX_DOCUMENT_SIZE']:
+        return jsonify({"error": "File size not allowed"}), 400
+    
+    upload = DocumentUpload(
+        id=uuid.uuid4().hex,
+        user_id=current_user.id,
+        project_id=project.id,
+        filename=filename,
+        file_type=filename.rsplit('.', 1)[1].lower(),
+        total_size=total_size,
+        received_size=0,
+        name=data.get('name') or filename,
+        document_type=data.get('document_type', 'other'),
+        description=data.get('description', '')
     )
     
-    db.session.add(document)
+    # Create the empty partial file so chunks can be written at any offset
+    open(_partial_path(upload), 'wb').close()
+    
+    db.session.add(upload)
+    db.session.commit()
+    
+    response = jsonify({
+        "message": "Upload started",
+        "upload": upload.to_dict(),
+        "chunk_size": current_app.config['UPLOAD_CHUNK_SIZE']
+    })
+    response.headers['Upload-Offset'] = '0'
+    return response, 201
+
+@documents_bp.route('/uploads/<upload_id>', methods=['GET'])
+@login_required
+def get_upload(upload_id):
+    """Get the current offset of an upload so it can be resumed"""
+    upload = DocumentUpload.query.filter_by(id=upload_id, user_id=current_user.id).first_or_404()
+    
+    response = jsonify(upload.to_dict())
+    response.headers['Upload-Offset'] = str(upload.received_size)
+    response.headers['Cache-Control'] = 'no-store'
+    return response, 200
+
+@documents_bp.route('/uploads/<upload_id>', methods=['PUT', 'PATCH'])
+@login_required
+def upload_chunk(upload_id):
+    """Write one chunk of raw bytes at the given offset"""
+    upload = DocumentUpload.query.filter_by(id=upload_id, user_id=current_user.id).first_or_404()
+    if upload_expired(upload):
+        return jsonify({"error": "Upload expired"}), 410
+    
+    offset = request.headers.get('Upload-Offset', type=int)
+    if offset is None or offset < 0:
+        return jsonify({"error": "Upload-Offset header is required"}), 400
+    
+    # Chunks may be re-sent from an earlier offset, but never leave a gap
+    if offset > upload.received_size:
+        response = jsonify({"error": "Offset does not match upload progress", "offset": upload.received_size})
+        response.headers['Upload-Offset'] = str(upload.received_size)
+        return response, 409
+    
+    partial_path = _partial_path(upload)
+    if not os.path.isfile(partial_path):
+        return jsonify({"error": "Upload data not found"}), 410
+    
+    remaining = upload.total_size - offset
+    written = 0
+    disconnected = False
+    
+    with open(partial_path, 'r+b') as partial:
+        partial.seek(offset)
+        try:
+            while True:
+                chunk = request.stream.read(STREAM_BUFFER_SIZE)
+                if not chunk:
+                    break
+                if written + len(chunk) > remaining:
+                    return jsonify({"error": "Chunk exceeds declared file size"}), 400
+                partial.write(chunk)
+                written += len(chunk)
+        except ClientDisconnected:
+            # Keep whatever arrived so the client can resume from there
+            disconnected = True
+    
+    upload.received_size = max(upload.received_size, offset + written)
+    # A re-sent chunk leaves received_size alone but still keeps the session alive
+    upload.updated_at = datetime.utcnow()
     db.session.commit()
     
+    if disconnected:
+        return jsonify({"error": "Upload interrupted", "offset": upload.received_size}), 400
+    
+    response = jsonify(upload.to_dict())
+    response.headers['Upload-Offset'] = str(upload.received_size)
+    return response, 200
+
+@documents_bp.route('/uploads/<upload_id>/complete', methods=['POST'])
+@login_required
+def complete_upload(upload_id):
+    """Finalize a fully received upload into a Document"""
+    upload = DocumentUpload.query.filter_by(id=upload_id, user_id=current_user.id).first_or_404()
+    if upload_expired(upload):
+        return jsonify({"error": "Upload expired"}), 410
+    
+    if upload.received_size < upload.total_size:
+        return jsonify({
+            "error": "Upload is incomplete",
+            "offset": upload.received_size
+        }), 400
+    
+    partial_path = _partial_path(upload)
+    if not os.path.isfile(partial_path):
+        return jsonify({"error": "Upload data not found"}), 410
+    
+    partial_path, content_hash, file_size = stage_file(partial_path)
+    
+    with blob_lock():
+        file_path = commit_blob(partial_path, content_hash)
+        
+        document = Document(
+            project_id=upload.project_id,
+            name=upload.name,
+            file_path=file_path,
+            file_type=upload.file_type,
+            file_size=file_size,
+            content_hash=content_hash,
+            document_type=upload.document_type,
+            description=upload.description
+        )
+        
+        db.session.add(document)
+        db.session.delete(upload)
+        db.session.commit()
+    schedule_thumbnail(document.file_path, document.file_type)
+    schedule_text_extraction(current_app._get_current_object(), document)
+    
     return jsonify({
         "message": "Document uploaded successfully",
         "document": document.to_dict()
     }), 201
 
+@documents_bp.route('/uploads/<upload_id>', methods=['DELETE'])
+@login_required
+def cancel_upload(upload_id):
+    """Cancel an upload and discard the received bytes"""
+    upload = DocumentUpload.query.filter_by(id=upload_id, user_id=current_user.id).first_or_404()
+    partial_path = _partial_path(upload)
+    
+    db.session.delete(upload)
+    db.session.commit()
+    
+    try:
+        if os.path.exists(partial_path):
+            os.remove(partial_path)
+    except OSError as e:
+        print(f"Error deleting file: {e}")
+    
+    return jsonify({"message": "Upload cancelled"}), 200
+
 @documents_bp.route('/<int:document_id>', methods=['PUT'])
 @login_required
 def update_document(document_id):
@@ -179,13 +427,8 @@ def delete_document(document_id):
     db.session.delete(document)
     db.session.commit()
     
-    # Delete file from filesystem
-    try:
-        if os.path.exists(file_path):
-            os.remove(file_path)
-    except OSError as e:
-        # Log the error but don't fail the request
-        print(f"Error deleting file: {e}")
+    # Delete the stored file unless other documents share the same content
+    release_file(file_path)
     
     return jsonify({"message": "Document deleted successfully"}), 200
 
@@ -192,6 +192,11 @@ def update_invoice(invoice_id):
             return jsonify({"error": "Invalid due date format. Use YYYY-MM-DD"}), 400
     
     if 'status' in data:
+        if data['status'] == 'paid' and invoice.status != 'paid':
+            invoice.paid_date = datetime.utcnow().date()
+        elif data['status'] != 'paid':
+            # Only paid invoices carry a payment on the client statement
+            invoice.paid_date = None
         invoice.status = data['status']
     
     if 'notes' in data:
@@ -377,28 +382,23 @@ def generate_invoice_pdf(invoice_id):
 @login_required
 def invoice_stats():
     """Get statistics about invoices"""
-    # Total invoiced amount
-    total_invoiced = db.session.query(
-        db.func.sum(InvoiceItem.quantity * InvoiceItem.unit_price)
+    # Invoiced and paid totals in one pass; FILTER works on SQLite and PostgreSQL
+    amount = InvoiceItem.quantity * InvoiceItem.unit_price
+    totals = db.session.query(
+        db.func.sum(amount),
+        db.func.sum(amount).filter(Invoice.status == 'paid')
     ).join(Invoice).join(Project).filter(
         Project.user_id == current_user.id
-    ).scalar() or 0
+    ).one()
+    total_invoiced = totals[0] or 0
+    total_paid = totals[1] or 0
     
-    # Total paid amount
-    total_paid = db.session.query(
-        db.func.sum(InvoiceItem.quantity * InvoiceItem.unit_price)
-    ).join(Invoice).join(Project).filter(
+    # Count invoices by status
+    status_counts = dict.fromkeys(['draft', 'sent', 'paid', 'overdue'], 0)
+    for status, count in db.session.query(Invoice.status, db.func.count(Invoice.id)).join(Project).filter(
         Project.user_id == current_user.id,
-        Invoice.status == 'paid'
-    ).scalar() or 0
-    
-        # Count invoices by status
-    status_counts = {}
-    for status in ['draft', 'sent', 'paid', 'overdue']:
-        count = db.session.query(Invoice).join(Project).filter(
-            Project.user_id == current_user.id,
-            Invoice.status == status
-        ).count()
+        Invoice.status.in_(list(status_counts))
+    ).group_by(Invoice.status):
         status_counts[status] = count
     
     # Recent invoices
@@ -437,6 +437,8 @@ def mark_invoice_paid(invoice_id):
     ).first_or_404()
     
     # Update status to paid
+    if invoice.status != 'paid':
+        invoice.paid_date = datetime.utcnow().date()
     invoice.status = 'paid'
     db.session.commit()
     
@@ -457,6 +459,7 @@ def mark_invoice_sent(invoice_id):
     
     # Update status to sent
     invoice.status = 'sent'
+    invoice.paid_date = None
     db.session.commit()
     
     return jsonify({
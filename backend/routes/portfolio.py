@@ -3,8 +3,14 @@ from flask_login import current_user, login_required
 from app import db
 from models.user import User
 from models.project import Project
+import json
 import logging
 
+import portfolio_cache
+from portfolio_analytics import record_view, view_stats
+from user_cache import invalidate_user
+from portfolio_cache import bump_portfolio_version
+
 # Create blueprint
 portfolio_bp = Blueprint('portfolio', __name__)
 
@@ -13,19 +19,8 @@ def get_base_url():
     from flask import current_app
     return f"http://{current_app.config['SERVER_NAME'] or 'localhost:5001'}" if current_app.config.get('SERVER_NAME') else 'http://localhost:5001'
 
-@portfolio_bp.route('/<username>', methods=['GET'])
-def get_portfolio(username):
-    """Get a user's public portfolio"""
-    # Find user by username
-    user = User.query.filter_by(username=username).first_or_404()
-    
-    # Check if portfolio is public or user is authenticated
-    if not user.is_public:
-        if not current_user.is_authenticated or current_user.username != username:
-            return jsonify({"error": "This portfolio is private"}), 404
-    
-    logging.debug(f"User profile_image for {username}: {user.profile_image}")
-    
+def build_portfolio(user):
+    """Public portfolio data for a user"""
     # Generate profile_image URL directly, avoiding url_for for static files that start with /static
     base_url = get_base_url()
     profile_image_url = f"{base_url}{user.profile_image}" if user.profile_image else None
@@ -61,14 +56,59 @@ def get_portfolio(username):
         } for project in public_projects
     ]
     
-    response = make_response(jsonify(portfolio), 200)
-    response.headers['Cache-Control'] = 'no-cache, no-store, must-revalidate'
-    response.headers['Pragma'] = 'no-cache'
-    response.headers['Expires'] = '0'
-    response.headers['Content-Type'] = 'application/json'
-    
+    return portfolio
+
+def _portfolio_response(body, etag):
+    if etag in request.if_none_match:
+        response = make_response('', 304)
+    else:
+        response = make_response(body, 200)
+        response.headers['Content-Type'] = 'application/json'
+    response.set_etag(etag)
+    # Clients and proxies may keep a copy but must revalidate with the ETag
+    response.headers['Cache-Control'] = 'public, no-cache'
     return response
 
+@portfolio_bp.route('/<username>', methods=['GET'])
+def get_portfolio(username):
+    """Get a user's public portfolio"""
+    # Only the visibility flag and version are needed to serve a cached copy
+    row = db.session.query(User.id, User.is_public, User.portfolio_version).filter(
+        User.username == username
+    ).first_or_404()
+    
+    if row.is_public:
+        # Counted in memory and flushed in batches
+        record_view(row.id, request.referrer)
+        cached = portfolio_cache.get(username, row.portfolio_version)
+        if cached:
+            return _portfolio_response(*cached)
+    
+    # Find user by username
+    user = User.query.filter_by(username=username).first_or_404()
+    
+    # Check if portfolio is public or user is authenticated
+    if not user.is_public:
+        if not current_user.is_authenticated or current_user.username != username:
+            return jsonify({"error": "This portfolio is private"}), 404
+    
+    logging.debug(f"User profile_image for {username}: {user.profile_image}")
+    
+    portfolio = build_portfolio(user)
+    
+    if not user.is_public:
+        # A private portfolio seen by its owner is never shared or cached
+        response = make_response(jsonify(portfolio), 200)
+        response.headers['Cache-Control'] = 'no-cache, no-store, must-revalidate'
+        response.headers['Pragma'] = 'no-cache'
+        response.headers['Expires'] = '0'
+        response.headers['Content-Type'] = 'application/json'
+        return response
+    
+    body = json.dumps(portfolio, separators=(',', ':')).encode('utf-8')
+    etag = portfolio_cache.put(username, row.portfolio_version, body)
+    return _portfolio_response(body, etag)
+
 @portfolio_bp.route('/settings', methods=['GET'])
 @login_required
 def get_portfolio_settings():
@@ -105,6 +145,9 @@ def get_portfolio_settings():
         } for project in completed_projects
     ]
     
+    # Views buffered in memory show up after the next flush
+    settings['analytics'] = view_stats(current_user.id)
+    
     response = make_response(jsonify(settings), 200)
     response.headers['Cache-Control'] = 'no-cache, no-store, must-revalidate'
     response.headers['Pragma'] = 'no-cache'
@@ -113,6 +156,53 @@ def get_portfolio_settings():
     
     return response
 
+def _update_project_visibility(entries):
+    """Apply is_public flags in bulk; returns the ids that couldn't be updated"""
+    requested = {}
+    rejected = []
+    for project_data in entries:
+        if not isinstance(project_data, dict) or 'id' not in project_data or 'is_public' not in project_data:
+            continue
+        try:
+            requested[int(project_data['id'])] = bool(project_data['is_public'])
+        except (TypeError, ValueError):
+            rejected.append(project_data['id'])
+    if not requested:
+        return rejected
+    
+    # One ownership check; only completed projects may be made public
+    allowed = {
+        project_id: status == 'completed'
+        for project_id, status in db.session.query(Project.id, Project.status).filter(
+            Project.user_id == current_user.id,
+            Project.id.in_(requested)
+        )
+    }
+    
+    make_public = []
+    make_private = []
+    for project_id, is_public in requested.items():
+        if project_id not in allowed or (is_public and not allowed[project_id]):
+            rejected.append(project_id)
+        elif is_public:
+            make_public.append(project_id)
+        else:
+            make_private.append(project_id)
+    
+    if make_public:
+        Project.query.filter(
+            Project.user_id == current_user.id,
+            Project.status == 'completed',
+            Project.id.in_(make_public)
+        ).update({Project.is_public: True}, synchronize_session=False)
+    if make_private:
+        Project.query.filter(
+            Project.user_id == current_user.id,
+            Project.id.in_(make_private)
+        ).update({Project.is_public: False}, synchronize_session=False)
+    
+    return rejected
+
 @portfolio_bp.route('/settings', methods=['PUT'])
 @login_required
 def update_portfolio_settings():
@@ -127,23 +217,19 @@ def update_portfolio_settings():
     if 'is_public' in data:  # Allow updating is_public
         current_user.is_public = bool(data['is_public'])
     
+    bump_portfolio_version(current_user.id)
+    
     # Update project visibility
+    rejected = []
     if 'projects' in data:
-        for project_data in data['projects']:
-            if 'id' in project_data and 'is_public' in project_data:
-                # Verify project belongs to user
-                project = Project.query.filter_by(
-                    id=project_data['id'],
-                    user_id=current_user.id
-                ).first()
-                
-                if project:
-                    project.is_public = bool(project_data['is_public'])  # Ensure boolean conversion
+        rejected = _update_project_visibility(data['projects'])
     
     db.session.commit()
+    invalidate_user(current_user.id)
     
     response = make_response(jsonify({
-        "message": "Portfolio settings updated successfully"
+        "message": "Portfolio settings updated successfully",
+        "rejected_projects": rejected
     }), 200)
     response.headers['Cache-Control'] = 'no-cache, no-store, must-revalidate'
     response.headers['Pragma'] = 'no-cache'
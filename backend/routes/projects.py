@@ -1,11 +1,18 @@
-from flask import Blueprint, request, jsonify
+from flask import Blueprint, request, jsonify, Response, stream_with_context
 from flask_login import current_user, login_required
+from werkzeug.utils import secure_filename
 from datetime import datetime
+import io
+import os
+import zipfile
 import logging
 
 from app import db
 from models.project import Project
 from models.client import Client
+from models.document import Document
+from portfolio_cache import bump_portfolio_version
+from typeahead import invalidate_description_suggestions
 
 projects_bp = Blueprint('projects', __name__)
 
@@ -130,6 +137,7 @@ def update_project(project_id):
     if 'is_public' in data:
         project.is_public = data['is_public']
     
+    bump_portfolio_version(current_user.id)
     db.session.commit()
     
     return jsonify({
@@ -143,7 +151,10 @@ def delete_project(project_id):
     project = Project.query.filter_by(id=project_id, user_id=current_user.id).first_or_404()
     
     db.session.delete(project)
+    bump_portfolio_version(current_user.id)
     db.session.commit()
+    # The project's time entries went with it
+    invalidate_description_suggestions(current_user.id)
     
     return jsonify({"message": "Project deleted successfully"}), 200
 
@@ -185,9 +196,102 @@ def toggle_project_public(project_id):
         }), 400
     
     project.is_public = request.json.get('is_public', not project.is_public)
+    bump_portfolio_version(current_user.id)
     db.session.commit()
     
     return jsonify({
         "message": f"Project visibility {'enabled' if project.is_public else 'disabled'} for portfolio",
         "project": project.to_dict()
     }), 200
+
+
+# Formats that are already compressed are stored as-is in project archives
+STORED_FILE_TYPES = {'pdf', 'png', 'jpg', 'jpeg', 'gif', 'docx', 'xlsx'}
+
+ZIP_READ_SIZE = 64 * 1024
+
+class _ZipStreamBuffer(io.RawIOBase):
+    """Unseekable sink for zipfile that hands written bytes back to a generator"""
+    
+    def __init__(self):
+        self._chunks = []
+    
+    def writable(self):
+        return True
+    
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        return len(data)
+    
+    def pop(self):
+        data = b''.join(self._chunks)
+        self._chunks = []
+        return data
+
+def _archive_name(document, used_names):
+    """Pick a unique, safe file name inside the archive"""
+    name = secure_filename(document.name or '') or f"document-{document.id}"
+    if document.file_type and not name.lower().endswith(f".{document.file_type}"):
+        name = f"{name}.{document.file_type}"
+    
+    base, dot, extension = name.rpartition('.')
+    if not dot:
+        base, extension = name, ''
+    candidate = name
+    counter = 2
+    while candidate.lower() in used_names:
+        candidate = f"{base} ({counter}).{extension}" if extension else f"{base} ({counter})"
+        counter += 1
+    used_names.add(candidate.lower())
+    return candidate
+
+def _generate_zip(documents):
+    buffer = _ZipStreamBuffer()
+    used_names = set()
+    
+    with zipfile.ZipFile(buffer, mode='w') as archive:
+        for document in documents:
+            if not os.path.isfile(document.file_path):
+                logging.warning(f"Skipping missing file for document {document.id}: {document.file_path}")
+                continue
+            
+            info = zipfile.ZipInfo(
+                _archive_name(document, used_names),
+                date_time=(document.uploaded_at or datetime.utcnow()).timetuple()[:6]
+            )
+            info.compress_type = (
+                zipfile.ZIP_STORED if (document.file_type or '').lower() in STORED_FILE_TYPES
+                else zipfile.ZIP_DEFLATED
+            )
+            # Known size up front lets zipfile decide on ZIP64 without seeking
+            info.file_size = os.path.getsize(document.file_path)
+            
+            with open(document.file_path, 'rb') as source, archive.open(info, mode='w') as target:
+                while True:
+                    chunk = source.read(ZIP_READ_SIZE)
+                    if not chunk:
+                        break
+                    target.write(chunk)
+                    yield buffer.pop()
+            yield buffer.pop()
+    
+    # Central directory
+    yield buffer.pop()
+
+@projects_bp.route('/<int:project_id>/documents.zip', methods=['GET'])
+@login_required
+def download_project_documents(project_id):
+    """Stream a ZIP of all documents for a project"""
+    project = Project.query.filter_by(id=project_id, user_id=current_user.id).first_or_404()
+    document_type = request.args.get('document_type')
+    
+    query = Document.query.filter_by(project_id=project.id)
+    if document_type:
+        query = query.filter_by(document_type=document_type)
+    documents = query.order_by(Document.uploaded_at).all()
+    
+    archive_name = secure_filename(project.title) or f"project-{project.id}"
+    response = Response(stream_with_context(_generate_zip(documents)), mimetype='application/zip')
+    response.headers.set('Content-Disposition', 'attachment', filename=f"{archive_name}-documents.zip")
+    response.headers['Cache-Control'] = 'no-store'
+    return response
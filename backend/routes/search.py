@@ -0,0 +1,27 @@
+from flask import Blueprint, request, jsonify
+from flask_login import current_user, login_required
+
+from search_index import search
+
+search_bp = Blueprint('search', __name__)
+
+@search_bp.route('', methods=['GET'])
+@search_bp.route('/', methods=['GET'])
+@login_required
+def global_search():
+    """Full-text search across clients, projects, time entries, invoices and documents"""
+    query = request.args.get('q', '').strip()
+    page = max(request.args.get('page', 1, type=int), 1)
+    per_page = min(max(request.args.get('per_page', 20, type=int), 1), 100)
+    
+    if not query:
+        return jsonify({"results": [], "page": page, "per_page": per_page, "has_more": False}), 200
+    
+    results = search(current_user.id, query, limit=per_page + 1, offset=(page - 1) * per_page)
+    
+    return jsonify({
+        "results": results[:per_page],
+        "page": page,
+        "per_page": per_page,
+        "has_more": len(results) > per_page
+    }), 200
@@ -6,6 +6,7 @@ from sqlalchemy import func
 from app import db
 from models.time_entry import TimeEntry
 from models.project import Project
+from typeahead import get_description_suggestions, record_description, invalidate_description_suggestions
 
 time_entries_bp = Blueprint('time_entries', __name__)
 
@@ -109,6 +110,7 @@ def create_time_entry():
     
     db.session.add(time_entry)
     db.session.commit()
+    record_description(current_user.id, time_entry.project_id, time_entry.description, time_entry.date)
     
     return jsonify({
         "message": "Time entry created successfully",
@@ -163,6 +165,7 @@ def update_time_entry(entry_id):
         entry.invoiced = data['invoiced']
     
     db.session.commit()
+    invalidate_description_suggestions(current_user.id)
     
     return jsonify({
         "message": "Time entry updated successfully",
@@ -185,9 +188,24 @@ def delete_time_entry(entry_id):
     
     db.session.delete(entry)
     db.session.commit()
+    invalidate_description_suggestions(current_user.id)
     
     return jsonify({"message": "Time entry deleted successfully"}), 200
 
+@time_entries_bp.route('/suggest', methods=['GET'])
+@login_required
+def suggest_descriptions():
+    """Suggest frequent and recent descriptions for a project"""
+    project_id = request.args.get('project_id', type=int)
+    query = request.args.get('q', '')
+    limit = min(max(request.args.get('limit', 10, type=int), 1), 50)
+    
+    if not project_id:
+        return jsonify({"error": "Project ID is required"}), 400
+    
+    suggestions = get_description_suggestions(current_user.id)
+    return jsonify(suggestions.suggest(project_id, query, limit)), 200
+
 @time_entries_bp.route('/summary', methods=['GET'])
 @login_required
 def time_summary():
@@ -217,22 +235,18 @@ def time_summary():
     # Calculate summary statistics
     summary = {}
     
-    # Total hours in date range
-    hours_query = db.session.query(func.sum(TimeEntry.hours)).join(Project).filter(
+    # Total and billable hours in one pass; FILTER works on SQLite and PostgreSQL
+    totals = db.session.query(
+        func.sum(TimeEntry.hours),
+        func.sum(TimeEntry.hours).filter(TimeEntry.billable == True)
+    ).join(Project).filter(
         Project.user_id == current_user.id,
         TimeEntry.date >= start_date,
         TimeEntry.date <= end_date
-    )
+    ).one()
     
-    summary['total_hours'] = hours_query.scalar() or 0
-    
-    # Billable hours and percentage
-    billable_hours = db.session.query(func.sum(TimeEntry.hours)).join(Project).filter(
-        Project.user_id == current_user.id,
-        TimeEntry.date >= start_date,
-        TimeEntry.date <= end_date,
-        TimeEntry.billable == True
-    ).scalar() or 0
+    summary['total_hours'] = totals[0] or 0
+    billable_hours = totals[1] or 0
     
     summary['billable_hours'] = billable_hours
     summary['billable_percentage'] = (billable_hours / summary['total_hours'] * 100) if summary['total_hours'] > 0 else 0
@@ -253,20 +267,23 @@ def time_summary():
         for p in project_hours
     ]
     
-    # Hours by day (for charts)
+    # Hours by day (for charts), with empty days filled in
+    hours_by_date = dict(db.session.query(
+        TimeEntry.date,
+        func.sum(TimeEntry.hours)
+    ).join(Project).filter(
+        Project.user_id == current_user.id,
+        TimeEntry.date >= start_date,
+        TimeEntry.date <= end_date
+    ).group_by(TimeEntry.date).all())
+    
     day_hours = []
     current_date = start_date
     while current_date <= end_date:
-        hours = db.session.query(func.sum(TimeEntry.hours)).join(Project).filter(
-            Project.user_id == current_user.id,
-            TimeEntry.date == current_date
-        ).scalar() or 0
-        
         day_hours.append({
             'date': current_date.isoformat(),
-            'hours': hours
+            'hours': hours_by_date.get(current_date) or 0
         })
-        
         current_date += timedelta(days=1)
     
     summary['hours_by_day'] = day_hours
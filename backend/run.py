@@ -1,15 +1,80 @@
 import os
 import argparse
 import logging
-from app import create_app
+import multiprocessing
+from gunicorn.app.base import BaseApplication
+from app import create_app, db
+from config import config_by_name
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-def main():
-    """Run the Flask application with configurable settings."""
-    # Parse command line arguments
+def flush_buffers():
+    """Finish queued background work and write in-memory counters; run as a worker exits"""
+    from background import shutdown_background_tasks
+    from portfolio_analytics import shutdown_portfolio_analytics
+
+    # Background tasks first: they may still commit portfolio changes
+    shutdown_background_tasks(wait=True)
+    shutdown_portfolio_analytics()
+
+def _post_fork(server, worker):
+    # Connections opened by the master must not be shared with workers
+    app = worker.app.application
+    if app is not None:
+        with app.app_context():
+            db.engine.dispose(close=False)
+
+def _worker_exit(server, worker):
+    logger.info(f"Worker {worker.pid} exiting; flushing buffers")
+    try:
+        flush_buffers()
+    except Exception as e:
+        logger.error(f"Flushing buffers failed: {str(e)}")
+
+class ProductionServer(BaseApplication):
+    """Gunicorn serving the API.
+
+    With preload, pass the app created once in the master; the workers are
+    forked from it. Without, each worker calls create_app(config_class) itself.
+    """
+
+    def __init__(self, config_class, options=None, application=None):
+        self.config_class = config_class
+        self.application = application
+        self.options = options or {}
+        super().__init__()
+
+    def load_config(self):
+        for key, value in self.options.items():
+            if key in self.cfg.settings and value is not None:
+                self.cfg.set(key.lower(), value)
+        self.cfg.set('post_fork', _post_fork)
+        self.cfg.set('worker_exit', _worker_exit)
+
+    def load(self):
+        if self.application is None:
+            self.application = create_app(self.config_class)
+        return self.application
+
+def server_options(args):
+    """Gunicorn settings from the command line arguments"""
+    return {
+        'bind': f"{args.host}:{args.port}",
+        'workers': args.workers,
+        'threads': args.threads,
+        'worker_class': args.worker_class,
+        'preload_app': args.preload,
+        'max_requests': args.max_requests,
+        'max_requests_jitter': args.max_requests_jitter,
+        'timeout': args.timeout,
+        'graceful_timeout': args.graceful_timeout,
+        'accesslog': '-'
+    }
+
+def parse_args(argv=None):
+    """Parse the command line arguments"""
     parser = argparse.ArgumentParser(description='Run the Freelance Manager API server')
     parser.add_argument(
         '--env',
@@ -28,6 +93,54 @@ def main():
         default='127.0.0.1',
         help='Host to run the server on (default: 127.0.0.1)'
     )
+    # Production server (gunicorn) settings, used with --env prod
+    parser.add_argument(
+        '--workers',
+        type=int,
+        default=int(os.environ.get('WEB_CONCURRENCY', multiprocessing.cpu_count() * 2 + 1)),
+        help='Gunicorn worker processes (default: WEB_CONCURRENCY or 2 * CPUs + 1)'
+    )
+    parser.add_argument(
+        '--threads',
+        type=int,
+        default=int(os.environ.get('GUNICORN_THREADS', 1)),
+        help='Threads per worker; more than 1 implies the gthread worker class (default: 1)'
+    )
+    parser.add_argument(
+        '--worker-class',
+        default=os.environ.get('GUNICORN_WORKER_CLASS', 'sync'),
+        help='Gunicorn worker class, e.g. sync or gthread (default: sync)'
+    )
+    parser.add_argument(
+        '--preload',
+        action=argparse.BooleanOptionalAction,
+        default=True,
+        help='Load the app in the master before forking workers (default: on)'
+    )
+    parser.add_argument(
+        '--max-requests',
+        type=int,
+        default=1000,
+        help='Restart a worker after this many requests; 0 disables (default: 1000)'
+    )
+    parser.add_argument(
+        '--max-requests-jitter',
+        type=int,
+        default=100,
+        help='Random extra requests so workers do not restart together (default: 100)'
+    )
+    parser.add_argument(
+        '--timeout',
+        type=int,
+        default=60,
+        help='Seconds before a silent worker is killed and restarted (default: 60)'
+    )
+    parser.add_argument(
+        '--graceful-timeout',
+        type=int,
+        default=30,
+        help='Seconds workers get to finish requests and flush buffers on shutdown (default: 30)'
+    )
     parser.add_argument(
         '--setup-db',
         action='store_true',
@@ -39,7 +152,11 @@ def main():
         help='Seed the database with test data before starting the server'
     )
 
-    args = parser.parse_args()
+    return parser.parse_args(argv)
+
+def main():
+    """Run the Flask application with configurable settings."""
+    args = parse_args()
 
     # Set environment variables based on environment
     if args.env == 'dev':
@@ -52,12 +169,14 @@ def main():
         os.environ['FLASK_ENV'] = 'production'
         os.environ['FLASK_DEBUG'] = '0'
 
-    # Create the app instance
-    try:
-        app = create_app()
-    except Exception as e:
-        logger.error(f"Failed to create Flask app: {str(e)}")
-        raise
+    # Create the app instance, unless only the forked workers need it
+    app = None
+    if args.env != 'prod' or args.preload or args.setup_db or args.seed_db:
+        try:
+            app = create_app(config_by_name[args.env])
+        except Exception as e:
+            logger.error(f"Failed to create Flask app: {str(e)}")
+            raise
 
     # Run database migrations if requested
     if args.setup_db:
@@ -92,7 +211,15 @@ def main():
     # Start the server
     logger.info(f"Starting server in {args.env} mode on {args.host}:{args.port}")
     try:
-        app.run(host=args.host, port=args.port, debug=(args.env != 'prod'))
+        if args.env == 'prod':
+            if app is not None:
+                with app.app_context():
+                    db.engine.dispose()
+            # With --preload the workers inherit this app; otherwise each builds its own
+            ProductionServer(config_by_name[args.env], server_options(args),
+                             application=app if args.preload else None).run()
+        else:
+            app.run(host=args.host, port=args.port, debug=True)
     except Exception as e:
         logger.error(f"Failed to run server: {str(e)}")
         raise
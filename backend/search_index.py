@@ -0,0 +1,452 @@
+import re
+import html
+import logging
+from sqlalchemy import event, inspect, text, bindparam, table, column
+
+from extensions import db
+
+# Each indexed row gets a stable FTS rowid derived from its kind and primary
+# key, so updates and deletes hit the index by rowid instead of scanning.
+KIND_CODES = {
+    'client': 1,
+    'project': 2,
+    'time_entry': 3,
+    'invoice': 4,
+    'invoice_item': 5,
+    'document': 6
+}
+
+_TERM_RE = re.compile(r'\w+', re.UNICODE)
+
+# Documents are backfilled in batches of this size
+BATCH_SIZE = 500
+
+CREATE_SQL = """
+    CREATE VIRTUAL TABLE IF NOT EXISTS search_index USING fts5(
+        title,
+        body,
+        kind UNINDEXED,
+        ref_id UNINDEXED,
+        parent_id UNINDEXED,
+        user_id UNINDEXED,
+        tokenize = 'unicode61 remove_diacritics 2'
+    )
+"""
+
+# Extracted document text lives in its own table keyed by document id
+# (rowid), with the name and description alongside so one MATCH covers all
+# three. 'extracted' is 0 until the background extractor has run.
+CONTENT_CREATE_SQL = """
+    CREATE VIRTUAL TABLE IF NOT EXISTS document_content USING fts5(
+        name,
+        description,
+        content,
+        extracted UNINDEXED,
+        tokenize = 'unicode61 remove_diacritics 2'
+    )
+"""
+
+# Title and description hits outrank matches deep inside the body
+CONTENT_RANK_SQL = "INSERT INTO document_content (document_content, rank) VALUES ('rank', 'bm25(10.0, 5.0, 1.0)')"
+
+# On PostgreSQL the same two tables are ordinary tables with a generated,
+# GIN-indexed tsvector column. Weights A > B > C mirror the bm25 weights.
+PG_CREATE_SQL = [
+    """
+    CREATE TABLE IF NOT EXISTS search_index (
+        rowid BIGINT PRIMARY KEY,
+        title TEXT NOT NULL DEFAULT '',
+        body TEXT NOT NULL DEFAULT '',
+        kind VARCHAR(20) NOT NULL,
+        ref_id INTEGER NOT NULL,
+        parent_id INTEGER,
+        user_id INTEGER,
+        document TSVECTOR GENERATED ALWAYS AS (
+            setweight(to_tsvector('simple', title), 'A') || setweight(to_tsvector('simple', body), 'B')
+        ) STORED
+    )
+    """,
+    "CREATE INDEX IF NOT EXISTS ix_search_index_document ON search_index USING GIN (document)",
+    "CREATE INDEX IF NOT EXISTS ix_search_index_user_id ON search_index (user_id)",
+    """
+    CREATE TABLE IF NOT EXISTS document_content (
+        rowid INTEGER PRIMARY KEY,
+        name TEXT NOT NULL DEFAULT '',
+        description TEXT NOT NULL DEFAULT '',
+        content TEXT NOT NULL DEFAULT '',
+        extracted INTEGER NOT NULL DEFAULT 0,
+        document TSVECTOR GENERATED ALWAYS AS (
+            setweight(to_tsvector('simple', name), 'A') ||
+            setweight(to_tsvector('simple', description), 'B') ||
+            setweight(to_tsvector('simple', content), 'C')
+        ) STORED
+    )
+    """,
+    "CREATE INDEX IF NOT EXISTS ix_document_content_document ON document_content USING GIN (document)"
+]
+
+# ts_rank weights in {D, C, B, A} order
+PG_SEARCH_WEIGHTS = '{0.1, 0.1, 0.1, 1.0}'
+PG_CONTENT_WEIGHTS = '{0.1, 0.1, 0.5, 1.0}'
+
+document_content = table(
+    'document_content', column('rowid'), column('rank'), column('document_content'), column('document')
+)
+
+def _rowid(kind, ref_id):
+    return ref_id * 8 + KIND_CODES[kind]
+
+def _join(*parts):
+    return '\n'.join(part for part in parts if part)
+
+def _is_sqlite(connection):
+    return connection.dialect.name == 'sqlite'
+
+def _is_postgresql(connection):
+    return connection.dialect.name == 'postgresql'
+
+def _is_supported(connection):
+    return _is_sqlite(connection) or _is_postgresql(connection)
+
+def _create_index(target, connection, **kw):
+    if _is_sqlite(connection):
+        connection.execute(text(CREATE_SQL))
+        connection.execute(text(CONTENT_CREATE_SQL))
+        connection.execute(text(CONTENT_RANK_SQL))
+    elif _is_postgresql(connection):
+        for statement in PG_CREATE_SQL:
+            connection.execute(text(statement))
+
+def _drop_index(target, connection, **kw):
+    if _is_supported(connection):
+        connection.execute(text("DROP TABLE IF EXISTS search_index"))
+        connection.execute(text("DROP TABLE IF EXISTS document_content"))
+
+def _write(connection, kind, ref_id, parent_id, user_id, title, body):
+    rowid = _rowid(kind, ref_id)
+    connection.execute(text("DELETE FROM search_index WHERE rowid = :rowid"), {'rowid': rowid})
+    connection.execute(text("""
+        INSERT INTO search_index (rowid, title, body, kind, ref_id, parent_id, user_id)
+        VALUES (:rowid, :title, :body, :kind, :ref_id, :parent_id, :user_id)
+    """), {
+        'rowid': rowid,
+        'title': title or '',
+        'body': body or '',
+        'kind': kind,
+        'ref_id': ref_id,
+        'parent_id': parent_id,
+        'user_id': user_id
+    })
+
+def _project_owner(connection, project_id):
+    return connection.execute(
+        text("SELECT user_id FROM project WHERE id = :id"), {'id': project_id}
+    ).scalar()
+
+def _invoice_owner(connection, invoice_id):
+    return connection.execute(text("""
+        SELECT p.user_id FROM invoice i JOIN project p ON p.id = i.project_id
+        WHERE i.id = :id
+    """), {'id': invoice_id}).scalar()
+
+# Each builder returns (parent_id, user_id, title, body) for one row
+def _client_doc(connection, client):
+    return None, client.user_id, client.name, _join(client.company, client.email, client.notes)
+
+def _project_doc(connection, project):
+    return project.client_id, project.user_id, project.title, project.description
+
+def _time_entry_doc(connection, entry):
+    return entry.project_id, _project_owner(connection, entry.project_id), entry.description, None
+
+def _invoice_doc(connection, invoice):
+    return (invoice.project_id, _project_owner(connection, invoice.project_id),
+            invoice.invoice_number, invoice.notes)
+
+def _invoice_item_doc(connection, item):
+    return item.invoice_id, _invoice_owner(connection, item.invoice_id), item.description, None
+
+def _document_doc(connection, document):
+    return (document.project_id, _project_owner(connection, document.project_id),
+            document.name, document.description)
+
+def _make_listeners(kind, fields, build):
+    def after_insert(mapper, connection, target):
+        if _is_supported(connection):
+            _write(connection, kind, target.id, *build(connection, target))
+
+    def after_update(mapper, connection, target):
+        if not _is_supported(connection):
+            return
+        state = inspect(target)
+        if any(state.attrs[field].history.has_changes() for field in fields):
+            _write(connection, kind, target.id, *build(connection, target))
+
+    def after_delete(mapper, connection, target):
+        if _is_supported(connection):
+            connection.execute(text("DELETE FROM search_index WHERE rowid = :rowid"),
+                               {'rowid': _rowid(kind, target.id)})
+
+    return after_insert, after_update, after_delete
+
+def _indexed_models():
+    from models.client import Client
+    from models.project import Project
+    from models.time_entry import TimeEntry
+    from models.invoice import Invoice, InvoiceItem
+    from models.document import Document
+
+    return [
+        (Client, 'client', ('name', 'company', 'email', 'notes'), _client_doc),
+        (Project, 'project', ('title', 'description', 'client_id'), _project_doc),
+        (TimeEntry, 'time_entry', ('description', 'project_id'), _time_entry_doc),
+        (Invoice, 'invoice', ('invoice_number', 'notes', 'project_id'), _invoice_doc),
+        (InvoiceItem, 'invoice_item', ('description',), _invoice_item_doc),
+        (Document, 'document', ('name', 'description', 'project_id'), _document_doc)
+    ]
+
+def _document_content_inserted(mapper, connection, target):
+    if _is_supported(connection):
+        connection.execute(text("""
+            INSERT INTO document_content (rowid, name, description, content, extracted)
+            VALUES (:id, :name, :description, '', 0)
+        """), {'id': target.id, 'name': target.name or '', 'description': target.description or ''})
+
+def _document_content_updated(mapper, connection, target):
+    if not _is_supported(connection):
+        return
+    state = inspect(target)
+    if state.attrs.name.history.has_changes() or state.attrs.description.history.has_changes():
+        connection.execute(text("""
+            UPDATE document_content SET name = :name, description = :description WHERE rowid = :id
+        """), {'id': target.id, 'name': target.name or '', 'description': target.description or ''})
+
+def _document_content_deleted(mapper, connection, target):
+    if _is_supported(connection):
+        connection.execute(text("DELETE FROM document_content WHERE rowid = :id"), {'id': target.id})
+
+_listeners_registered = False
+
+def init_search_index(app):
+    """Register DDL and mapper hooks that keep the FTS5 index in sync with writes"""
+    global _listeners_registered
+    if _listeners_registered:
+        return
+
+    event.listen(db.metadata, 'after_create', _create_index)
+    event.listen(db.metadata, 'before_drop', _drop_index)
+
+    for model, kind, fields, build in _indexed_models():
+        after_insert, after_update, after_delete = _make_listeners(kind, fields, build)
+        event.listen(model, 'after_insert', after_insert)
+        event.listen(model, 'after_update', after_update)
+        event.listen(model, 'after_delete', after_delete)
+
+    from models.document import Document
+    event.listen(Document, 'after_insert', _document_content_inserted)
+    event.listen(Document, 'after_update', _document_content_updated)
+    event.listen(Document, 'after_delete', _document_content_deleted)
+
+    _listeners_registered = True
+
+def build_match_query(query):
+    """Turn free text into a safe FTS5 expression: every term, prefix-matched"""
+    terms = _TERM_RE.findall(query)
+    return ' '.join(f'"{term}"*' for term in terms)
+
+def build_tsquery(query):
+    """The PostgreSQL to_tsquery equivalent of build_match_query"""
+    terms = _TERM_RE.findall(query.lower())
+    return ' & '.join(f"'{term}':*" for term in terms)
+
+# Matches are delimited with control characters rather than <mark>, so the
+# indexed text can be HTML-escaped before the tags are added; the text is
+# user-authored and would otherwise reach the client as markup.
+HIGHLIGHT_START = '\x02'
+HIGHLIGHT_STOP = '\x03'
+
+def _highlighted_html(value):
+    """Escape indexed text and turn the match delimiters into <mark> tags"""
+    return html.escape(value or '').replace(HIGHLIGHT_START, '<mark>').replace(HIGHLIGHT_STOP, '</mark>')
+
+PG_SEARCH_SQL = text(f"""
+    SELECT kind, ref_id, parent_id,
+           ts_headline('simple', title, q, :title_options) AS title,
+           ts_headline('simple', body, q, :snippet_options) AS snippet,
+           -ts_rank('{PG_SEARCH_WEIGHTS}', document, q) AS score
+    FROM search_index, to_tsquery('simple', :match) AS q
+    WHERE document @@ q AND user_id = :user_id
+    ORDER BY score, rowid
+    LIMIT :limit OFFSET :offset
+""")
+
+def search(user_id, query, limit=20, offset=0):
+    """Return ranked, highlighted hits for a user; fetches one extra row for paging"""
+    dialect = db.session.get_bind().dialect.name
+    match = build_tsquery(query) if dialect == 'postgresql' else build_match_query(query)
+    if not match:
+        return []
+
+    if dialect == 'postgresql':
+        rows = db.session.execute(PG_SEARCH_SQL, {
+            'match': match, 'user_id': user_id, 'limit': limit, 'offset': offset,
+            'title_options': f'StartSel={HIGHLIGHT_START}, StopSel={HIGHLIGHT_STOP}, HighlightAll=true',
+            'snippet_options': f'StartSel={HIGHLIGHT_START}, StopSel={HIGHLIGHT_STOP}, MaxWords=16, MinWords=8'
+        }).all()
+    else:
+        rows = _sqlite_search(match, user_id, limit, offset)
+
+    return [
+        {
+            'type': row.kind,
+            'id': row.ref_id,
+            'parent_id': row.parent_id,
+            'title': _highlighted_html(row.title),
+            'snippet': _highlighted_html(row.snippet),
+            'score': row.score
+        } for row in rows
+    ]
+
+def _sqlite_search(match, user_id, limit, offset):
+    return db.session.execute(text("""
+        SELECT kind, ref_id, parent_id,
+               highlight(search_index, 0, :start, :stop) AS title,
+               snippet(search_index, 1, :start, :stop, '...', 16) AS snippet,
+               bm25(search_index, 10.0, 1.0) AS score
+        FROM search_index
+        WHERE search_index MATCH :match AND user_id = :user_id
+        ORDER BY score
+        LIMIT :limit OFFSET :offset
+    """), {
+        'match': match, 'user_id': user_id, 'limit': limit, 'offset': offset,
+        'start': HIGHLIGHT_START, 'stop': HIGHLIGHT_STOP
+    }).all()
+
+# Set-based backfill, one INSERT ... SELECT per source table, keyed by kind
+# together with the id column used to restrict it to specific rows. Each
+# statement takes a :newline parameter, which joins the client fields.
+REBUILD_SQL = {
+    'client': ("""
+    INSERT INTO search_index (rowid, title, body, kind, ref_id, parent_id, user_id)
+    SELECT c.id * 8 + 1, c.name,
+           COALESCE(c.company, '') || :newline || COALESCE(c.email, '') || :newline || COALESCE(c.notes, ''),
+           'client', c.id, NULL, c.user_id
+    FROM client c
+    """, 'c.id'),
+    'project': ("""
+    INSERT INTO search_index (rowid, title, body, kind, ref_id, parent_id, user_id)
+    SELECT p.id * 8 + 2, p.title, COALESCE(p.description, ''), 'project', p.id, p.client_id, p.user_id
+    FROM project p
+    """, 'p.id'),
+    'time_entry': ("""
+    INSERT INTO search_index (rowid, title, body, kind, ref_id, parent_id, user_id)
+    SELECT t.id * 8 + 3, t.description, '', 'time_entry', t.id, t.project_id, p.user_id
+    FROM time_entry t JOIN project p ON p.id = t.project_id
+    """, 't.id'),
+    'invoice': ("""
+    INSERT INTO search_index (rowid, title, body, kind, ref_id, parent_id, user_id)
+    SELECT i.id * 8 + 4, i.invoice_number, COALESCE(i.notes, ''), 'invoice', i.id, i.project_id, p.user_id
+    FROM invoice i JOIN project p ON p.id = i.project_id
+    """, 'i.id'),
+    'invoice_item': ("""
+    INSERT INTO search_index (rowid, title, body, kind, ref_id, parent_id, user_id)
+    SELECT ii.id * 8 + 5, ii.description, '', 'invoice_item', ii.id, ii.invoice_id, p.user_id
+    FROM invoice_item ii
+    JOIN invoice i ON i.id = ii.invoice_id
+    JOIN project p ON p.id = i.project_id
+    """, 'ii.id'),
+    'document': ("""
+    INSERT INTO search_index (rowid, title, body, kind, ref_id, parent_id, user_id)
+    SELECT d.id * 8 + 6, d.name, COALESCE(d.description, ''), 'document', d.id, d.project_id, p.user_id
+    FROM document d JOIN project p ON p.id = d.project_id
+    """, 'd.id')
+}
+
+def index_rows(kind, ids):
+    """Index rows written with bulk statements, which bypass the mapper events"""
+    if not ids or db.session.get_bind().dialect.name not in ('sqlite', 'postgresql'):
+        return
+    # Re-indexed rows are replaced; rowid is the primary key on PostgreSQL
+    db.session.execute(
+        text("DELETE FROM search_index WHERE rowid IN :rowids").bindparams(bindparam('rowids', expanding=True)),
+        {'rowids': [_rowid(kind, ref_id) for ref_id in ids]}
+    )
+    sql, id_column = REBUILD_SQL[kind]
+    statement = text(f"{sql} WHERE {id_column} IN :ids").bindparams(bindparam('ids', expanding=True))
+    db.session.execute(statement, {'ids': list(ids), 'newline': '\n'})
+
+def filter_documents_by_content(query, search_text):
+    """Restrict a Document query to content/name/description matches, best first"""
+    from models.document import Document
+
+    dialect = db.session.get_bind().dialect.name
+    if dialect == 'postgresql' and build_tsquery(search_text):
+        tsquery = db.func.to_tsquery('simple', build_tsquery(search_text))
+        return query.join(
+            document_content, document_content.c.rowid == Document.id
+        ).filter(
+            document_content.c.document.op('@@')(tsquery)
+        ).order_by(db.func.ts_rank(PG_CONTENT_WEIGHTS, document_content.c.document, tsquery).desc(), Document.id)
+
+    match = build_match_query(search_text)
+    if not match or dialect != 'sqlite':
+        return query.filter(db.or_(
+            Document.name.ilike(f'%{search_text}%'),
+            Document.description.ilike(f'%{search_text}%')
+        ))
+    return query.join(
+        document_content, document_content.c.rowid == Document.id
+    ).filter(
+        document_content.c.document_content.op('MATCH')(match)
+    ).order_by(document_content.c.rank)
+
+def store_document_text(document_id, content):
+    """Save extracted text for a document, creating its row if it predates the index"""
+    with db.engine.begin() as connection:
+        updated = connection.execute(text("""
+            UPDATE document_content SET content = :content, extracted = 1 WHERE rowid = :id
+        """), {'id': document_id, 'content': content}).rowcount
+        if not updated:
+            connection.execute(text("""
+                INSERT INTO document_content (rowid, name, description, content, extracted)
+                SELECT id, COALESCE(name, ''), COALESCE(description, ''), :content, 1
+                FROM document WHERE id = :id
+            """), {'id': document_id, 'content': content})
+
+def documents_pending_extraction(after_id=0, limit=BATCH_SIZE):
+    """Return (id, file_path, file_type) for documents whose text hasn't been extracted"""
+    return db.session.execute(text("""
+        SELECT d.id, d.file_path, d.file_type
+        FROM document d
+        LEFT JOIN document_content c ON c.rowid = d.id
+        WHERE d.id > :after_id AND (c.rowid IS NULL OR c.extracted = 0)
+        ORDER BY d.id
+        LIMIT :limit
+    """), {'after_id': after_id, 'limit': limit}).all()
+
+def rebuild_search_index():
+    """Repopulate the search index from the existing tables"""
+    with db.engine.begin() as connection:
+        if _is_postgresql(connection):
+            for statement in PG_CREATE_SQL:
+                connection.execute(text(statement))
+            connection.execute(text("TRUNCATE search_index"))
+            for statement, _ in REBUILD_SQL.values():
+                connection.execute(text(statement), {'newline': '\n'})
+            return
+        if not _is_sqlite(connection):
+            logging.warning("Full-text search index requires SQLite FTS5 or PostgreSQL; skipping rebuild")
+            return
+        connection.execute(text("DROP TABLE IF EXISTS search_index"))
+        connection.execute(text(CREATE_SQL))
+        for statement, _ in REBUILD_SQL.values():
+            connection.execute(text(statement), {'newline': '\n'})
+        connection.execute(text("INSERT INTO search_index (search_index) VALUES ('optimize')"))
+
+if __name__ == "__main__":
+    from app import create_app
+
+    app = create_app()
+    with app.app_context():
+        rebuild_search_index()
+        print("Search index rebuilt successfully.")
@@ -1,6 +1,7 @@
 import os
 import sys
 import pytest
+import io
 import json
 from datetime import datetime
 
@@ -8,23 +9,59 @@ from datetime import datetime
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
 from app import create_app, db
+from config import TestingConfig
+import user_cache
+import token_revocation
+import login_throttle
 from models.user import User
 from models.client import Client
 from models.project import Project
+from models.invoice import Invoice, InvoiceItem
+from models.document import Document
+
+def _reset_module_state():
+    """Finish background work and forget cached state tied to the current app's database.
+    
+    create_app binds module-level state (the background pool, the view
+    flusher and the caches) to the newest app, so this runs before an app's
+    database is dropped.
+    """
+    from background import shutdown_background_tasks
+    from portfolio_analytics import shutdown_portfolio_analytics
+    import portfolio_cache
+    import typeahead
+    
+    shutdown_background_tasks(wait=True)
+    shutdown_portfolio_analytics()
+    user_cache.clear()
+    token_revocation.clear()
+    login_throttle.clear()
+    portfolio_cache.clear()
+    typeahead.clear()
+
+@pytest.fixture
+def upload_dir(tmp_path):
+    """A throwaway upload folder, so stored blobs never land in the source tree"""
+    path = tmp_path / 'uploads'
+    path.mkdir()
+    return str(path)
 
 @pytest.fixture
-def app():
+def app(tmp_path, upload_dir):
     """Create and configure a Flask app for testing"""
-    # Create the app with a test configuration
-    app = create_app()
-    app.config.update({
-        'TESTING': True,
-        'SQLALCHEMY_DATABASE_URI': 'sqlite:///:memory:',
-        'SECRET_KEY': 'test-key',
-        'WTF_CSRF_ENABLED': False
-    })
+    # The engine is created inside create_app, so the database and upload
+    # folder must be set on the config class rather than afterwards
+    class TestConfig(TestingConfig):
+        SQLALCHEMY_DATABASE_URI = f"sqlite:///{tmp_path / 'test.db'}"
+        STATIC_FOLDER = str(tmp_path / 'static')
+        UPLOAD_FOLDER = upload_dir
+        SECRET_KEY = 'test-key'
+        WTF_CSRF_ENABLED = False
+        TRUSTED_PROXIES = 1
     
-    # Create the database and the database tables
+    # Create the app, the database and the database tables
+    app = create_app(TestConfig)
+    _reset_module_state()
     with app.app_context():
         db.create_all()
         
@@ -54,7 +91,9 @@ def app():
     
     # Clean up
     with app.app_context():
+        _reset_module_state()
         db.drop_all()
+        db.engine.dispose()
 
 @pytest.fixture
 def client(app):
@@ -152,3 +191,1075 @@ def test_unauthorized_access(client):
     
     response = client.get('/api/auth/user')
     assert response.status_code == 401
+
+def test_client_statement(client, auth_header, app):
+    """Test the client statement running balance and pagination"""
+    with app.app_context():
+        test_client = Client.query.first()
+        project = Project(user_id=test_client.user_id, client_id=test_client.id,
+                          title='Ledger Project', status='active')
+        db.session.add(project)
+        db.session.commit()
+        for number, (issued, amount, paid) in enumerate([
+            ('2024-01-10', 100.0, '2024-01-20'),
+            ('2024-02-10', 250.0, None),
+        ]):
+            invoice = Invoice(
+                project_id=project.id,
+                invoice_number=f'INV-TEST-{number}',
+                issue_date=datetime.strptime(issued, '%Y-%m-%d').date(),
+                status='paid' if paid else 'sent',
+                paid_date=datetime.strptime(paid, '%Y-%m-%d').date() if paid else None
+            )
+            db.session.add(invoice)
+            db.session.flush()
+            db.session.add(InvoiceItem(invoice_id=invoice.id, description='Work',
+                                       quantity=1, unit_price=amount))
+        db.session.commit()
+        client_id = test_client.id
+    
+    response = client.get(f'/api/clients/{client_id}/statement?limit=2', headers=auth_header)
+    assert response.status_code == 200
+    data = json.loads(response.data)
+    assert [e['type'] for e in data['entries']] == ['invoice', 'payment']
+    assert data['entries'][-1]['balance'] == 0
+    assert data['next_cursor']
+    
+    response = client.get(
+        f"/api/clients/{client_id}/statement?cursor={data['next_cursor']}",
+        headers=auth_header
+    )
+    data = json.loads(response.data)
+    assert len(data['entries']) == 1
+    assert data['opening_balance'] == 0
+    assert data['closing_balance'] == 250
+    assert data['next_cursor'] is None
+    
+    # Later pages start from the balance carried in the cursor
+    response = client.get(f'/api/clients/{client_id}/statement?limit=1', headers=auth_header)
+    cursor = json.loads(response.data)['next_cursor']
+    assert cursor.endswith(':100.0')
+    response = client.get(f'/api/clients/{client_id}/statement?limit=1&cursor={cursor}', headers=auth_header)
+    data = json.loads(response.data)
+    assert data['opening_balance'] == 100
+    assert [e['balance'] for e in data['entries']] == [0]
+    
+    # A date range opens with the balance of everything before it
+    response = client.get(f'/api/clients/{client_id}/statement?start_date=2024-01-15', headers=auth_header)
+    data = json.loads(response.data)
+    assert data['opening_balance'] == 100
+    assert [(e['type'], e['balance']) for e in data['entries']] == [('payment', 0), ('invoice', 250)]
+    
+    # Moving an invoice out of paid drops its payment from the statement
+    with app.app_context():
+        invoice_id = Invoice.query.filter_by(invoice_number='INV-TEST-0').first().id
+    response = client.post(f'/api/invoices/{invoice_id}/mark-sent', headers=auth_header)
+    assert json.loads(response.data)['invoice']['paid_date'] is None
+    response = client.get(f'/api/clients/{client_id}/statement', headers=auth_header)
+    assert [e['type'] for e in json.loads(response.data)['entries']] == ['invoice', 'invoice']
+
+def test_client_typeahead(client, auth_header, app, monkeypatch):
+    """Test prefix search, invalidation on client changes and the bounded cache"""
+    response = client.post('/api/clients/', headers=auth_header, json={
+        'name': 'Jane Doe',
+        'email': 'jane@widgets.io',
+        'company': 'Widget Works'
+    })
+    assert response.status_code == 201
+    
+    response = client.get('/api/clients/typeahead?q=wid', headers=auth_header)
+    data = json.loads(response.data)
+    assert [c['name'] for c in data] == ['Jane Doe']
+    
+    response = client.get('/api/clients/typeahead?q=test com', headers=auth_header)
+    data = json.loads(response.data)
+    assert [c['name'] for c in data] == ['Test Client']
+    
+    # Deleting a client drops it at once, not after the TTL
+    jane_id = json.loads(client.get('/api/clients/typeahead?q=jane', headers=auth_header).data)[0]['id']
+    client.delete(f'/api/clients/{jane_id}', headers=auth_header)
+    assert json.loads(client.get('/api/clients/typeahead?q=wid', headers=auth_header).data) == []
+    
+    # Only the most recently used users keep an index
+    import typeahead
+    monkeypatch.setattr(typeahead, 'MAX_INDEX_USERS', 2)
+    with app.app_context():
+        for user_id in (101, 102, 103):
+            typeahead.get_client_index(user_id)
+    assert list(typeahead._indexes) == [102, 103]
+
+def test_deletes_with_foreign_keys_enforced(client, auth_header, app):
+    """Test deletes still succeed or are refused cleanly with SQLite foreign keys on"""
+    from datetime import date
+    from models.time_entry import TimeEntry
+    from models.document import DocumentUpload
+    
+    with app.app_context():
+        assert db.session.execute(db.text("PRAGMA foreign_keys")).scalar() == 1
+        user_id = User.query.first().id
+        client_id = Client.query.first().id
+        project = Project(user_id=user_id, client_id=client_id, title='Dependents')
+        db.session.add(project)
+        db.session.flush()
+        invoice = Invoice(project_id=project.id, invoice_number='FK-1', issue_date=date(2024, 1, 1),
+                          due_date=date(2024, 1, 15))
+        db.session.add(invoice)
+        db.session.flush()
+        db.session.add_all([
+            InvoiceItem(invoice_id=invoice.id, description='Work', quantity=1, unit_price=10),
+            TimeEntry(project_id=project.id, description='Work', date=date(2024, 1, 1), hours=1),
+            Document(project_id=project.id, name='a.txt', file_path='missing.txt', file_type='txt'),
+            DocumentUpload(id='fk-upload', user_id=user_id, project_id=project.id, filename='b.txt',
+                           file_type='txt', total_size=10)
+        ])
+        db.session.commit()
+        project_id = project.id
+    
+    # A client with projects is refused by the route, not by an IntegrityError
+    response = client.delete(f'/api/clients/{client_id}', headers=auth_header)
+    assert response.status_code == 400
+    
+    # Deleting a project removes its dependents through the ORM cascades
+    response = client.delete(f'/api/projects/{project_id}', headers=auth_header)
+    assert response.status_code == 200
+    with app.app_context():
+        for model in (TimeEntry, Invoice, InvoiceItem, Document, DocumentUpload):
+            assert db.session.query(model).count() == 0
+        assert db.session.execute(db.text("PRAGMA foreign_key_check")).all() == []
+    
+    response = client.delete(f'/api/clients/{client_id}', headers=auth_header)
+    assert response.status_code == 200
+
+def test_global_search(client, auth_header, app):
+    """Test that writes are indexed and search is scoped to the current user"""
+    with app.app_context():
+        client_id = Client.query.first().id
+    
+    client.post('/api/projects/', headers=auth_header, json={
+        'title': 'Bakery website',
+        'client_id': client_id,
+        'description': 'Online ordering for sourdough loaves'
+    })
+    
+    response = client.get('/api/search?q=sourd', headers=auth_header)
+    assert response.status_code == 200
+    data = json.loads(response.data)
+    assert len(data['results']) == 1
+    assert data['results'][0]['type'] == 'project'
+    assert '<mark>' in data['results'][0]['snippet']
+    
+    with app.app_context():
+        from search_index import rebuild_search_index
+        rebuild_search_index()
+    
+    response = client.get('/api/search?q=test client', headers=auth_header)
+    data = json.loads(response.data)
+    assert [r['type'] for r in data['results']] == ['client']
+    
+    # User-authored text is escaped; only the highlight tags are markup
+    client.post('/api/projects/', headers=auth_header, json={
+        'title': 'Bakery <b>menu</b>',
+        'client_id': client_id,
+        'description': '<img src=x onerror=alert(1)> pastry menu'
+    })
+    response = client.get('/api/search?q=pastry', headers=auth_header)
+    result = json.loads(response.data)['results'][0]
+    assert result['title'] == 'Bakery &lt;b&gt;menu&lt;/b&gt;'
+    assert '<img' not in result['snippet']
+    assert '&lt;img src=x onerror=alert(1)&gt; <mark>pastry</mark> menu' in result['snippet']
+
+def test_import_clients(client, auth_header, app):
+    """Test CSV and vCard import with deduplication and dry run"""
+    csv_data = (
+        b"Name,Email,Company\n"
+        b"Alice Smith,alice@example.com,Acme\n"
+        b"Duplicate,CLIENT@example.com,Dup Co\n"
+        b",nobody@example.com,No Name\n"
+    )
+    response = client.post('/api/clients/import', headers=auth_header, data={
+        'file': (io.BytesIO(csv_data), 'contacts.csv'),
+        'dry_run': 'true'
+    })
+    assert response.status_code == 200
+    data = json.loads(response.data)
+    assert (data['created'], data['skipped'], data['errors']) == (1, 1, 1)
+    with app.app_context():
+        assert Client.query.count() == 1
+    
+    vcard_data = (
+        b"BEGIN:VCARD\r\nVERSION:3.0\r\nFN:Bob Jones\r\n"
+        b"EMAIL;TYPE=work:bob@example.com\r\nORG:Jones Ltd;Sales\r\n"
+        b"NOTE:Prefers email\\, never calls\r\nEND:VCARD\r\n"
+    )
+    response = client.post('/api/clients/import', headers=auth_header, data={
+        'file': (io.BytesIO(vcard_data), 'contacts.vcf')
+    })
+    assert response.status_code == 201
+    with app.app_context():
+        bob = Client.query.filter_by(email='bob@example.com').one()
+        assert bob.company == 'Jones Ltd'
+        assert bob.notes == 'Prefers email, never calls'
+    
+    response = client.get('/api/search?q=jones', headers=auth_header)
+    assert len(json.loads(response.data)['results']) == 1
+
+def test_time_entry_suggestions(client, auth_header, app):
+    """Test description suggestions ranked by frequency"""
+    with app.app_context():
+        client_id = Client.query.first().id
+    response = client.post('/api/projects/', headers=auth_header, json={
+        'title': 'Suggest Project', 'client_id': client_id
+    })
+    project_id = json.loads(response.data)['project']['id']
+    
+    for description in ['Code review', 'Client call', 'Code review', 'Coding']:
+        client.post('/api/time/', headers=auth_header, json={
+            'project_id': project_id, 'hours': 1, 'description': description
+        })
+    
+    response = client.get(f'/api/time/suggest?project_id={project_id}&q=co', headers=auth_header)
+    assert response.status_code == 200
+    data = json.loads(response.data)
+    assert [s['description'] for s in data][:1] == ['Code review']
+    assert data[0]['count'] == 2
+    assert 'Client call' not in [s['description'] for s in data]
+    
+    # Deleting the project drops its descriptions from the cached suggestions
+    client.delete(f'/api/projects/{project_id}', headers=auth_header)
+    response = client.get(f'/api/time/suggest?project_id={project_id}&q=co', headers=auth_header)
+    assert json.loads(response.data) == []
+
+def _stored_blobs(upload_dir):
+    """Names of the blobs stored under a test's upload folder"""
+    root = os.path.join(upload_dir, 'documents', 'blobs')
+    return [name for _, _, names in os.walk(root) for name in names]
+
+def test_chunked_document_upload(client, auth_header, app):
+    """Test chunked upload with resume and completion"""
+    with app.app_context():
+        client_id = Client.query.first().id
+    response = client.post('/api/projects/', headers=auth_header, json={
+        'title': 'Upload Project', 'client_id': client_id
+    })
+    project_id = json.loads(response.data)['project']['id']
+    content = b'0123456789' * 10
+    
+    response = client.post('/api/documents/uploads', headers=auth_header, json={
+        'project_id': project_id, 'filename': 'notes.txt', 'size': len(content)
+    })
+    assert response.status_code == 201
+    upload_id = json.loads(response.data)['upload']['id']
+    
+    response = client.put(f'/api/documents/uploads/{upload_id}', data=content[:40],
+                          headers={**auth_header, 'Upload-Offset': '0'})
+    assert response.headers['Upload-Offset'] == '40'
+    
+    # A gap is rejected, then the client resumes from the reported offset
+    response = client.put(f'/api/documents/uploads/{upload_id}', data=content[60:],
+                          headers={**auth_header, 'Upload-Offset': '60'})
+    assert response.status_code == 409
+    offset = int(client.get(f'/api/documents/uploads/{upload_id}', headers=auth_header).headers['Upload-Offset'])
+    response = client.put(f'/api/documents/uploads/{upload_id}', data=content[offset:],
+                          headers={**auth_header, 'Upload-Offset': str(offset)})
+    assert response.status_code == 200
+    
+    response = client.post(f'/api/documents/uploads/{upload_id}/complete', headers=auth_header)
+    assert response.status_code == 201
+    document_id = json.loads(response.data)['document']['id']
+    
+    response = client.get(f'/api/documents/{document_id}/download', headers=auth_header)
+    assert response.data == content
+    client.delete(f'/api/documents/{document_id}', headers=auth_header)
+
+def test_document_deduplication(client, auth_header, app, upload_dir):
+    """Test identical uploads share one blob until the last reference is deleted"""
+    with app.app_context():
+        client_id = Client.query.first().id
+    response = client.post('/api/projects/', headers=auth_header, json={
+        'title': 'Dedup Project', 'client_id': client_id
+    })
+    project_id = json.loads(response.data)['project']['id']
+    
+    documents = []
+    for name in ['contract.pdf', 'copy.pdf']:
+        response = client.post('/api/documents/', headers=auth_header, data={
+            'project_id': project_id,
+            'file': (io.BytesIO(b'%PDF-1.4 same bytes'), name)
+        })
+        assert response.status_code == 201
+        documents.append(json.loads(response.data)['document'])
+    
+    assert documents[0]['file_path'] == documents[1]['file_path']
+    assert documents[0]['file_path'].startswith(upload_dir)
+    assert documents[0]['content_hash'] == documents[1]['content_hash']
+    
+    response = client.get(f"/api/documents/{documents[0]['id']}/download", headers=auth_header)
+    assert response.headers['ETag'] == f'"{documents[0]["content_hash"]}"'
+    
+    client.delete(f"/api/documents/{documents[0]['id']}", headers=auth_header)
+    assert os.path.exists(documents[1]['file_path'])
+    client.delete(f"/api/documents/{documents[1]['id']}", headers=auth_header)
+    assert not os.path.exists(documents[1]['file_path'])
+    
+    # An identical upload that reuses the blob holds the lock until its row
+    # commits, so a concurrent release sees the new reference and keeps the file
+    import threading
+    import time
+    from document_storage import blob_lock, stage_stream, commit_blob, release_file
+    
+    with app.app_context():
+        client.post('/api/documents/', headers=auth_header, data={
+            'project_id': project_id, 'file': (io.BytesIO(b'%PDF-1.4 same bytes'), 'first.pdf')
+        })
+        first = Document.query.filter_by(name='first.pdf').first()
+        file_path = first.file_path
+        db.session.delete(first)
+        db.session.commit()
+        
+        released = []
+        def release():
+            with app.app_context():
+                released.append(release_file(file_path))
+        
+        temp_path, content_hash, size = stage_stream(io.BytesIO(b'%PDF-1.4 same bytes'))
+        with blob_lock():
+            assert commit_blob(temp_path, content_hash) == file_path
+            releaser = threading.Thread(target=release)
+            releaser.start()
+            time.sleep(0.2)
+            assert not released
+            db.session.add(Document(project_id=project_id, name='second.pdf', file_path=file_path,
+                                    file_type='pdf', content_hash=content_hash))
+            db.session.commit()
+        releaser.join()
+        assert released == [False]
+        assert os.path.exists(file_path)
+        
+        # The orphan collector checks references under the same lock, so a
+        # blob reused while it runs is not removed from under the new row
+        from document_storage import collect_orphans
+        for document in Document.query.filter_by(project_id=project_id).all():
+            db.session.delete(document)
+        db.session.commit()
+        
+        collected = []
+        def collect():
+            with app.app_context():
+                collected.append(collect_orphans(delete=True, min_age_seconds=0))
+        
+        temp_path, content_hash, size = stage_stream(io.BytesIO(b'%PDF-1.4 same bytes'))
+        with blob_lock():
+            assert commit_blob(temp_path, content_hash) == file_path
+            collector = threading.Thread(target=collect)
+            collector.start()
+            time.sleep(0.2)
+            assert not collected
+            db.session.add(Document(project_id=project_id, name='third.pdf', file_path=file_path,
+                                    file_type='pdf', content_hash=content_hash))
+            db.session.commit()
+        collector.join()
+        assert file_path not in collected[0]['orphan_files']
+        assert os.path.exists(file_path)
+
+def test_document_download_range_and_conditional(client, auth_header, app):
+    """Test Range, If-None-Match and X-Accel-Redirect on downloads"""
+    with app.app_context():
+        client_id = Client.query.first().id
+    response = client.post('/api/projects/', headers=auth_header, json={
+        'title': 'Download Project', 'client_id': client_id
+    })
+    project_id = json.loads(response.data)['project']['id']
+    response = client.post('/api/documents/', headers=auth_header, data={
+        'project_id': project_id,
+        'file': (io.BytesIO(b'abcdefghijklmnopqrstuvwxyz'), 'alphabet.txt')
+    })
+    document = json.loads(response.data)['document']
+    url = f"/api/documents/{document['id']}/download"
+    
+    response = client.get(url, headers={**auth_header, 'Range': 'bytes=2-4'})
+    assert response.status_code == 206
+    assert response.data == b'cde'
+    
+    etag = f'"{document["content_hash"]}"'
+    response = client.get(url, headers={**auth_header, 'If-None-Match': etag})
+    assert response.status_code == 304
+    
+    app.config['DOCUMENT_ACCEL_REDIRECT_PREFIX'] = '/protected-documents'
+    response = client.get(url, headers=auth_header)
+    content_hash = document['content_hash']
+    assert response.headers['X-Accel-Redirect'] == (
+        f"/protected-documents/blobs/{content_hash[:2]}/{content_hash[2:4]}/{content_hash}"
+    )
+    assert response.data == b''
+    
+    client.delete(f"/api/documents/{document['id']}", headers=auth_header)
+
+def test_document_thumbnail(client, auth_header, app):
+    """Test thumbnails are generated in the background and cached"""
+    from PIL import Image
+    import time
+    
+    with app.app_context():
+        client_id = Client.query.first().id
+    response = client.post('/api/projects/', headers=auth_header, json={
+        'title': 'Thumbnail Project', 'client_id': client_id
+    })
+    project_id = json.loads(response.data)['project']['id']
+    
+    image_data = io.BytesIO()
+    Image.new('RGB', (1200, 600), (200, 30, 30)).save(image_data, 'PNG')
+    image_data.seek(0)
+    response = client.post('/api/documents/', headers=auth_header, data={
+        'project_id': project_id,
+        'file': (image_data, 'mockup.png')
+    })
+    document_id = json.loads(response.data)['document']['id']
+    
+    url = f'/api/documents/{document_id}/thumbnail'
+    for _ in range(50):
+        response = client.get(url, headers=auth_header)
+        if response.status_code == 200:
+            break
+        time.sleep(0.1)
+    assert response.status_code == 200
+    assert 'immutable' in response.headers['Cache-Control']
+    assert Image.open(io.BytesIO(response.data)).size == (320, 160)
+    
+    client.delete(f'/api/documents/{document_id}', headers=auth_header)
+
+def test_project_documents_zip(client, auth_header, app, upload_dir):
+    """Test the streamed project archive and its document_type filter"""
+    import zipfile
+    
+    with app.app_context():
+        client_id = Client.query.first().id
+    response = client.post('/api/projects/', headers=auth_header, json={
+        'title': 'Zip Project', 'client_id': client_id
+    })
+    project_id = json.loads(response.data)['project']['id']
+    for name, content, document_type in [
+        ('spec.txt', b'spec ' * 100, 'specification'),
+        ('spec.txt', b'second spec', 'specification'),
+        ('contract.pdf', b'%PDF-1.4 contract', 'contract')
+    ]:
+        client.post('/api/documents/', headers=auth_header, data={
+            'project_id': project_id,
+            'document_type': document_type,
+            'file': (io.BytesIO(content), name)
+        })
+    
+    response = client.get(f'/api/projects/{project_id}/documents.zip', headers=auth_header)
+    assert response.status_code == 200
+    archive = zipfile.ZipFile(io.BytesIO(response.data))
+    assert sorted(archive.namelist()) == ['contract.pdf', 'spec (2).txt', 'spec.txt']
+    assert archive.getinfo('contract.pdf').compress_type == zipfile.ZIP_STORED
+    assert archive.getinfo('spec.txt').compress_type == zipfile.ZIP_DEFLATED
+    assert archive.read('spec.txt') == b'spec ' * 100
+    
+    response = client.get(f'/api/projects/{project_id}/documents.zip?document_type=contract',
+                          headers=auth_header)
+    assert zipfile.ZipFile(io.BytesIO(response.data)).namelist() == ['contract.pdf']
+    
+    client.delete(f'/api/projects/{project_id}', headers=auth_header)
+    # Deleting the project removes only rows; its blobs stay in the temporary folder
+    assert _stored_blobs(upload_dir)
+
+def test_storage_migration_and_orphan_gc(client, auth_header, app, upload_dir):
+    """Test moving legacy files into the sharded layout and collecting orphans"""
+    from document_storage import documents_dir, blob_path, migrate_to_sharded_layout, collect_orphans
+    
+    with app.app_context():
+        # The collector deletes files, so it must only ever see the test's own folder
+        assert documents_dir().startswith(upload_dir)
+        project = Project(user_id=User.query.first().id, client_id=Client.query.first().id,
+                          title='Legacy Project')
+        db.session.add(project)
+        db.session.commit()
+        
+        legacy_paths = []
+        for name in ['legacy-a.txt', 'legacy-b.txt']:
+            path = os.path.join(documents_dir(), name)
+            with open(path, 'wb') as f:
+                f.write(b'legacy content')
+            legacy_paths.append(path)
+            db.session.add(Document(project_id=project.id, name=name, file_path=path, file_type='txt'))
+        orphan_path = os.path.join(documents_dir(), 'orphan.txt')
+        with open(orphan_path, 'wb') as f:
+            f.write(b'nobody references me')
+        db.session.commit()
+        
+        stats = migrate_to_sharded_layout()
+        assert stats['moved'] == 2
+        documents = Document.query.filter_by(project_id=project.id).all()
+        assert {d.file_path for d in documents} == {blob_path(documents[0].content_hash)}
+        assert not any(os.path.exists(path) for path in legacy_paths)
+        
+        report = collect_orphans(delete=False, min_age_seconds=0)
+        assert orphan_path in report['orphan_files']
+        assert os.path.exists(orphan_path)
+        collect_orphans(delete=True, min_age_seconds=0)
+        assert not os.path.exists(orphan_path)
+        assert os.path.exists(documents[0].file_path)
+        
+        db.session.delete(project)
+        db.session.commit()
+        collect_orphans(delete=True, min_age_seconds=0)
+
+def test_expired_upload_sessions(client, auth_header, app):
+    """Test idle upload sessions are refused and collected with their partial file"""
+    from datetime import timedelta
+    from document_storage import documents_dir, collect_orphans
+    from models.document import DocumentUpload
+    
+    with app.app_context():
+        client_id = Client.query.first().id
+    response = client.post('/api/projects/', headers=auth_header, json={
+        'title': 'Abandoned Upload Project', 'client_id': client_id
+    })
+    project_id = json.loads(response.data)['project']['id']
+    response = client.post('/api/documents/uploads', headers=auth_header, json={
+        'project_id': project_id, 'filename': 'notes.txt', 'size': 100
+    })
+    upload_id = json.loads(response.data)['upload']['id']
+    client.put(f'/api/documents/uploads/{upload_id}', data=b'x' * 40,
+               headers={**auth_header, 'Upload-Offset': '0'})
+    
+    with app.app_context():
+        partial_path = os.path.join(documents_dir(), '.partial', f"{upload_id}.part")
+        report = collect_orphans(delete=False, min_age_seconds=0)
+        assert report['expired_uploads'] == 0
+        
+        upload = db.session.get(DocumentUpload, upload_id)
+        upload.updated_at = datetime.utcnow() - timedelta(hours=app.config['UPLOAD_SESSION_TTL_HOURS'] + 1)
+        db.session.commit()
+    
+    response = client.put(f'/api/documents/uploads/{upload_id}', data=b'x' * 60,
+                          headers={**auth_header, 'Upload-Offset': '40'})
+    assert response.status_code == 410
+    
+    with app.app_context():
+        report = collect_orphans(delete=False, min_age_seconds=0)
+        assert report['expired_uploads'] == 1
+        assert report['orphan_bytes'] >= 40
+        assert os.path.exists(partial_path)
+        
+        collect_orphans(delete=True, min_age_seconds=0)
+        assert db.session.get(DocumentUpload, upload_id) is None
+        assert not os.path.exists(partial_path)
+    
+    client.delete(f'/api/projects/{project_id}', headers=auth_header)
+
+def test_document_content_search(client, auth_header, app, upload_dir):
+    """Test document text is extracted in the background and searchable with q="""
+    import time
+    import zipfile
+    
+    with app.app_context():
+        client_id = Client.query.first().id
+    response = client.post('/api/projects/', headers=auth_header, json={
+        'title': 'Content Project', 'client_id': client_id
+    })
+    project_id = json.loads(response.data)['project']['id']
+    
+    docx = io.BytesIO()
+    with zipfile.ZipFile(docx, 'w') as archive:
+        archive.writestr('word/document.xml', (
+            '<w:document xmlns:w="http://schemas.openxmlformats.org/wordprocessingml/2006/main">'
+            '<w:body><w:p><w:r><w:t>Indemnification clause</w:t></w:r></w:p></w:body></w:document>'
+        ))
+    docx.seek(0)
+    uploads = [
+        (docx, 'agreement.docx'),
+        (io.BytesIO(b'Payment terms: net thirty days'), 'terms.txt')
+    ]
+    for data, name in uploads:
+        client.post('/api/documents/', headers=auth_header, data={
+            'project_id': project_id, 'file': (data, name)
+        })
+    
+    for _ in range(50):
+        response = client.get('/api/documents/?q=indemnif', headers=auth_header)
+        if json.loads(response.data):
+            break
+        time.sleep(0.1)
+    assert [d['name'] for d in json.loads(response.data)] == ['agreement.docx']
+    
+    # Name matches work before extraction and rank above body matches
+    response = client.get('/api/documents/?q=terms', headers=auth_header)
+    assert [d['name'] for d in json.loads(response.data)] == ['terms.txt']
+    
+    client.delete(f'/api/projects/{project_id}', headers=auth_header)
+    # Deleting the project removes only rows; its blobs stay in the temporary folder
+    assert _stored_blobs(upload_dir)
+
+def test_profile_image_variants(client, auth_header, upload_dir):
+    """Test profile images are resized, stripped and served with immutable caching"""
+    from PIL import Image
+    
+    image_data = io.BytesIO()
+    exif = Image.Exif()
+    exif[0x010F] = 'PhoneMaker'
+    Image.new('RGB', (2000, 1000), (10, 120, 200)).save(image_data, 'JPEG', exif=exif)
+    image_data.seek(0)
+    
+    response = client.post('/api/auth/user/profile-image', headers=auth_header, data={
+        'profile_image': (image_data, 'me.jpg')
+    })
+    assert response.status_code == 200
+    variants = json.loads(response.data)['variants']
+    assert os.path.exists(os.path.join(upload_dir, variants['webp']['128'].rsplit('/', 1)[-1]))
+    
+    response = client.get(variants['webp']['128'])
+    assert response.status_code == 200
+    assert response.headers['Cache-Control'] == 'public, max-age=31536000, immutable'
+    assert Image.open(io.BytesIO(response.data)).size == (128, 64)
+    
+    response = client.get(variants['jpg']['512'])
+    image = Image.open(io.BytesIO(response.data))
+    assert image.size == (512, 256)
+    assert not image.getexif()
+    
+    response = client.post('/api/auth/user/profile-image', headers=auth_header, data={
+        'profile_image': (io.BytesIO(b'not an image'), 'me.jpg')
+    })
+    assert response.status_code == 400
+
+def test_portfolio_cache_and_etag(client, auth_header, app):
+    """Test cached portfolio responses, 304s and invalidation on changes"""
+    import portfolio_cache
+    portfolio_cache.clear()
+    
+    response = client.get('/api/portfolio/testuser')
+    assert response.status_code == 200
+    etag = response.headers['ETag']
+    assert json.loads(response.data)['bio'] is None
+    
+    response = client.get('/api/portfolio/testuser', headers={'If-None-Match': etag})
+    assert response.status_code == 304
+    
+    client.put('/api/portfolio/settings', headers=auth_header, json={'bio': 'Hello there'})
+    
+    response = client.get('/api/portfolio/testuser', headers={'If-None-Match': etag})
+    assert response.status_code == 200
+    assert response.headers['ETag'] != etag
+    assert json.loads(response.data)['bio'] == 'Hello there'
+
+def test_portfolio_snapshots(client, auth_header, app, tmp_path, monkeypatch):
+    """Test snapshots are written after portfolio changes and served statically"""
+    import time
+    from portfolio_snapshots import regenerate_all_snapshots
+    
+    client.put('/api/portfolio/settings', headers=auth_header, json={'bio': 'Snapshot <bio>'})
+    
+    for _ in range(50):
+        response = client.get('/static/portfolios/testuser.json')
+        if response.status_code == 200 and json.loads(response.data)['bio'] == 'Snapshot <bio>':
+            break
+        time.sleep(0.1)
+    assert json.loads(response.data)['bio'] == 'Snapshot <bio>'
+    response = client.get('/static/portfolios/testuser.html')
+    assert b'Snapshot &lt;bio&gt;' in response.data
+    assert (tmp_path / 'static' / 'portfolios' / 'testuser.html').exists()
+    
+    # Concurrent renders of the same snapshot never share a temp file
+    from concurrent.futures import ThreadPoolExecutor
+    from portfolio_snapshots import render_user_snapshot
+    with app.app_context():
+        user_id = User.query.first().id
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        list(executor.map(lambda _: render_user_snapshot(app, user_id), range(16)))
+    assert json.loads((tmp_path / 'static' / 'portfolios' / 'testuser.json').read_bytes())['bio'] == 'Snapshot <bio>'
+    assert not list((tmp_path / 'static' / 'portfolios').glob('*.tmp'))
+    
+    # A render still building when the user goes private must not put the
+    # files back after the newer render removed them
+    import threading
+    import routes.portfolio
+    build_portfolio = routes.portfolio.build_portfolio
+    building, release = threading.Event(), threading.Event()
+    def slow_build(user):
+        building.set()
+        release.wait(5)
+        return build_portfolio(user)
+    monkeypatch.setattr(routes.portfolio, 'build_portfolio', slow_build)
+    stale_render = threading.Thread(target=render_user_snapshot, args=(app, user_id))
+    stale_render.start()
+    assert building.wait(5)
+    monkeypatch.setattr(routes.portfolio, 'build_portfolio', build_portfolio)
+    client.put('/api/portfolio/settings', headers=auth_header, json={'is_public': False})
+    time.sleep(0.2)
+    release.set()
+    stale_render.join()
+    for _ in range(50):
+        if not (tmp_path / 'static' / 'portfolios' / 'testuser.html').exists():
+            break
+        time.sleep(0.1)
+    assert not (tmp_path / 'static' / 'portfolios' / 'testuser.json').exists()
+    assert not (tmp_path / 'static' / 'portfolios' / 'testuser.html').exists()
+    client.put('/api/portfolio/settings', headers=auth_header, json={'is_public': True})
+    
+    with app.app_context():
+        assert regenerate_all_snapshots(workers=2) == 1
+        User.query.first().is_public = False
+        db.session.commit()
+        regenerate_all_snapshots(workers=2)
+    assert client.get('/static/portfolios/testuser.json').status_code == 404
+
+def test_bulk_project_visibility(client, auth_header, app):
+    """Test portfolio settings update project visibility in bulk and report rejected ids"""
+    with app.app_context():
+        client_id = Client.query.first().id
+        user_id = User.query.first().id
+        completed = Project(user_id=user_id, client_id=client_id, title='Done', status='completed')
+        active = Project(user_id=user_id, client_id=client_id, title='Ongoing', status='active', is_public=True)
+        db.session.add_all([completed, active])
+        db.session.commit()
+        completed_id, active_id = completed.id, active.id
+    
+    response = client.put('/api/portfolio/settings', headers=auth_header, json={'projects': [
+        {'id': completed_id, 'is_public': True},
+        {'id': active_id, 'is_public': False},
+        {'id': 9999, 'is_public': True}
+    ]})
+    assert response.status_code == 200
+    assert json.loads(response.data)['rejected_projects'] == [9999]
+    
+    response = client.put('/api/portfolio/settings', headers=auth_header, json={'projects': [
+        {'id': active_id, 'is_public': True}
+    ]})
+    assert json.loads(response.data)['rejected_projects'] == [active_id]
+    
+    with app.app_context():
+        assert db.session.get(Project, completed_id).is_public is True
+        assert db.session.get(Project, active_id).is_public is False
+
+def test_portfolio_view_analytics(client, auth_header, app):
+    """Test portfolio views are buffered, flushed and reported in settings"""
+    from portfolio_analytics import flush_portfolio_views, shutdown_portfolio_analytics
+    from models.portfolio_view import PortfolioViewDaily
+    
+    # Start from an empty buffer with a fresh flush timer
+    shutdown_portfolio_analytics()
+    with app.app_context():
+        PortfolioViewDaily.query.delete()
+        db.session.commit()
+    
+    client.get('/api/portfolio/testuser', headers={'Referer': 'https://www.linkedin.com/in/someone'})
+    client.get('/api/portfolio/testuser', headers={'Referer': 'https://www.linkedin.com/feed'})
+    client.get('/api/portfolio/testuser')
+    
+    with app.app_context():
+        assert db.session.execute(db.text("SELECT COUNT(*) FROM portfolio_view_daily")).scalar() == 0
+    assert flush_portfolio_views() == 3
+    
+    client.get('/api/portfolio/testuser')
+    assert flush_portfolio_views() == 1
+    
+    response = client.get('/api/portfolio/settings', headers=auth_header)
+    analytics = json.loads(response.data)['analytics']
+    assert analytics['total_views'] == 4
+    assert analytics['daily'][-1]['views'] == 4
+    assert analytics['top_referrers'] == [{'referrer': 'www.linkedin.com', 'views': 2}]
+
+def test_authenticated_user_cache(client, auth_header, app):
+    """Test token requests reuse the cached user row and see profile updates"""
+    from sqlalchemy import event
+    
+    client.get('/api/auth/user', headers=auth_header)
+    
+    statements = []
+    def record(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+    with app.app_context():
+        engine = db.engine
+    event.listen(engine, 'before_cursor_execute', record)
+    try:
+        response = client.get('/api/auth/user', headers=auth_header)
+    finally:
+        event.remove(engine, 'before_cursor_execute', record)
+    assert response.status_code == 200
+    assert not [statement for statement in statements if 'FROM user' in statement]
+    
+    client.put('/api/auth/user', headers=auth_header, json={'name': 'Renamed User'})
+    response = client.get('/api/auth/user', headers=auth_header)
+    assert json.loads(response.data)['name'] == 'Renamed User'
+
+def test_token_requests_are_stateless(client, auth_header):
+    """Test bearer token requests don't write the session cookie or fall back to it"""
+    response = client.get('/api/auth/user', headers=auth_header)
+    assert response.status_code == 200
+    assert 'Set-Cookie' not in response.headers
+    
+    # The login route left a session cookie behind; a bad token must not use it
+    response = client.get('/api/auth/user', headers={'Authorization': 'Bearer not-a-token'})
+    assert response.status_code == 401
+    
+    response = client.get('/api/auth/user')
+    assert response.status_code == 200
+
+def test_refresh_token_rotation_and_revocation(client, app):
+    """Test refresh tokens rotate, reuse ends the session, and logout revokes access at once"""
+    response = client.post('/api/auth/login', json={'username': 'testuser', 'password': 'password123'})
+    tokens = json.loads(response.data)
+    assert tokens['expires_in'] == 15 * 60
+    
+    response = client.post('/api/auth/refresh', json={'refresh_token': tokens['refresh_token']})
+    assert response.status_code == 200
+    rotated = json.loads(response.data)
+    assert rotated['refresh_token'] != tokens['refresh_token']
+    assert client.get('/api/auth/user', headers={'Authorization': f"Bearer {rotated['token']}"}).status_code == 200
+    
+    # Another tab refreshing with the same token right away gets the same successor
+    response = client.post('/api/auth/refresh', json={'refresh_token': tokens['refresh_token']})
+    assert response.status_code == 200
+    repeated = json.loads(response.data)
+    assert repeated['refresh_token'] == rotated['refresh_token']
+    assert 0 < repeated['expires_in'] <= 15 * 60
+    assert client.get('/api/auth/user', headers={'Authorization': f"Bearer {repeated['token']}"}).status_code == 200
+    
+    # Replaying the old refresh token after the grace window revokes the whole session
+    from datetime import timedelta
+    from models.auth_token import RefreshToken
+    with app.app_context():
+        RefreshToken.query.filter(RefreshToken.revoked_at.isnot(None)).update(
+            {RefreshToken.revoked_at: datetime.utcnow() - timedelta(minutes=1)}, synchronize_session=False
+        )
+        db.session.commit()
+    response = client.post('/api/auth/refresh', json={'refresh_token': tokens['refresh_token']})
+    assert response.status_code == 401
+    assert client.get('/api/auth/user', headers={'Authorization': f"Bearer {rotated['token']}"}).status_code == 401
+    assert client.post('/api/auth/refresh', json={'refresh_token': rotated['refresh_token']}).status_code == 401
+    
+    response = client.post('/api/auth/login', json={'username': 'testuser', 'password': 'password123'})
+    header = {'Authorization': f"Bearer {json.loads(response.data)['token']}"}
+    client.post('/api/auth/logout', headers=header)
+    assert client.get('/api/auth/user', headers=header).status_code == 401
+    
+    # Revocations are rebuilt from the database, e.g. in a freshly started worker
+    token_revocation.clear()
+    assert client.get('/api/auth/user', headers=header).status_code == 401
+    
+    # A rolled back revocation never takes effect in memory
+    from models.auth_token import RevokedToken
+    expires_at = datetime.utcnow() + timedelta(minutes=5)
+    with app.app_context():
+        token_revocation.revoke('rolled-back', expires_at)
+        db.session.rollback()
+        assert not token_revocation.is_revoked('rolled-back')
+        
+        # Rows committed out of id order (as with PostgreSQL sequences) are still picked up
+        db.session.add(RevokedToken(id=1000, jti='high-id', expires_at=expires_at))
+        db.session.commit()
+        token_revocation._sync()
+        db.session.add(RevokedToken(id=999, jti='low-id', expires_at=expires_at))
+        db.session.commit()
+        token_revocation._sync()
+        assert token_revocation.is_revoked('high-id') and token_revocation.is_revoked('low-id')
+
+def test_password_change_revokes_sessions(client, auth_header):
+    """Test a password change signs out other sessions and returns new tokens"""
+    response = client.post('/api/auth/login', json={'username': 'testuser', 'password': 'password123'})
+    other = {'Authorization': f"Bearer {json.loads(response.data)['token']}"}
+    
+    response = client.put('/api/auth/user/password', headers=auth_header, json={
+        'current_password': 'password123',
+        'new_password': 'newpassword456'
+    })
+    assert response.status_code == 200
+    fresh = {'Authorization': f"Bearer {json.loads(response.data)['token']}"}
+    
+    assert client.get('/api/auth/user', headers=other).status_code == 401
+    assert client.get('/api/auth/user', headers=auth_header).status_code == 401
+    assert client.get('/api/auth/user', headers=fresh).status_code == 200
+
+def test_login_throttling(client, app, tmp_path):
+    """Test repeated failed logins are throttled before the password is checked"""
+    for _ in range(5):
+        response = client.post('/api/auth/login', json={'username': 'testuser', 'password': 'wrong'})
+        assert response.status_code == 401
+    
+    response = client.post('/api/auth/login', json={'username': 'testuser', 'password': 'password123'})
+    assert response.status_code == 429
+    assert int(response.headers['Retry-After']) > 0
+    
+    # Other usernames are still allowed until the per-IP limit is reached
+    response = client.post('/api/auth/login', json={'username': 'someone', 'password': 'wrong'})
+    assert response.status_code == 401
+    
+    # Behind the proxy, each forwarded client address gets its own bucket
+    attacker = {'X-Forwarded-For': '203.0.113.5'}
+    for number in range(20):
+        response = client.post('/api/auth/login', headers=attacker,
+                               json={'username': f'guess{number}', 'password': 'wrong'})
+        assert response.status_code == 401
+    response = client.post('/api/auth/login', headers=attacker, json={'username': 'guess', 'password': 'wrong'})
+    assert response.status_code == 429
+    response = client.post('/api/auth/login', headers={'X-Forwarded-For': '198.51.100.7'},
+                           json={'username': 'someone', 'password': 'wrong'})
+    assert response.status_code == 401
+    
+    # The file backend shares buckets between workers
+    path = str(tmp_path / 'throttle.json')
+    first = login_throttle.FileBackend(path)
+    second = login_throttle.FileBackend(path)
+    limits = [('user:testuser', 2, 300)]
+    assert first.take(limits, 1000) == 0
+    assert second.take(limits, 1000) == 0
+    assert first.take(limits, 1000) == 150
+    assert second.take(limits, 1150) == 0
+
+def test_api_keys(client, auth_header, app):
+    """Test scoped API keys authenticate requests and can be revoked"""
+    response = client.post('/api/auth/api-keys', headers=auth_header, json={
+        'name': 'Timer integration',
+        'scopes': ['time:write']
+    })
+    assert response.status_code == 201
+    data = json.loads(response.data)
+    key_header = {'Authorization': f"Bearer {data['key']}"}
+    assert data['key'].startswith(f"fl_{data['api_key']['prefix']}_")
+    
+    response = client.post('/api/auth/api-keys', headers=auth_header, json={'name': 'Bad', 'scopes': ['everything']})
+    assert response.status_code == 400
+    
+    # Write scope on time entries only
+    response = client.post('/api/time/', headers=key_header, json={})
+    assert response.status_code == 400
+    assert client.get('/api/time/', headers=key_header).status_code == 403
+    assert client.get('/api/clients/', headers=key_header).status_code == 403
+    assert client.get('/api/auth/api-keys', headers=key_header).status_code == 403
+    assert 'Set-Cookie' not in response.headers
+    
+    wrong_secret = {'Authorization': f"Bearer fl_{data['api_key']['prefix']}_wrong"}
+    assert client.post('/api/time/', headers=wrong_secret, json={}).status_code == 401
+    
+    client.delete(f"/api/auth/api-keys/{data['api_key']['id']}", headers=auth_header)
+    assert client.post('/api/time/', headers=key_header, json={}).status_code == 401
+
+def _collect_aggregates(database_url, upload_dir):
+    """Seed one database and return the results of the aggregate and search endpoints"""
+    from datetime import date
+    from models.time_entry import TimeEntry
+    
+    class DatabaseConfig(TestingConfig):
+        SQLALCHEMY_DATABASE_URI = database_url
+        STATIC_FOLDER = os.path.join(os.path.dirname(upload_dir), 'static')
+        UPLOAD_FOLDER = upload_dir
+        SECRET_KEY = 'test-key'
+    
+    _reset_module_state()
+    app = create_app(DatabaseConfig)
+    with app.app_context():
+        db.drop_all()
+        db.create_all()
+        user = User(username='parity', email='parity@example.com', name='Parity')
+        user.set_password('password123')
+        db.session.add(user)
+        db.session.flush()
+        client_row = Client(user_id=user.id, name='Acme Website Co', email='acme@example.com')
+        db.session.add(client_row)
+        db.session.flush()
+        project = Project(user_id=user.id, client_id=client_row.id, title='Website redesign', status='active')
+        db.session.add(project)
+        db.session.flush()
+        for day, hours, billable in [(1, 2.0, True), (1, 1.5, False), (3, 4.0, True), (9, 0.5, True)]:
+            db.session.add(TimeEntry(project_id=project.id, description=f'Website work {day}',
+                                     date=date(2024, 3, day), hours=hours, billable=billable))
+        for number, status, issue_day, paid_day, amount in [
+            ('P-1', 'paid', 2, 10, 300.0), ('P-2', 'sent', 5, None, 120.0), ('P-3', 'draft', 6, None, 80.0)
+        ]:
+            invoice = Invoice(project_id=project.id, invoice_number=number, status=status,
+                              issue_date=date(2024, 3, issue_day), due_date=date(2024, 3, issue_day + 14),
+                              paid_date=date(2024, 3, paid_day) if paid_day else None)
+            db.session.add(invoice)
+            db.session.flush()
+            db.session.add(InvoiceItem(invoice_id=invoice.id, description='Website build', quantity=2, unit_price=amount / 2))
+        db.session.commit()
+        client_id = client_row.id
+        
+        # Re-indexing a row replaces its entry instead of adding a second one
+        from search_index import index_rows
+        index_rows('client', [client_id])
+        db.session.commit()
+    
+    test_client = app.test_client()
+    response = test_client.post('/api/auth/login', json={'username': 'parity', 'password': 'password123'})
+    header = {'Authorization': f"Bearer {json.loads(response.data)['token']}"}
+    
+    summary = json.loads(test_client.get('/api/time/summary?start_date=2024-03-01&end_date=2024-03-10', headers=header).data)
+    stats = json.loads(test_client.get('/api/invoices/stats', headers=header).data)
+    statement = json.loads(test_client.get(f'/api/clients/{client_id}/statement', headers=header).data)
+    search = json.loads(test_client.get('/api/search?q=websit', headers=header).data)
+    
+    # Nothing may keep using this app's engine once its database is gone
+    with app.app_context():
+        _reset_module_state()
+        db.drop_all()
+        db.engine.dispose()
+    
+    return {
+        'total_hours': summary['total_hours'],
+        'billable_hours': summary['billable_hours'],
+        'hours_by_day': [(day['date'], day['hours']) for day in summary['hours_by_day'] if day['hours']],
+        'total_invoiced': stats['total_invoiced'],
+        'total_paid': stats['total_paid'],
+        'by_status': stats['by_status'],
+        'statement': [(entry['date'], entry['balance']) for entry in statement['entries']],
+        'closing_balance': statement['closing_balance'],
+        'search': sorted((hit['type'], hit['id']) for hit in search['results'])
+    }
+
+def test_aggregates_on_sqlite(tmp_path, upload_dir):
+    """Test the single-pass FILTER aggregates return the expected figures"""
+    results = _collect_aggregates(f"sqlite:///{tmp_path / 'aggregates.db'}", upload_dir)
+    assert results['total_hours'] == 8.0
+    assert results['billable_hours'] == 6.5
+    assert results['hours_by_day'] == [('2024-03-01', 3.5), ('2024-03-03', 4.0), ('2024-03-09', 0.5)]
+    assert results['total_invoiced'] == 500.0
+    assert results['total_paid'] == 300.0
+    assert results['by_status'] == {'draft': 1, 'sent': 1, 'paid': 1, 'overdue': 0}
+    assert results['statement'] == [('2024-03-02', 300.0), ('2024-03-05', 420.0), ('2024-03-10', 120.0)]
+    assert results['closing_balance'] == 120.0
+    assert len(results['search']) == 9
+
+@pytest.mark.skipif(not os.environ.get('TEST_POSTGRES_URL'),
+                    reason='set TEST_POSTGRES_URL to a scratch PostgreSQL database')
+def test_postgresql_parity(tmp_path, upload_dir):
+    """Test PostgreSQL and SQLite return the same results for the same data"""
+    sqlite_results = _collect_aggregates(f"sqlite:///{tmp_path / 'parity.db'}", upload_dir)
+    postgres_results = _collect_aggregates(os.environ['TEST_POSTGRES_URL'], upload_dir)
+    assert postgres_results == sqlite_results
+
+def test_production_server_options(app, client, auth_header, monkeypatch):
+    """Test the gunicorn launcher serves the prebuilt app and flushes buffers on worker exit"""
+    import run
+    import portfolio_analytics
+    from models.portfolio_view import PortfolioViewDaily
+
+    args = run.parse_args(['--env', 'prod', '--workers', '3', '--threads', '4', '--worker-class', 'gthread',
+                           '--no-preload', '--max-requests-jitter', '50'])
+    server = run.ProductionServer(TestingConfig, run.server_options(args), application=app)
+    assert server.load() is app
+    assert server.cfg.workers == 3
+    assert server.cfg.threads == 4
+    assert server.cfg.worker_class_str == 'gthread'
+    assert server.cfg.preload_app is False
+    assert server.cfg.max_requests == 1000
+    assert server.cfg.max_requests_jitter == 50
+    assert server.cfg.address == [('127.0.0.1', 5001)]
+    
+    # Without preload nothing is built until a worker loads the app
+    built = []
+    monkeypatch.setattr(run, 'create_app', lambda config_class: built.append(config_class) or app)
+    lazy_server = run.ProductionServer(TestingConfig, run.server_options(args))
+    assert built == []
+    assert lazy_server.load() is app and lazy_server.load() is app
+    assert built == [TestingConfig]
+    
+    # A worker's buffered portfolio views reach the database when it exits
+    portfolio_analytics.shutdown_portfolio_analytics()
+    client.get('/api/portfolio/testuser')
+    assert sum(portfolio_analytics._pending.values()) > 0
+    server.cfg.worker_exit(None, type('Worker', (), {'pid': 0})())
+    assert not portfolio_analytics._pending
+    assert db.session.query(db.func.sum(PortfolioViewDaily.views)).scalar() >= 1
@@ -0,0 +1,77 @@
+import os
+import shutil
+import logging
+import tempfile
+import threading
+import subprocess
+
+from PIL import Image, ImageOps
+
+from background import submit
+
+# Thumbnails are generated off the request thread and cached on disk next
+# to the stored file, so the same content is only ever rendered once.
+
+THUMBNAIL_SIZE = (320, 320)
+IMAGE_TYPES = {'png', 'jpg', 'jpeg', 'gif'}
+PDF_TYPES = {'pdf'}
+
+def thumbnail_path(file_path):
+    return f"{file_path}.thumb.jpg"
+
+def can_thumbnail(file_type):
+    if file_type in IMAGE_TYPES:
+        return True
+    # PDFs are rasterised with poppler's pdftoppm when it is installed
+    return file_type in PDF_TYPES and shutil.which('pdftoppm') is not None
+
+def _render_pdf_first_page(file_path):
+    """Rasterise the first PDF page to a temporary PNG and open it with Pillow"""
+    with tempfile.TemporaryDirectory() as temp_dir:
+        output_prefix = os.path.join(temp_dir, 'page')
+        subprocess.run(
+            ['pdftoppm', '-png', '-f', '1', '-l', '1', '-singlefile',
+             '-scale-to', str(max(THUMBNAIL_SIZE)), file_path, output_prefix],
+            check=True, timeout=30, capture_output=True
+        )
+        with Image.open(f"{output_prefix}.png") as page:
+            page.load()
+            return page.copy()
+
+def generate_thumbnail(file_path, file_type):
+    """Write a JPEG thumbnail next to file_path; returns its path or None"""
+    target = thumbnail_path(file_path)
+    if os.path.exists(target):
+        return target
+
+    try:
+        if file_type in PDF_TYPES:
+            image = _render_pdf_first_page(file_path)
+        else:
+            with Image.open(file_path) as source:
+                source.seek(0)
+                image = ImageOps.exif_transpose(source)
+                image.load()
+                image = image.copy()
+
+        image.thumbnail(THUMBNAIL_SIZE)
+        if image.mode != 'RGB':
+            background = Image.new('RGB', image.size, (255, 255, 255))
+            rgba = image.convert('RGBA')
+            background.paste(rgba, mask=rgba.getchannel('A'))
+            image = background
+
+        # Write to a temp name first so readers never see a partial file
+        temp_target = f"{target}.{threading.get_ident()}.tmp"
+        image.save(temp_target, 'JPEG', quality=80, optimize=True)
+        os.replace(temp_target, target)
+        return target
+    except Exception as e:
+        logging.warning(f"Thumbnail generation failed for {file_path}: {e}")
+        return None
+
+def schedule_thumbnail(file_path, file_type):
+    """Queue thumbnail generation without blocking the caller"""
+    if not can_thumbnail(file_type) or os.path.exists(thumbnail_path(file_path)):
+        return None
+    return submit(generate_thumbnail, file_path, file_type)
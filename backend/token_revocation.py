@@ -0,0 +1,89 @@
+import time
+import calendar
+import threading
+from datetime import datetime
+
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+from extensions import db
+from models.auth_token import RevokedToken
+
+# Revoked access token ids, kept in memory so validating a token needs no
+# query. Each worker reloads the unexpired rows at most every SYNC_SECONDS
+# to pick up revocations made by other workers. Rows only live as long as
+# the short-lived access tokens they block, so the set stays small, and
+# reloading it does not depend on ids committing in order. Revocations
+# made in this worker apply as soon as their transaction commits. Entries
+# are dropped when the token they block expires.
+
+SYNC_SECONDS = 5
+
+_revoked = {}  # jti -> expiry as a unix timestamp
+_lock = threading.Lock()
+_last_sync = 0.0
+
+def _timestamp(value):
+    return calendar.timegm(value.utctimetuple())
+
+def _prune(now):
+    for jti in [jti for jti, expires in _revoked.items() if expires <= now]:
+        del _revoked[jti]
+
+def _sync():
+    """Load every revocation that has not expired yet"""
+    global _last_sync
+    rows = db.session.query(RevokedToken.jti, RevokedToken.expires_at).filter(
+        RevokedToken.expires_at > datetime.utcnow()
+    ).all()
+    now = time.time()
+    with _lock:
+        for row in rows:
+            _revoked[row.jti] = _timestamp(row.expires_at)
+        _prune(now)
+        _last_sync = time.monotonic()
+
+def is_revoked(jti):
+    if time.monotonic() - _last_sync > SYNC_SECONDS:
+        _sync()
+    with _lock:
+        expires = _revoked.get(jti)
+    return expires is not None and expires > time.time()
+
+def revoke(jti, expires_at):
+    """Revoke an access token until it expires; the caller commits"""
+    if not jti or expires_at <= datetime.utcnow():
+        return
+    # Applied in memory by _after_commit, so a rolled back revocation never is
+    db.session.info.setdefault('revoked_tokens', {})[jti] = _timestamp(expires_at)
+    if not RevokedToken.query.filter_by(jti=jti).first():
+        db.session.add(RevokedToken(jti=jti, expires_at=expires_at))
+    # Rows are only needed until the tokens they block expire
+    RevokedToken.query.filter(RevokedToken.expires_at <= datetime.utcnow()).delete(synchronize_session=False)
+
+def _after_commit(session):
+    revoked = session.info.pop('revoked_tokens', None)
+    if revoked:
+        with _lock:
+            _revoked.update(revoked)
+
+def _after_rollback(session):
+    session.info.pop('revoked_tokens', None)
+
+_listeners_registered = False
+
+def init_token_revocation(app):
+    """Apply revocations in memory once the transaction recording them commits"""
+    global _listeners_registered
+    if _listeners_registered:
+        return
+    event.listen(Session, 'after_commit', _after_commit)
+    event.listen(Session, 'after_rollback', _after_rollback)
+    _listeners_registered = True
+
+def clear():
+    """Forget all in-memory state; the next check reloads from the database"""
+    global _last_sync
+    with _lock:
+        _revoked.clear()
+        _last_sync = 0.0
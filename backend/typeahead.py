@@ -0,0 +1,211 @@
+import re
+import time
+import threading
+from bisect import bisect_left
+from collections import OrderedDict
+from sqlalchemy import func
+
+from extensions import db
+
+# Entries are rebuilt after this many seconds even without an explicit
+# invalidation, which bounds staleness across separate worker processes.
+INDEX_TTL_SECONDS = 60
+
+# Users whose prefix index is kept; the least recently used are dropped
+MAX_INDEX_USERS = 256
+
+_WORD_RE = re.compile(r'[a-z0-9]+')
+
+# Field weights used for ranking: a hit on the name beats company beats email.
+_FIELD_WEIGHTS = {'name': 3, 'company': 2, 'email': 1}
+
+class ClientPrefixIndex:
+    """Sorted (token, field, client_id) array answering prefix queries with bisect"""
+
+    def __init__(self, rows):
+        self.clients = {}
+        entries = []
+        for row in rows:
+            self.clients[row.id] = {
+                'id': row.id,
+                'name': row.name,
+                'company': row.company,
+                'email': row.email
+            }
+            for field in ('name', 'company', 'email'):
+                value = (getattr(row, field) or '').lower()
+                tokens = set(_WORD_RE.findall(value))
+                if field == 'email' and value:
+                    tokens.add(value)
+                for token in tokens:
+                    entries.append((token, field, row.id))
+        entries.sort()
+        self.tokens = [entry[0] for entry in entries]
+        self.entries = entries
+        self.built_at = time.monotonic()
+
+    def _match(self, prefix):
+        """Return {client_id: score} for all tokens starting with prefix"""
+        scores = {}
+        i = bisect_left(self.tokens, prefix)
+        while i < len(self.tokens) and self.tokens[i].startswith(prefix):
+            token, field, client_id = self.entries[i]
+            score = _FIELD_WEIGHTS[field] * (2 if token == prefix else 1)
+            if score > scores.get(client_id, 0):
+                scores[client_id] = score
+            i += 1
+        return scores
+
+    def search(self, query, limit=10):
+        terms = _WORD_RE.findall(query.lower())
+        if not terms:
+            return []
+
+        # Every term must prefix-match some token of the client
+        scores = None
+        for term in terms:
+            matched = self._match(term)
+            if scores is None:
+                scores = matched
+            else:
+                scores = {cid: scores[cid] + s for cid, s in matched.items() if cid in scores}
+            if not scores:
+                return []
+
+        ranked = sorted(
+            scores.items(),
+            key=lambda item: (-item[1], (self.clients[item[0]]['name'] or '').lower())
+        )
+        return [self.clients[client_id] for client_id, _ in ranked[:limit]]
+
+_indexes = OrderedDict()
+_lock = threading.Lock()
+
+# Bumped by every invalidation. An entry built while the generation moved
+# may be stale and is not cached; one counter for all users keeps this
+# bookkeeping as bounded as the caches themselves.
+_generation = 0
+
+def get_client_index(user_id):
+    """Return the prefix index for a user, building it on first use"""
+    with _lock:
+        index = _indexes.get(user_id)
+        if index is not None and time.monotonic() - index.built_at < INDEX_TTL_SECONDS:
+            _indexes.move_to_end(user_id)
+            return index
+        generation = _generation
+
+    from models.client import Client
+    rows = db.session.query(
+        Client.id, Client.name, Client.company, Client.email
+    ).filter(Client.user_id == user_id).all()
+    index = ClientPrefixIndex(rows)
+
+    # Don't cache an index that was invalidated while it was being built
+    with _lock:
+        if _generation == generation:
+            _indexes[user_id] = index
+            _indexes.move_to_end(user_id)
+            while len(_indexes) > MAX_INDEX_USERS:
+                _indexes.popitem(last=False)
+    return index
+
+def invalidate_client_index(user_id):
+    """Drop a user's prefix index after their clients change"""
+    global _generation
+    with _lock:
+        _indexes.pop(user_id, None)
+        _generation += 1
+
+# Time entry description suggestions. Each user's descriptions are loaded
+# with one grouped query and kept in a small LRU of users.
+MAX_SUGGESTION_USERS = 256
+
+class DescriptionSuggestions:
+    """Per-project description frequencies for one user"""
+
+    def __init__(self, rows):
+        # project_id -> {description_lower: [description, count, last_used]}
+        self.projects = {}
+        for row in rows:
+            self.record(row.project_id, row.description, row.last_used, row.uses)
+        self.built_at = time.monotonic()
+
+    def record(self, project_id, description, used_on, count=1):
+        stats = self.projects.setdefault(project_id, {})
+        key = description.strip().lower()
+        entry = stats.get(key)
+        if entry is None:
+            stats[key] = [description.strip(), count, used_on]
+        else:
+            entry[1] += count
+            if used_on and (entry[2] is None or used_on > entry[2]):
+                entry[2] = used_on
+
+    def suggest(self, project_id, query='', limit=10):
+        query = query.strip().lower()
+        stats = self.projects.get(project_id, {})
+        matches = [
+            entry for key, entry in stats.items()
+            if not query or key.startswith(query) or any(
+                word.startswith(query) for word in key.split()
+            )
+        ]
+        matches.sort(key=lambda entry: (-entry[1], -(entry[2].toordinal() if entry[2] else 0)))
+        return [
+            {
+                'description': description,
+                'count': count,
+                'last_used': last_used.isoformat() if last_used else None
+            } for description, count, last_used in matches[:limit]
+        ]
+
+_suggestions = OrderedDict()
+
+def get_description_suggestions(user_id):
+    """Return a user's description frequencies, warming them with one grouped query"""
+    with _lock:
+        entry = _suggestions.get(user_id)
+        if entry is not None and time.monotonic() - entry.built_at < INDEX_TTL_SECONDS:
+            _suggestions.move_to_end(user_id)
+            return entry
+        generation = _generation
+
+    from models.time_entry import TimeEntry
+    from models.project import Project
+    rows = db.session.query(
+        TimeEntry.project_id,
+        TimeEntry.description,
+        func.count(TimeEntry.id).label('uses'),
+        func.max(TimeEntry.date).label('last_used')
+    ).join(Project).filter(
+        Project.user_id == user_id
+    ).group_by(TimeEntry.project_id, TimeEntry.description).all()
+    entry = DescriptionSuggestions(rows)
+
+    with _lock:
+        if _generation == generation:
+            _suggestions[user_id] = entry
+            _suggestions.move_to_end(user_id)
+            while len(_suggestions) > MAX_SUGGESTION_USERS:
+                _suggestions.popitem(last=False)
+    return entry
+
+def record_description(user_id, project_id, description, used_on):
+    """Count a newly logged description if the user's suggestions are loaded"""
+    with _lock:
+        entry = _suggestions.get(user_id)
+        if entry is not None:
+            entry.record(project_id, description, used_on)
+
+def invalidate_description_suggestions(user_id):
+    """Drop a user's suggestions after time entries are edited or removed"""
+    global _generation
+    with _lock:
+        _suggestions.pop(user_id, None)
+        _generation += 1
+
+def clear():
+    with _lock:
+        _indexes.clear()
+        _suggestions.clear()
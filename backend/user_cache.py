@@ -0,0 +1,54 @@
+import time
+import threading
+from collections import OrderedDict
+from sqlalchemy.orm import make_transient_to_detached
+
+from extensions import db
+
+# Column values of recently authenticated users, so a request with a valid
+# token can attach its user to the session without a SELECT. Routes that
+# change a user's row call invalidate_user after committing; the TTL bounds
+# how long other workers can see an old row.
+
+MAX_ENTRIES = 512
+TTL_SECONDS = 30
+
+_entries = OrderedDict()
+_lock = threading.Lock()
+
+def _columns(user):
+    return {attr.key: getattr(user, attr.key) for attr in user.__mapper__.column_attrs}
+
+def get_user(user_id):
+    """Return the user attached to the current session, or None if it doesn't exist"""
+    from models.user import User
+    
+    with _lock:
+        entry = _entries.get(user_id)
+        if entry is not None and time.monotonic() - entry[1] > TTL_SECONDS:
+            del _entries[user_id]
+            entry = None
+        if entry is not None:
+            _entries.move_to_end(user_id)
+    
+    if entry is not None:
+        user = User(**entry[0])
+        make_transient_to_detached(user)
+        return db.session.merge(user, load=False)
+    
+    user = db.session.get(User, user_id)
+    if user is not None:
+        with _lock:
+            _entries[user_id] = (_columns(user), time.monotonic())
+            _entries.move_to_end(user_id)
+            while len(_entries) > MAX_ENTRIES:
+                _entries.popitem(last=False)
+    return user
+
+def invalidate_user(user_id):
+    with _lock:
+        _entries.pop(user_id, None)
+
+def clear():
+    with _lock:
+        _entries.clear()
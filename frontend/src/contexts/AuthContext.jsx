@@ -27,6 +27,69 @@ export const AuthProvider = ({ children }) => {
     }
   }, [token]);
 
+  const storeTokens = ({ token: newToken, refresh_token: refreshToken }) => {
+    localStorage.setItem('token', newToken);
+    localStorage.setItem('refreshToken', refreshToken);
+    axios.defaults.headers.common['Authorization'] = `Bearer ${newToken}`;
+    setToken(newToken);
+  };
+
+  // Access tokens expire after a few minutes: on a 401, swap the refresh
+  // token for a new pair once and retry the request
+  useEffect(() => {
+    let refreshing = null;
+    const interceptor = axios.interceptors.response.use(
+      (response) => response,
+      async (error) => {
+        const original = error.config;
+        const refreshToken = localStorage.getItem('refreshToken');
+        if (
+          error.response?.status !== 401 ||
+          !refreshToken ||
+          original._retried ||
+          original.url === '/api/auth/refresh'
+        ) {
+          throw error;
+        }
+        original._retried = true;
+        try {
+          refreshing = refreshing || axios.post('/api/auth/refresh', { refresh_token: refreshToken });
+          const response = await refreshing;
+          storeTokens(response.data);
+          original.headers['Authorization'] = `Bearer ${response.data.token}`;
+          return axios(original);
+        } catch (refreshError) {
+          localStorage.removeItem('token');
+          localStorage.removeItem('refreshToken');
+          setToken(null);
+          setCurrentUser(null);
+          throw error;
+        } finally {
+          refreshing = null;
+        }
+      }
+    );
+    return () => axios.interceptors.response.eject(interceptor);
+  }, []);
+
+  // Tabs share the tokens in localStorage: pick up a pair another tab
+  // stored, so this tab doesn't refresh with the token it just replaced
+  useEffect(() => {
+    const handleStorage = (event) => {
+      if (event.key !== 'token') {
+        return;
+      }
+      if (event.newValue) {
+        axios.defaults.headers.common['Authorization'] = `Bearer ${event.newValue}`;
+      } else {
+        setCurrentUser(null); // Logged out in another tab
+      }
+      setToken(event.newValue);
+    };
+    window.addEventListener('storage', handleStorage);
+    return () => window.removeEventListener('storage', handleStorage);
+  }, []);
+
   useEffect(() => {
     const fetchUser = async () => {
       if (token) {
@@ -48,9 +111,8 @@ export const AuthProvider = ({ children }) => {
     try {
       await logout(); // Clear previous state
       const response = await axios.post('/api/auth/login', { username, password });
-      const { token: newToken, user } = response.data;
-      localStorage.setItem('token', newToken);
-      setToken(newToken);
+      const { user } = response.data;
+      storeTokens(response.data);
       setCurrentUser(user);
       console.log('Logged in user:', user);
       return user;
@@ -63,9 +125,8 @@ export const AuthProvider = ({ children }) => {
   const register = async (userData) => {
     try {
       const response = await axios.post('/api/auth/register', userData);
-      const { token: newToken, user } = response.data;
-      localStorage.setItem('token', newToken);
-      setToken(newToken);
+      const { user } = response.data;
+      storeTokens(response.data);
       setCurrentUser(user);
       console.log('Registered user:', user);
       return user;
@@ -83,6 +144,7 @@ export const AuthProvider = ({ children }) => {
       console.error('Logout request failed', error);
     }
     localStorage.removeItem('token');
+    localStorage.removeItem('refreshToken');
     setToken(null);
     setCurrentUser(null);
   };
@@ -106,6 +168,7 @@ export const AuthProvider = ({ children }) => {
     register,
     logout,
     updateProfile,
+    storeTokens,
   };
 
   return (
@@ -9,7 +9,7 @@ import {
 } from 'react-icons/fi';
 
 const Settings = () => {
-  const { currentUser, updateProfile } = useAuth();
+  const { currentUser, updateProfile, storeTokens } = useAuth();
   const [activeTab, setActiveTab] = useState('profile');
   const [profileSuccess, setProfileSuccess] = useState('');
   const [passwordSuccess, setPasswordSuccess] = useState('');
@@ -114,10 +114,12 @@ const Settings = () => {
         setPasswordError('');
         setPasswordSuccess('');
         
-        await axios.put('/api/auth/user/password', {
+        const response = await axios.put('/api/auth/user/password', {
           current_password: values.current_password,
           new_password: values.new_password,
         }, { headers: { 'Cache-Control': 'no-cache' } });
+        // Other sessions are signed out; keep this one with the new tokens
+        storeTokens(response.data);
         
         setPasswordSuccess('Password updated successfully');
         passwordFormik.resetForm();